@@ -0,0 +1,84 @@
+# account_numbers.py
+"""
+Collision-free account number allocation.
+
+Numbers come from a single counter document in `counters`. Instead of one
+round trip per account, each process leases a block of `block_size`
+sequence values with one atomic $inc and hands them out locally. Blocks are
+never shared, so two workers can not allocate the same number; the unique
+index on accounts.account_number (indexes.py) is the backstop for numbers
+issued by the old random generator.
+
+An account number is the zero-padded sequence value followed by a Luhn
+check digit, which catches single-digit typos and most transpositions of an
+issued number. The API does not reject numbers that fail it:
+legacy random numbers have the same 10-digit format and mostly fail the
+check, and beneficiaries may hold accounts at other banks, so
+add_beneficiary still looks every number up. is_valid_account_number is for
+callers that know a number was issued here (e.g. the allocator benchmark).
+"""
+import os
+import threading
+
+from pymongo import ReturnDocument
+
+COUNTER_ID = "account_number"
+
+
+def luhn_check_digit(digits):
+    """Check digit that makes `digits` + digit pass the Luhn test."""
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_account_number(number):
+    number = str(number)
+    return number.isdigit() and len(number) > 1 and luhn_check_digit(number[:-1]) == number[-1]
+
+
+class AccountNumberAllocator:
+    def __init__(self, db, block_size=100, start=100000000, width=9):
+        """
+        `start` is the first sequence value and `width` the number of digits
+        before the check digit (9 + 1 keeps the 10-digit format).
+        """
+        self.db = db
+        self.block_size = block_size
+        self.start = start
+        self.width = width
+        self._lock = threading.Lock()
+        self._pid = None
+        self._seeded = False
+        self._next = 0
+        self._end = 0
+
+    def allocate(self):
+        with self._lock:
+            # A block leased before a fork would be handed out by every child
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._lease()
+            value = self._next
+            self._next += 1
+        base = str(value).zfill(self.width)
+        return base + luhn_check_digit(base)
+
+    def _lease(self):
+        if not self._seeded:
+            # Idempotent and never moves the counter backwards
+            self.db.counters.update_one({"_id": COUNTER_ID}, {"$max": {"next": self.start}}, upsert=True)
+            self._seeded = True
+        counter = self.db.counters.find_one_and_update(
+            {"_id": COUNTER_ID},
+            {"$inc": {"next": self.block_size}},
+            return_document=ReturnDocument.AFTER,
+        )
+        self._end = counter["next"]
+        self._next = self._end - self.block_size
+        self._pid = os.getpid()
@@ -1,19 +1,42 @@
 # app.py
+import logging
 import os
-from datetime import datetime, timedelta, UTC
+from datetime import datetime, time, timedelta, timezone, UTC
 from functools import wraps
+from time import perf_counter
 
 from bson import ObjectId
+import click
+import hashlib
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS
 from flask_mail import Mail, Message
-from flask_pymongo import PyMongo
+from pymongo import ReturnDocument
 import jwt
 import secrets
+from werkzeug.http import http_date
 
 # Import your model (assumes models.py defines BankingModel)
 from models import BankingModel
+from hashing import HasherBusy, PasswordHasher
+from balances import make_balance_cache
+from batches import TransferBatches, parse_csv
+from cache import TTLCache
+from connections import MongoConnections
+from directory import BeneficiaryDirectory
+from events import EventHub, format_event
+from archive import TransactionArchive
+from indexes import audit_query_plans, ensure_indexes
+from json_provider import OrjsonProvider
+from journal import Backfill
+from mailer import MailDispatcher, MailQueueFull
+from metrics import RequestMetrics, log_event
+from otp_store import OTP_MISMATCH, make_otp_store
+from ratelimit import make_rate_limiter
+from pagination import DEFAULT_PAGE_SIZE
+from statements import StatementGenerator
+from streaming import STREAM_BATCH_SIZE, stream_rows, wants_stream
 
 # Load .env
 load_dotenv()
@@ -21,13 +44,37 @@ load_dotenv()
 # ---------------------- CONFIG ----------------------
 app = Flask(__name__)
 CORS(app)
+# Mongo documents are returned as they come off the cursor; ObjectId, datetime,
+# Decimal128 and bytes are encoded by the provider. "iso" renders datetimes as
+# ISO 8601 (fastest); "http" keeps Flask's RFC 1123 dates
+app.json = OrjsonProvider(app, datetime_format=os.getenv("JSON_DATETIME_FORMAT", "http"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+# Per-request latency, Mongo command and SMTP timings, served on /metrics
+request_metrics = RequestMetrics(server_timing=os.getenv("SERVER_TIMING", "false").lower() == "true")
+# Fraction of successful requests logged; errors and slow requests are always logged
+app.config["REQUEST_LOG_SAMPLE_RATE"] = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", 0.01))
+app.config["SLOW_REQUEST_MS"] = int(os.getenv("SLOW_REQUEST_MS", 1000))
 
 # SECRET for Flask sessions and JWT signing
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", os.getenv("SECRET_KEY", "change-this-in-prod"))
 
 # MongoDB
 app.config["MONGO_URI"] = os.getenv("MONGO_URI", "mongodb://localhost:27017/bank_app")
-mongo = PyMongo(app)
+# Pools are per worker process: size them for one worker's threads
+app.config["MONGO_MAX_POOL_SIZE"] = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+app.config["MONGO_MIN_POOL_SIZE"] = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+# 0 leaves idle connections open / waits for a free connection indefinitely
+app.config["MONGO_MAX_IDLE_TIME_MS"] = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 0))
+app.config["MONGO_WAIT_QUEUE_TIMEOUT_MS"] = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 0))
+app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"] = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000))
+app.config["MONGO_CONNECT_TIMEOUT_MS"] = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 20000))
+# Read-only listings (balance, accounts, transactions, beneficiaries) can be served
+# by secondaries, e.g. "secondaryPreferred" with a staleness bound of at least 90s
+app.config["MONGO_READ_PREFERENCE"] = os.getenv("MONGO_READ_PREFERENCE", "primary")
+app.config["MONGO_MAX_STALENESS_SECONDS"] = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", -1))
+# One client per worker process, created on first use after the fork
+mongo = MongoConnections.from_config(app.config, event_listeners=[request_metrics.command_listener()])
 
 # Mail configuration — ensure these env vars are set in your .env
 app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER", "smtp.gmail.com")
@@ -38,15 +85,143 @@ app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")            # e.g. offic
 app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")            # app password (DO NOT store real password in repo)
 app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_DEFAULT_SENDER", app.config["MAIL_USERNAME"])
 
+# Skip the credential check when relaying through a local stand-in SMTP server
+app.config["MAIL_REQUIRE_AUTH"] = os.getenv("MAIL_REQUIRE_AUTH", "true").lower() == "true"
+# Hand OTP mail to a background dispatcher instead of sending on the request thread
+app.config["MAIL_ASYNC"] = os.getenv("MAIL_ASYNC", "true").lower() == "true"
+
 mail = Mail(app)
+mail_dispatcher = MailDispatcher.from_config(
+    app.config,
+    workers=int(os.getenv("MAIL_WORKERS", 2)),
+    queue_size=int(os.getenv("MAIL_QUEUE_SIZE", 1000)),
+    batch_size=int(os.getenv("MAIL_BATCH_SIZE", 20)),
+    max_retries=int(os.getenv("MAIL_MAX_RETRIES", 3)),
+    on_status=lambda job_id, status: _record_mail_status(job_id, status),
+    on_send=lambda seconds: request_metrics.observe_smtp("dispatcher", seconds)
+)
+
+# Worker processes serving the app (gunicorn and uvicorn read the same variable).
+# Backends that keep their state in one process refuse to run with more than one.
+app.config["WEB_CONCURRENCY"] = int(os.getenv("WEB_CONCURRENCY", 1))
+
+
+def _single_process_only(setting, value):
+    if app.config["WEB_CONCURRENCY"] > 1:
+        raise RuntimeError(f"{setting}={value} only sees this process; "
+                           f"it cannot serve WEB_CONCURRENCY={app.config['WEB_CONCURRENCY']} workers")
+
+
+# Per-user balance/account snapshots kept current by every transfer; "mongo"
+# shares them across workers, "off" reads accounts directly. "memory" keeps them
+# per process and misses other workers' transfers (stale balances and 304s), so
+# it is only allowed with a single worker.
+balance_cache_backend = os.getenv("BALANCE_CACHE", "mongo")
+if balance_cache_backend == "memory":
+    _single_process_only("BALANCE_CACHE", balance_cache_backend)
+balance_cache = make_balance_cache(
+    balance_cache_backend,
+    mongo.db,
+    ttl=int(os.getenv("BALANCE_CACHE_TTL_SECONDS", 30))
+)
+# Longest a client may long-poll /api/user/balance or /api/user/accounts for a change
+app.config["BALANCE_LONG_POLL_MAX_SECONDS"] = int(os.getenv("BALANCE_LONG_POLL_MAX_SECONDS", 25))
 
 # Initialize model (BankingModel should accept the db object)
-bank_model = BankingModel(mongo.db)
+# Multi-document transactions need a replica set; leave off for a standalone mongod
+bank_model = BankingModel(
+    mongo.db,
+    use_transactions=os.getenv("MONGO_USE_TRANSACTIONS", "false").lower() == "true",
+    account_number_block_size=int(os.getenv("ACCOUNT_NUMBER_BLOCK_SIZE", 100)),
+    hasher=PasswordHasher(
+        algorithm=os.getenv("PASSWORD_HASH_ALGORITHM", "bcrypt"),
+        rounds=int(os.getenv("PASSWORD_HASH_ROUNDS", 12)),
+        workers=int(os.getenv("PASSWORD_HASH_WORKERS", 2)),
+        max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", 8))
+    ),
+    user_cache=TTLCache(
+        maxsize=int(os.getenv("USER_CACHE_SIZE", 10000)),
+        ttl=int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+    ),
+    balance_cache=balance_cache,
+    read_db=mongo.read_db,
+    # `flask archive-transactions` moves journal rows older than this into monthly archive collections
+    # Each worker caches the archive watermark and months this long (archiving waits it out)
+    archive=TransactionArchive(mongo.db, hot_days=int(os.getenv("TRANSACTIONS_HOT_DAYS", 365)),
+                               state_ttl=int(os.getenv("ARCHIVE_STATE_TTL_SECONDS", 5)))
+)
+
+# Server-sent events: per-user streams of new transactions and balances, fed by
+# this worker's transfers ("local") or a change stream on transactions
+# ("changestream", the default with more than one worker; needs a replica set)
+events_source = os.getenv("EVENTS_SOURCE", "local" if app.config["WEB_CONCURRENCY"] == 1 else "changestream")
+if events_source == "local":
+    _single_process_only("EVENTS_SOURCE", events_source)
+event_hub = EventHub(
+    mongo.db,
+    source=events_source,
+    max_streams=int(os.getenv("EVENTS_MAX_STREAMS", 1000)),
+    max_pending=int(os.getenv("EVENTS_MAX_PENDING", 100))
+)
+if event_hub.source == "local":
+    bank_model.transfers.add_listener(event_hub.record)
+    bank_model.ledger.add_listener(event_hub.record)
+app.config["EVENTS_HEARTBEAT_SECONDS"] = int(os.getenv("EVENTS_HEARTBEAT_SECONDS", 15))
+# EventSource cannot send headers: browsers connect with a short-lived, events-only ticket
+app.config["EVENTS_TICKET_TTL_SECONDS"] = int(os.getenv("EVENTS_TICKET_TTL_SECONDS", 3600))
+
+# OTPs live in Mongo by default; "memory" keeps them in this process (single worker only)
+otp_store = make_otp_store(os.getenv("OTP_STORE", "mongo"), mongo.db)
+
+# Throttle auth, OTP and transfer endpoints; "mongo" shares the counters across workers
+rate_limiter = make_rate_limiter(os.getenv("RATE_LIMIT_BACKEND", "memory"), mongo.db)
+app.config["RATE_LIMIT_ENABLED"] = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Key per-IP limits on the client address from X-Forwarded-For (only behind a trusted proxy)
+app.config["RATE_LIMIT_TRUST_PROXY"] = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+# Deduplicated directory of verified payee accounts, and a short-lived per-user
+# cache of GET /api/beneficiaries responses (served with ETags)
+beneficiary_directory = BeneficiaryDirectory(mongo.db)
+beneficiary_cache = TTLCache(
+    maxsize=int(os.getenv("BENEFICIARY_CACHE_SIZE", 10000)),
+    ttl=int(os.getenv("BENEFICIARY_CACHE_TTL_SECONDS", 10))
+)
+
+# Bulk (payroll) transfers, approved with one OTP and paid in chunked bulk writes
+transfer_batches = TransferBatches(
+    mongo.db,
+    bank_model.transfers,
+    max_items=int(os.getenv("TRANSFER_BATCH_MAX_ITEMS", 10000)),
+    chunk_size=int(os.getenv("TRANSFER_BATCH_CHUNK_SIZE", 500))
+)
+
+# Statements are written to local disk by background workers
+statement_generator = StatementGenerator(
+    mongo.db,
+    output_dir=os.getenv("STATEMENT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "statements")),
+    workers=int(os.getenv("STATEMENT_WORKERS", 2)),
+    batch_size=int(os.getenv("STATEMENT_BATCH_SIZE", 1000)),
+    retention_hours=int(os.getenv("STATEMENT_RETENTION_HOURS", 24)),
+    ledger=bank_model.ledger,
+    archive=bank_model.archive
+)
+
+# Build the indexes every query relies on (set MONGO_BOOTSTRAP_INDEXES=false to skip)
+if os.getenv("MONGO_BOOTSTRAP_INDEXES", "true").lower() == "true":
+    try:
+        for collection, error in ensure_indexes(mongo.db):
+            app.logger.warning("Index on %s not created: %s", collection, error)
+    except Exception as e:
+        app.logger.warning("Index bootstrap skipped: %s", e)
 
 # JWT settings
 JWT_SECRET = app.config["SECRET_KEY"]
 JWT_ALGORITHM = "HS256"
 JWT_EXP_DELTA_HOURS = int(os.getenv("JWT_EXP_HOURS", 168))  # default 7 days
+# Embed the public user record in the JWT and trust it on GET requests, so read-only
+# endpoints authenticate without touching Mongo. Profile changes and deleted users
+# are only picked up when the token is reissued.
+JWT_TRUST_CLAIMS = os.getenv("JWT_TRUST_CLAIMS", "false").lower() == "true"
 
 
 # ---------------------- HELPERS ----------------------
@@ -55,75 +230,81 @@ def _generate_numeric_otp(length: int = 6) -> str:
     return "".join(secrets.choice(digits) for _ in range(length))
 
 
-def _send_otp_email(to_email: str, subject: str, body: str):
-    if not app.config.get("MAIL_USERNAME") or not app.config.get("MAIL_PASSWORD"):
+def _send_otp_email(to_email: str, subject: str, body: str, job_id: str = None):
+    """
+    Queue the OTP mail on the background dispatcher and return its delivery id,
+    or send it inline (returning None) when MAIL_ASYNC is off.
+    """
+    if app.config["MAIL_REQUIRE_AUTH"] and (not app.config.get("MAIL_USERNAME") or not app.config.get("MAIL_PASSWORD")):
         raise RuntimeError("Mail credentials not configured")
+    started = perf_counter()
+    if app.config["MAIL_ASYNC"]:
+        try:
+            return mail_dispatcher.submit(to_email, subject, body, job_id=job_id)
+        finally:
+            request_metrics.observe_smtp("enqueue", perf_counter() - started)
     msg = Message(subject=subject, recipients=[to_email], body=body)
-    mail.send(msg)
+    try:
+        mail.send(msg)
+    finally:
+        request_metrics.observe_smtp("inline", perf_counter() - started)
+    return None
+
+
+def _record_mail_status(job_id: str, status: dict):
+    """Store dispatcher status on the OTP record so any worker can answer a poll."""
+    otp_store.set_delivery(job_id, status)
 
 
 def _store_otp(email: str, purpose: str, metadata: dict = None, ttl_minutes: int = 10):
     """
-    Store an OTP document in mongo.otps collection.
-    Returns the inserted record (including ObjectId _id).
+    Store a new OTP in the configured OTP store.
+    Returns the stored record (including ObjectId _id).
     """
-    code = _generate_numeric_otp(6)
-    record = {
-        "email": email,
-        "purpose": purpose,
-        "code": code,
-        "metadata": metadata or {},
-        "expires_at": datetime.now(UTC) + timedelta(minutes=ttl_minutes),
-        "attempts": 0,
-        "created_at": datetime.now(UTC),
-    }
-    res = mongo.db.otps.insert_one(record)
-    record["_id"] = res.inserted_id  # keep as ObjectId
-    return record
-
+    return otp_store.create(_generate_numeric_otp(6), email, purpose, metadata, ttl_minutes)
 
-from datetime import datetime, UTC
 
-def _verify_and_consume_otp(email: str, purpose: str, code: str):
+def _verify_and_consume_otp(email: str, purpose: str, code: str, metadata: dict = None):
     """
-    Find the most recent OTP for (email, purpose). Verify and consume (delete) on success.
+    Atomically consume the live OTP for (email, purpose) if the code and the
+    given metadata (e.g. the pending transfer it was issued for) match.
     Returns (True, record) on success, or (False, reason) on failure.
     """
-    record = mongo.db.otps.find_one(
-        {"email": email, "purpose": purpose},
-        sort=[("created_at", -1)]
-    )
-    if not record:
-        return False, "OTP not found"
+    return otp_store.verify(email, purpose, code, metadata)
 
-    # --- Check expiry safely ---
-    expires_at = record.get("expires_at")
-    if not expires_at:
-        return False, "Invalid OTP record (no expiry date)"
 
-    # Normalize timezone handling
-    now_utc = datetime.now(UTC)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=UTC)
+def _busy_response():
+    """429 for requests shed because the password hasher is saturated."""
+    response = jsonify({"error": "Server busy, please retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 429
 
-    if now_utc > expires_at:
-        # Delete expired record
-        mongo.db.otps.delete_one({"_id": record["_id"]})
-        return False, "OTP expired"
 
-    # --- Check attempt limits ---
-    if record.get("attempts", 0) >= 5:
-        mongo.db.otps.delete_one({"_id": record["_id"]})
-        return False, "Too many attempts"
+def _etag_body(payload) -> tuple:
+    """Serialize a JSON payload once and return (body, ETag value)."""
+    body = app.json.encoder.encode(payload)
+    return body, hashlib.sha1(body).hexdigest()
 
-    # --- Check code ---
-    if record.get("code") != code:
-        mongo.db.otps.update_one({"_id": record["_id"]}, {"$inc": {"attempts": 1}})
-        return False, "Invalid OTP"
 
-    # --- Success: consume OTP ---
-    mongo.db.otps.delete_one({"_id": record["_id"]})
-    return True, record
+def _conditional_json(body: bytes, etag: str):
+    """200 with the body, or 304 when the client's If-None-Match already holds this ETag."""
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Let browsers keep the copy but revalidate it on every use
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
+def _await_balance_change(user_id):
+    """
+    Long-poll: with ?since=<version>&wait=<seconds>, hold the request until the
+    user's balance snapshot moves past `since` or the wait runs out.
+    """
+    since = request.args.get("since")
+    wait = request.args.get("wait", type=float)
+    if balance_cache is None or since is None or not wait or wait <= 0:
+        return
+    balance_cache.wait_for_change(user_id, since, min(wait, app.config["BALANCE_LONG_POLL_MAX_SECONDS"]))
 
 
 def _user_doc_to_public(user_doc: dict) -> dict:
@@ -142,9 +323,28 @@ def _user_doc_to_public(user_doc: dict) -> dict:
     return doc
 
 
-def create_jwt_for_user(user_id: str) -> str:
+def _user_claims(user_public: dict) -> dict:
+    """
+    Public user record in a JWT-safe form. Datetimes are rendered the same way
+    jsonify renders them so trusted-claim responses match database ones.
+    """
+    claims = {}
+    for key, value in user_public.items():
+        if key in ("accounts", "beneficiaries"):
+            continue
+        if isinstance(value, datetime):
+            value = http_date(value)
+        elif isinstance(value, ObjectId):
+            value = str(value)
+        claims[key] = value
+    return claims
+
+
+def create_jwt_for_user(user_id: str, user_public: dict = None) -> str:
     exp = datetime.now(UTC) + timedelta(hours=JWT_EXP_DELTA_HOURS)
     payload = {"user_id": user_id, "exp": exp}
+    if JWT_TRUST_CLAIMS and user_public:
+        payload["user"] = _user_claims(user_public)
     token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
     # jwt.encode returns bytes in some pyjwt versions; ensure str
     if isinstance(token, bytes):
@@ -177,23 +377,168 @@ def require_auth(f):
         if not ok:
             return jsonify({"error": result}), 401
         user_id = result.get("user_id")
-        if not user_id:
+        if not user_id or result.get("scope"):
+            # Scoped tokens (event stream tickets) are not API credentials
             return jsonify({"error": "Invalid token payload"}), 401
 
-        # Fetch user from model (assumes BankingModel.get_user_by_id returns (user, status))
+        # Read-only requests can trust the signed claims and skip the lookup entirely
+        claims = result.get("user")
+        if JWT_TRUST_CLAIMS and claims and request.method in ("GET", "HEAD"):
+            request.current_user = claims
+            return f(*args, **kwargs)
+
+        # Fetch the projected user record (cached, see BankingModel.get_public_user)
         try:
-            user, status = bank_model.get_user_by_id(user_id)
+            user, status = bank_model.get_public_user(user_id)
         except Exception:
             return jsonify({"error": "Failed to fetch user"}), 500
         if status != 200 or not user:
             return jsonify({"error": "Invalid or expired token"}), 401
 
-        # Attach to request context
-        request.current_user = _user_doc_to_public(user)
+        # Attach to request context (shared cached record: handlers must not mutate it)
+        request.current_user = user
         return f(*args, **kwargs)
     return decorated_function
 
 
+# ---------------------- RATE LIMIT DECORATOR ----------------------
+def _client_ip() -> str:
+    if app.config["RATE_LIMIT_TRUST_PROXY"] and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or "unknown"
+
+
+def _rate_limit_user() -> str:
+    """The authenticated user, or the email an anonymous request acts on."""
+    user = getattr(request, "current_user", None)
+    if user:
+        return str(user["_id"])
+    email = (request.get_json(silent=True) or {}).get("email")
+    return str(email).strip().lower() if email else None
+
+
+def _rate_limits(name: str, ip: str = None, user: str = None) -> dict:
+    """{"ip": limit, "user": limit} for a named limit, after env overrides."""
+    return {
+        "ip": os.getenv(f"RATE_LIMIT_{name.upper()}_IP", ip),
+        "user": os.getenv(f"RATE_LIMIT_{name.upper()}_USER", user),
+    }
+
+
+def rate_limit(name: str, ip: str = None, user: str = None):
+    """
+    Throttle a route per client IP and/or per user ("N/period" limits, see
+    ratelimit.py). Each limit can be overridden with RATE_LIMIT_<NAME>_IP /
+    RATE_LIMIT_<NAME>_USER. Place it below @require_auth so per-user limits
+    key on the authenticated user.
+    """
+    limits = _rate_limits(name, ip, user)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if app.config["RATE_LIMIT_ENABLED"]:
+                for scope, limit in limits.items():
+                    if not limit:
+                        continue
+                    key = _client_ip() if scope == "ip" else _rate_limit_user()
+                    if key is None:
+                        continue
+                    allowed, retry_after = rate_limiter.check(f"{name}:{scope}", key, limit)
+                    if not allowed:
+                        response = jsonify({"error": "Too many requests, please retry later"})
+                        response.headers["Retry-After"] = str(retry_after)
+                        return response, 429
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# ---------------------- INSTRUMENTATION ----------------------
+@app.before_request
+def _start_request_metrics():
+    request_metrics.start_request()
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    stats = request_metrics.finish_request(request.method, route, response.status_code)
+    if stats is None:
+        return response
+    if request_metrics.server_timing:
+        response.headers["Server-Timing"] = request_metrics.server_timing_header(stats)
+    slow = stats.elapsed * 1000 >= app.config["SLOW_REQUEST_MS"]
+    failed = response.status_code >= 500
+    log_event(
+        app.logger, "request",
+        logging.WARNING if slow or failed else logging.INFO,
+        sample_rate=1.0 if slow or failed else app.config["REQUEST_LOG_SAMPLE_RATE"],
+        method=request.method, route=route, status=response.status_code,
+        duration_ms=round(stats.elapsed * 1000, 1), db_commands=stats.db_count,
+        db_ms=round(stats.db_seconds * 1000, 1), smtp_ms=round(stats.smtp_seconds * 1000, 1)
+    )
+    return response
+
+
+def _component_metrics():
+    mail = dict(mail_dispatcher.stats)
+    limits = rate_limiter.snapshot()
+    return [
+        ("mail_dispatch_total", "counter", "OTP mail dispatcher events",
+         [({"event": event}, count) for event, count in sorted(mail.items())]),
+        ("mail_queue_pending", "gauge", "OTP mails waiting in this worker's queue",
+         [({}, mail_dispatcher.pending())]),
+        ("rate_limit_requests_total", "counter", "Requests checked by the rate limiter",
+         [({"limit": name, "outcome": outcome}, count)
+          for outcome in ("allowed", "limited") for name, count in sorted(limits[outcome].items())]),
+        ("event_streams_open", "gauge", "Server-sent event streams open on this worker",
+         [({}, event_hub.connected())]),
+        ("event_stream_events_total", "counter", "Event hub activity",
+         [({"event": event}, count) for event, count in sorted(event_hub.stats.items())]),
+        *_mongo_pool_metrics(),
+    ]
+
+
+def _mongo_pool_metrics():
+    servers = [({"client": client, "server": server}, stats)
+               for client, pool in sorted(mongo.pool_stats().items()) for server, stats in sorted(pool.items())]
+    return [
+        ("mongo_pool_max_size", "gauge", "Configured connections per server in each of this worker's Mongo pools",
+         [({}, mongo.max_pool_size)]),
+        ("mongo_pool_connections", "gauge", "Connections in this worker's Mongo pools",
+         [({**labels, "state": state}, value) for labels, stats in servers
+          for state, value in (("in_use", stats["in_use"]), ("idle", stats["open"] - stats["in_use"]))]),
+        ("mongo_pool_checkouts_total", "counter", "Connection checkouts from this worker's Mongo pools",
+         [({**labels, "outcome": "ok"}, stats["checkouts"]) for labels, stats in servers] +
+         [({**labels, "outcome": reason}, count) for labels, stats in servers
+          for reason, count in sorted(stats["failures"].items())]),
+        ("mongo_pool_checkout_wait_seconds_total", "counter", "Time spent waiting for a pooled connection",
+         [(labels, round(stats["wait_seconds"], 6)) for labels, stats in servers]),
+        ("mongo_pool_cleared_total", "counter", "Pools cleared after a server error",
+         [(labels, stats["cleared"]) for labels, stats in servers]),
+    ]
+
+
+request_metrics.add_collector(_component_metrics)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Mongo reachability, server roles and this worker's connection pools."""
+    try:
+        result, status = mongo.health()
+        return jsonify(result), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # ---------------------- BASE ROUTE ----------------------
 @app.route("/")
 def index():
@@ -205,12 +550,14 @@ def index():
                 "register": "POST /api/auth/register",
                 "register_initiate": "POST /api/auth/register/initiate",
                 "register_verify": "POST /api/auth/register/verify",
+                "otp_status": "GET /api/otp/status/<delivery_id>",
                 "login": "POST /api/auth/login",
                 "change_password": "POST /api/auth/change_password"
             },
             "user": {
                 "profile": "GET /api/user/profile",
                 "balance": "GET /api/user/balance",
+                "balance_as_of": "GET /api/user/balance/as_of?account_number=&date=YYYY-MM-DD",
                 "accounts": {
                     "list": "GET /api/user/accounts",
                     "create": "POST /api/user/accounts"
@@ -218,12 +565,33 @@ def index():
             },
             "beneficiaries": {
                 "add": "POST /api/beneficiaries",
-                "list": "GET /api/beneficiaries"
+                "list": "GET /api/beneficiaries",
+                "directory": "GET /api/beneficiaries/directory?q=&limit=&cursor="
             },
             "transfer": "POST /api/transfer",
             "transfer_initiate": "POST /api/transfer/initiate",
             "transfer_verify": "POST /api/transfer/verify",
-            "transactions": "GET /api/transactions"
+            "transfer_batch": {
+                "initiate": "POST /api/transfer/batch/initiate (JSON items or CSV upload)",
+                "verify": "POST /api/transfer/batch/verify",
+                "status": "GET /api/transfer/batch/<batch_id>"
+            },
+            "statement": {
+                "initiate": "POST /api/statement/initiate",
+                "verify": "POST /api/statement/verify",
+                "status": "GET /api/statement/<statement_id>",
+                "download": "GET /api/statement/<statement_id>/download"
+            },
+            "analytics_monthly": "GET /api/analytics/monthly?year=&account_number=",
+            "transactions": "GET /api/transactions?limit=&cursor=",
+            "transactions_filter": "GET /api/transactions/filter?limit=&cursor=",
+            "events": {
+                "ticket": "POST /api/events/ticket",
+                "stream": "GET /api/events?ticket= (text/event-stream)"
+            },
+            "rate_limit_stats": "GET /api/ratelimit/stats",
+            "metrics": "GET /metrics",
+            "health": "GET /health"
         }
     })
 
@@ -241,12 +609,15 @@ def register():
         if status == 201:
             return jsonify(_user_doc_to_public(user)), 201
         return jsonify(user), status
+    except HasherBusy:
+        return _busy_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # ---------------------- REGISTRATION WITH OTP ----------------------
 @app.route("/api/auth/register/initiate", methods=["POST"])
+@rate_limit("register_initiate", ip="20/hour", user="5/hour")
 def register_initiate():
     try:
         data = request.get_json() or {}
@@ -268,22 +639,27 @@ def register_initiate():
         )
 
         try:
-            _send_otp_email(
+            delivery_id = _send_otp_email(
                 to_email=data["email"],
                 subject="Your Registration OTP",
-                body=f"Your verification code is {otp_record['code']}. It expires in 10 minutes."
+                body=f"Your verification code is {otp_record['code']}. It expires in 10 minutes.",
+                job_id=str(otp_record["_id"])
             )
+        except MailQueueFull:
+            otp_store.delete(otp_record["_id"])
+            return jsonify({"error": "Mail service busy, please retry shortly"}), 503
         except Exception as e:
             # remove OTP if email sending failed
-            mongo.db.otps.delete_one({"_id": otp_record["_id"]})
+            otp_store.delete(otp_record["_id"])
             return jsonify({"error": "Failed to send OTP email", "detail": str(e)}), 500
 
-        return jsonify({"message": "OTP sent to email"}), 200
+        return jsonify({"message": "OTP sent to email", "delivery_id": delivery_id}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/auth/register/verify", methods=["POST"])
+@rate_limit("register_verify", ip="60/minute", user="10/minute")
 def register_verify():
     try:
         data = request.get_json() or {}
@@ -304,11 +680,34 @@ def register_verify():
         if status == 201:
             return jsonify(_user_doc_to_public(user)), 201
         return jsonify(user), status
+    except HasherBusy:
+        return _busy_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/otp/status/<delivery_id>", methods=["GET"])
+def otp_delivery_status(delivery_id):
+    """Poll the delivery status of an OTP mail queued by an initiate endpoint."""
+    try:
+        status = mail_dispatcher.status(delivery_id)
+        if status is None:
+            status = otp_store.delivery(delivery_id)
+        if status is None:
+            return jsonify({"error": "Unknown delivery id"}), 404
+        return jsonify({"delivery_id": delivery_id, **status}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/ratelimit/stats", methods=["GET"])
+def rate_limit_stats():
+    """Allowed/limited request counters of this worker, per limit."""
+    return jsonify(rate_limiter.snapshot()), 200
+
+
 @app.route("/api/auth/login", methods=["POST"])
+@rate_limit("login", ip="60/minute", user="10/minute")
 def login():
     try:
         data = request.get_json() or {}
@@ -321,10 +720,12 @@ def login():
 
         # create JWT token
         user_public = _user_doc_to_public(user)
-        token = create_jwt_for_user(user_public["_id"])
+        token = create_jwt_for_user(user_public["_id"], user_public)
 
         response = {"user": user_public, "token": token}
         return jsonify(response), 200
+    except HasherBusy:
+        return _busy_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -345,6 +746,8 @@ def change_password():
             new_password
         )
         return jsonify(result), status
+    except HasherBusy:
+        return _busy_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -359,15 +762,45 @@ def get_profile():
 @app.route("/api/user/balance", methods=["GET"])
 @require_auth
 def get_balance():
+    _await_balance_change(request.current_user["_id"])
     result, status = bank_model.get_user_balance(request.current_user["_id"])
-    return jsonify(result), status
+    return _conditional_json(*_etag_body(result))
+
+
+@app.route("/api/user/balance/as_of", methods=["GET"])
+@require_auth
+def get_balance_as_of():
+    try:
+        account_number = request.args.get("account_number")
+        if not account_number or not request.args.get("date"):
+            return jsonify({"error": "account_number and date are required"}), 400
+        try:
+            day = datetime.strptime(request.args["date"], "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+
+        account = mongo.db.accounts.find_one(
+            {"user_id": ObjectId(request.current_user["_id"]), "account_number": account_number},
+            {"_id": 1}
+        )
+        if not account:
+            return jsonify({"error": "Account not found"}), 404
+
+        # Closing balance of `date`: every entry stamped before the next midnight
+        at = datetime.combine(day + timedelta(days=1), time.min, tzinfo=timezone.utc)
+        return jsonify(bank_model.ledger.balance_as_of(account_number, at)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/user/accounts", methods=["GET"])
 @require_auth
 def list_user_accounts():
+    if wants_stream():
+        return stream_rows(bank_model.iter_user_accounts(request.current_user["_id"], STREAM_BATCH_SIZE), "accounts")
+    _await_balance_change(request.current_user["_id"])
     result, status = bank_model.get_user_accounts(request.current_user["_id"])
-    return jsonify(result), status
+    return _conditional_json(*_etag_body(result))
 
 
 @app.route("/api/user/accounts", methods=["POST"])
@@ -444,6 +877,10 @@ def add_beneficiary():
             {"_id": ObjectId(user_id)},
             {"$addToSet": {"beneficiaries": beneficiary_id}}
         )
+        bank_model.invalidate_user(user_id)
+        beneficiary_cache.invalidate(user_id)
+        if verified:
+            beneficiary_directory.record(new_beneficiary)
 
         return jsonify({
             "message": "Beneficiary added successfully",
@@ -460,44 +897,47 @@ def add_beneficiary():
 def get_beneficiaries():
     try:
         user_id = request.current_user["_id"]
+        projection = {"_id": 1, "name": 1, "account_number": 1, "verified": 1, "bank_name": 1}
+
+        if wants_stream():
+            return stream_rows(
+                mongo.read_db.beneficiaries.find({"user_id": user_id}, projection).batch_size(STREAM_BATCH_SIZE),
+                "beneficiaries"
+            )
 
-        # 1. User's own beneficiaries (pending + verified)
-        user_beneficiaries = list(mongo.db.beneficiaries.find(
-            {"user_id": user_id},
-            {"_id": 1, "name": 1, "account_number": 1, "verified": 1, "bank_name": 1}
-        ))
-
-        # 2. Other users' verified beneficiaries
-        other_verified = list(mongo.db.beneficiaries.find(
-            {"user_id": {"$ne": user_id}, "verified": True},
-            {"_id": 1, "name": 1, "account_number": 1, "verified": 1, "bank_name": 1}
-        ))
-
-        # Merge, avoiding duplicates (by account_number)
-        merged = {b["account_number"]: b for b in user_beneficiaries}
-        for b in other_verified:
-            merged[b["account_number"]] = b
-
-        # Convert _id to string
-        response = []
-        for b in merged.values():
-            response.append({
-                "_id": str(b["_id"]),
-                "name": b["name"],
-                "account_number": b["account_number"],
-                "bank_name": b.get("bank_name"),
-                "verified": b.get("verified", False)
-            })
-
-        return jsonify({"beneficiaries": response}), 200
+        # Only the caller's own beneficiaries; other payees are found via /api/beneficiaries/directory
+        cached = beneficiary_cache.get(user_id)
+        if cached is None:
+            # Every beneficiary is written with all five fields: the documents serialize as they are
+            cached = _etag_body({"beneficiaries": list(mongo.read_db.beneficiaries.find({"user_id": user_id}, projection))})
+            beneficiary_cache.set(user_id, cached)
+        return _conditional_json(*cached)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/beneficiaries/directory", methods=["GET"])
+@require_auth
+def beneficiary_directory_search():
+    """Prefix search over verified payee accounts by account number or name."""
+    try:
+        result, status = beneficiary_directory.search(
+            request.args.get("q"),
+            limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get("cursor")
+        )
+        if status != 200:
+            return jsonify(result), status
+        return _conditional_json(*_etag_body(result))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # ---------------------- TRANSFERS (with OTP) ----------------------
 @app.route("/api/transfer/initiate", methods=["POST"])
 @require_auth
+@rate_limit("transfer_initiate", ip="60/minute", user="10/minute")
 def transfer_initiate():
     try:
         data = request.get_json() or {}
@@ -550,23 +990,33 @@ def transfer_initiate():
             ttl_minutes=10
         )
         try:
-            _send_otp_email(
+            delivery_id = _send_otp_email(
                 to_email=user["email"],
                 subject="Your Transfer OTP",
-                body=f"Your transfer OTP is {otp_record['code']}. It expires in 10 minutes."
+                body=f"Your transfer OTP is {otp_record['code']}. It expires in 10 minutes.",
+                job_id=str(otp_record["_id"])
             )
+        except MailQueueFull:
+            mongo.db.pending_transfers.delete_one({"_id": res.inserted_id})
+            otp_store.delete(otp_record["_id"])
+            return jsonify({"error": "Mail service busy, please retry shortly"}), 503
         except Exception as e:
             mongo.db.pending_transfers.delete_one({"_id": res.inserted_id})
-            mongo.db.otps.delete_one({"_id": otp_record["_id"]})
+            otp_store.delete(otp_record["_id"])
             return jsonify({"error": "Failed to send OTP email", "detail": str(e)}), 500
 
-        return jsonify({"message": "OTP sent to email", "pending_transfer_id": pending_id}), 200
+        return jsonify({
+            "message": "OTP sent to email",
+            "pending_transfer_id": pending_id,
+            "delivery_id": delivery_id
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/transfer/verify", methods=["POST"])
 @require_auth
+@rate_limit("transfer_verify", ip="60/minute", user="10/minute")
 def transfer_verify():
     try:
         data = request.get_json() or {}
@@ -576,50 +1026,41 @@ def transfer_verify():
             return jsonify({"error": "pending_transfer_id and otp are required"}), 400
 
         user = request.current_user
-        ok, result = _verify_and_consume_otp(email=user["email"], purpose="transfer", code=code)
+        ok, result = _verify_and_consume_otp(email=user["email"], purpose="transfer", code=code,
+                                             metadata={"pending_transfer_id": pending_id})
         if not ok:
-            return jsonify({"error": result}), 400
+            error = "OTP does not match this transfer" if result == OTP_MISMATCH else result
+            return jsonify({"error": error}), 400
 
-        pending = mongo.db.pending_transfers.find_one({"_id": ObjectId(pending_id), "user_id": user["_id"]})
+        # Claim the pending transfer atomically so it can only ever execute once
+        pending = mongo.db.pending_transfers.find_one_and_delete({"_id": ObjectId(pending_id), "user_id": user["_id"]})
         if not pending:
             return jsonify({"error": "Pending transfer not found"}), 404
 
-        # Perform transfer
-        amount = float(pending["amount"])
-        from_acc = mongo.db.accounts.find_one({
-            "user_id": ObjectId(user["_id"]),
-            "account_number": pending["from_acc_number"]
-        })
-        if not from_acc:
-            return jsonify({"error": "Source account not found"}), 400
-        if float(from_acc.get("balance", 0)) < amount:
-            mongo.db.pending_transfers.delete_one({"_id": ObjectId(pending_id)})
-            return jsonify({"error": "Insufficient balance"}), 400
-
         beneficiary = mongo.db.beneficiaries.find_one({"_id": ObjectId(pending["beneficiary_id"])})
         if not beneficiary:
-            mongo.db.pending_transfers.delete_one({"_id": ObjectId(pending_id)})
             return jsonify({"error": "Beneficiary not found"}), 400
 
-        # debit from source
-        mongo.db.accounts.update_one({"_id": from_acc["_id"]}, {"$inc": {"balance": -amount}})
-
-        # credit to beneficiary account if it exists in accounts collection
-        ben_acc = mongo.db.accounts.find_one({"account_number": beneficiary["account_number"]})
-        if ben_acc:
-            mongo.db.accounts.update_one({"_id": ben_acc["_id"]}, {"$inc": {"balance": amount}})
-
-        # insert transaction record
-        mongo.db.transactions.insert_one({
-            "user_id": user["_id"],
-            "beneficiary_id": beneficiary["_id"],
-            "amount": amount,
-            "transfer_mode": pending["transfer_mode"],
-            "created_at": datetime.now(UTC)
-        })
+        # Perform transfer: conditional debit, credit and journal (see transfers.py)
+        result, status = bank_model.transfers.transfer(
+            source_filter={
+                "user_id": ObjectId(user["_id"]),
+                "account_number": pending["from_acc_number"]
+            },
+            beneficiary=beneficiary,
+            amount=float(pending["amount"]),
+            transfer_mode=pending["transfer_mode"],
+            user_id=user["_id"],
+        )
+        if status != 200:
+            return jsonify(result), status
+        app.logger.info("transfer %s completed in %.1f ms", result["transfer_id"], result["latency_ms"])
 
-        mongo.db.pending_transfers.delete_one({"_id": ObjectId(pending_id)})
-        return jsonify({"message": "Transfer completed successfully"}), 200
+        return jsonify({
+            "message": "Transfer completed successfully",
+            "transfer_id": result["transfer_id"],
+            "latency_ms": result["latency_ms"]
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -628,8 +1069,15 @@ def transfer_verify():
 @app.route("/api/transactions", methods=["GET"])
 @require_auth
 def transactions():
-    limit = request.args.get("limit", 50, type=int)
-    result, status = bank_model.get_transactions(request.current_user["_id"], limit)
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get("cursor")
+    if wants_stream():
+        try:
+            rows = bank_model.iter_transactions(request.current_user["_id"], cursor, STREAM_BATCH_SIZE)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return stream_rows(rows, "transactions", {"next_cursor": None})
+    result, status = bank_model.get_transactions(request.current_user["_id"], limit, cursor)
     return jsonify(result), status
 
 
@@ -637,85 +1085,508 @@ def transactions():
 @require_auth
 def transactions_filter():
     try:
-        user = request.current_user
-        user_id_str = str(user["_id"])
-        user_id_obj = ObjectId(user_id_str) if ObjectId.is_valid(user_id_str) else user_id_str
-
         account_number = request.args.get("account_number")
         ttype = request.args.get("type", "all")  # all, debit, credit
         start_date = request.args.get("start_date")
         end_date = request.args.get("end_date")
 
-        # ✅ Step 1: Find user's account(s)
-        account_query = {"user_id": {"$in": [user_id_str, user_id_obj]}}
-        if account_number:
-            account_query["account_number"] = account_number
-
-        accounts = list(mongo.db.accounts.find(account_query))
-        if not accounts:
-            return jsonify({"transactions": [], "message": "No account found"}), 200
-
-        account_ids = [a["_id"] for a in accounts]
-        print(f"✅ Found user accounts: {[str(a['_id']) for a in accounts]}")
-
-        # ✅ Step 2: Build transaction query
-        q = {
-            "$or": [
-                {"user_account_id": {"$in": account_ids}},
-                {"beneficiary_account_id": {"$in": account_ids}},
-            ]
-        }
-
-        # ✅ Step 3: Date filter
+        start_dt = end_dt = None
         if start_date and end_date:
             try:
                 sdate = datetime.strptime(start_date, "%Y-%m-%d").date()
                 edate = datetime.strptime(end_date, "%Y-%m-%d").date()
                 start_dt = datetime.combine(sdate, time.min, tzinfo=timezone.utc)
                 end_dt = datetime.combine(edate, time.max, tzinfo=timezone.utc)
-                q["timestamp"] = {"$gte": start_dt, "$lte": end_dt}
-                print(f"📅 Date range: {start_dt} → {end_dt}")
             except Exception as e:
-                print(f"⚠️ Invalid date filter: {e}")
+                log_event(app.logger, "invalid_date_filter", logging.WARNING, sample_rate=0.1,
+                          start_date=start_date, end_date=end_date, error=str(e))
+
+        if wants_stream():
+            try:
+                rows = bank_model.iter_filtered_transactions(
+                    request.current_user["_id"],
+                    account_number=account_number,
+                    ttype=ttype,
+                    start=start_dt,
+                    end=end_dt,
+                    cursor=request.args.get("cursor"),
+                    batch_size=STREAM_BATCH_SIZE
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return stream_rows(rows or [], "transactions", {"next_cursor": None})
+
+        # Classification, type and date filtering all run in Mongo (see BankingModel.filter_transactions)
+        result, status = bank_model.filter_transactions(
+            request.current_user["_id"],
+            account_number=account_number,
+            ttype=ttype,
+            start=start_dt,
+            end=end_dt,
+            limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get("cursor")
+        )
+        return jsonify(result), status
+
+    except Exception as e:
+        app.logger.exception("transactions_filter failed")
+        return jsonify({"error": str(e)}), 500
 
-        # ✅ Step 4: Fetch transactions
-        txs = list(mongo.db.transactions.find(q).sort("timestamp", -1))
-        print(f"📊 Found {len(txs)} transactions")
 
-        formatted = []
-        for t in txs:
-            # Convert ObjectId → str
-            t["_id"] = str(t["_id"])
-            if isinstance(t.get("user_account_id"), ObjectId):
-                t["user_account_id"] = str(t["user_account_id"])
-            if isinstance(t.get("beneficiary_account_id"), ObjectId):
-                t["beneficiary_account_id"] = str(t["beneficiary_account_id"])
+# ---------------------- ANALYTICS ----------------------
+@app.route("/api/analytics/monthly", methods=["GET"])
+@require_auth
+def analytics_monthly():
+    try:
+        year = request.args.get("year", datetime.now(UTC).year, type=int)
+        account_number = request.args.get("account_number")
 
-            # Determine debit/credit relative to user's accounts
-            ttype_calc = "credit" if ObjectId(t.get("beneficiary_account_id")) in account_ids else "debit"
-            t["type"] = ttype_calc
+        query = {"user_id": ObjectId(request.current_user["_id"])}
+        if account_number:
+            query["account_number"] = account_number
+        account_numbers = [a["account_number"] for a in mongo.db.accounts.find(query, {"account_number": 1})]
+        if not account_numbers:
+            return jsonify({"error": "Account not found"}), 404
+
+        # Served from monthly_rollups (see rollups.py): at most 12 documents per account
+        monthly = bank_model.rollups.monthly(year, account_numbers)
+        return jsonify({"year": year, "account_number": account_number, "monthly": monthly}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-            # Format timestamp nicely
-            if isinstance(t.get("timestamp"), datetime):
-                t["timestamp"] = t["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
 
-            # Attach the account number for clarity
-            src_acc = next((a for a in accounts if str(a["_id"]) == t.get("user_account_id")), None)
-            ben_acc = next((a for a in accounts if str(a["_id"]) == t.get("beneficiary_account_id")), None)
-            t["account_number"] = src_acc["account_number"] if src_acc else (ben_acc["account_number"] if ben_acc else "-")
+# ---------------------- EVENTS (SSE) ----------------------
+@app.route("/api/events/ticket", methods=["POST"])
+@require_auth
+def events_ticket():
+    """A ticket for GET /api/events?ticket=..., valid only for the event stream."""
+    ttl = app.config["EVENTS_TICKET_TTL_SECONDS"]
+    ticket = jwt.encode(
+        {"user_id": request.current_user["_id"], "scope": "events",
+         "exp": datetime.now(UTC) + timedelta(seconds=ttl)},
+        JWT_SECRET, algorithm=JWT_ALGORITHM
+    )
+    return jsonify({"ticket": ticket, "expires_in": ttl}), 200
 
-            formatted.append(t)
 
-        # ✅ Step 5: Filter by type if needed
-        if ttype in ["credit", "debit"]:
-            formatted = [t for t in formatted if t["type"] == ttype]
+@app.route("/api/events", methods=["GET"])
+def events_stream():
+    """
+    text/event-stream of the caller's new transactions ("transaction") and
+    balances ("balance"). Authenticate with the usual Authorization header or
+    with ?ticket= from /api/events/ticket. Each open stream holds a worker
+    thread here; asgi.py serves the same stream on its event loop.
+    """
+    ticket = request.args.get("ticket")
+    if ticket is None:
+        return require_auth(_open_event_stream)()
+    ok, result = decode_jwt(ticket)
+    if not ok or result.get("scope") != "events" or not result.get("user_id"):
+        return jsonify({"error": "Invalid or expired ticket"}), 401
+    return _open_event_stream(result["user_id"])
+
+
+def _open_event_stream(user_id=None):
+    user_id = user_id or request.current_user["_id"]
+    subscription = event_hub.subscribe(user_id)
+    if subscription is None:
+        response = jsonify({"error": "Too many open event streams, retry shortly"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    last_event_id = request.headers.get("Last-Event-ID")
+    heartbeat = app.config["EVENTS_HEARTBEAT_SECONDS"]
+
+    def balance_frame():
+        # Sent right after a transfer: read the primary, not a lagging secondary
+        result, _ = bank_model.get_user_balance(user_id, fresh=True)
+        return format_event("balance", result)
+
+    def generate():
+        try:
+            yield f"retry: {heartbeat * 1000}\n\n"
+            # Rows written while a reconnecting client was away; the hub may deliver them again
+            replayed = event_hub.replay(user_id, last_event_id) if last_event_id else []
+            for row in replayed:
+                yield format_event("transaction", row, row["_id"])
+            seen = {row["_id"] for row in replayed}
+            yield balance_frame()
+            while True:
+                events, overflowed = subscription.wait(heartbeat)
+                if overflowed:
+                    yield format_event("resync", {"reason": "Too many pending events"})
+                for row in events:
+                    if row["_id"] not in seen:
+                        yield format_event("transaction", row, row["_id"])
+                if events or overflowed:
+                    yield balance_frame()
+                else:
+                    # Keeps proxies from closing the stream and detects gone clients
+                    yield ": keepalive\n\n"
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------------------- BATCH TRANSFERS (with OTP) ----------------------
+@app.route("/api/transfer/batch/initiate", methods=["POST"])
+@require_auth
+@rate_limit("transfer_batch_initiate", ip="30/minute", user="5/minute")
+def transfer_batch_initiate():
+    """
+    Accepts JSON {"from_acc_number", "transfer_mode", "items": [{"beneficiary_id", "amount", "reference"?}]}
+    or a CSV upload (multipart "file" or a text/csv body) with from_acc_number and
+    transfer_mode as form fields or query parameters.
+    """
+    try:
+        if "file" in request.files or request.mimetype == "text/csv":
+            fields = request.form if request.form else request.args
+            upload = request.files.get("file")
+            text = upload.read().decode("utf-8-sig") if upload else request.get_data(as_text=True)
+            try:
+                rows = parse_csv(text)
+            except (ValueError, UnicodeDecodeError) as e:
+                return jsonify({"error": f"Invalid CSV: {e}"}), 400
+        else:
+            fields = request.get_json() or {}
+            rows = fields.get("items")
+            if not isinstance(rows, list):
+                return jsonify({"error": "items must be a list"}), 400
+        for field in ["from_acc_number", "transfer_mode"]:
+            if not fields.get(field):
+                return jsonify({"error": f"{field} is required"}), 400
 
-        return jsonify({"transactions": formatted}), 200
+        user = request.current_user
+        result, status = transfer_batches.prepare(user["_id"], fields["from_acc_number"],
+                                                  fields["transfer_mode"], rows)
+        if status != 201:
+            return jsonify(result), status
+        batch = result["batch"]
 
+        otp_record = _store_otp(
+            email=user["email"],
+            purpose="transfer_batch",
+            metadata={"batch_id": batch["batch_id"], "user_id": user["_id"]},
+            ttl_minutes=10
+        )
+        try:
+            delivery_id = _send_otp_email(
+                to_email=user["email"],
+                subject="Your Batch Transfer OTP",
+                body=(f"Your OTP to approve {batch['count']} transfers totalling {batch['total']} "
+                      f"is {otp_record['code']}. It expires in 10 minutes."),
+                job_id=str(otp_record["_id"])
+            )
+        except MailQueueFull:
+            mongo.db.transfer_batches.delete_one({"_id": ObjectId(batch["batch_id"])})
+            otp_store.delete(otp_record["_id"])
+            return jsonify({"error": "Mail service busy, please retry shortly"}), 503
+        except Exception as e:
+            mongo.db.transfer_batches.delete_one({"_id": ObjectId(batch["batch_id"])})
+            otp_store.delete(otp_record["_id"])
+            return jsonify({"error": "Failed to send OTP email", "detail": str(e)}), 500
+
+        return jsonify({
+            "message": "OTP sent to email",
+            "pending_batch_id": batch["batch_id"],
+            "count": batch["count"],
+            "total": batch["total"],
+            "delivery_id": delivery_id
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/transfer/batch/verify", methods=["POST"])
+@require_auth
+@rate_limit("transfer_batch_verify", ip="60/minute", user="10/minute")
+def transfer_batch_verify():
+    try:
+        data = request.get_json() or {}
+        batch_id = data.get("pending_batch_id")
+        code = data.get("otp")
+        if not batch_id or not code:
+            return jsonify({"error": "pending_batch_id and otp are required"}), 400
+        if not ObjectId.is_valid(batch_id):
+            return jsonify({"error": "Pending batch not found"}), 404
+
+        user = request.current_user
+        ok, result = _verify_and_consume_otp(email=user["email"], purpose="transfer_batch", code=code,
+                                             metadata={"batch_id": batch_id})
+        if not ok:
+            error = "OTP does not match this batch" if result == OTP_MISMATCH else result
+            return jsonify({"error": error}), 400
+
+        started = perf_counter()
+        batch, status = transfer_batches.execute(batch_id, user["_id"])
+        if status == 200:
+            app.logger.info("transfer batch %s: %s in %.1f ms", batch_id, batch["summary"],
+                            (perf_counter() - started) * 1000)
+        return jsonify(batch), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/transfer/batch/<batch_id>", methods=["GET"])
+@require_auth
+def transfer_batch_status(batch_id):
+    try:
+        if not ObjectId.is_valid(batch_id):
+            return jsonify({"error": "Batch not found"}), 404
+        batch, status = transfer_batches.get(batch_id, request.current_user["_id"])
+        return jsonify(batch), status
     except Exception as e:
-        print("❌ Error in /api/transactions/filter:", e)
         return jsonify({"error": str(e)}), 500
+
+
+# ---------------------- STATEMENTS (with OTP) ----------------------
+def _statement_public(job: dict) -> dict:
+    return {
+        "statement_id": str(job["_id"]),
+        "status": job["status"],
+        "account": {"account_number": job["account_number"]},
+        "start_date": job["start_date"],
+        "end_date": job["end_date"],
+        "written": job.get("written", 0),
+        "total": job.get("total"),
+        "opening_balance": job.get("opening_balance"),
+        "closing_balance": job.get("closing_balance"),
+        "error": job.get("error"),
+        "download_url": f"/api/statement/{job['_id']}/download" if job["status"] == "ready" else None
+    }
+
+
+@app.route("/api/statement/initiate", methods=["POST"])
+@require_auth
+@rate_limit("statement_initiate", ip="60/minute", user="10/minute")
+def statement_initiate():
+    try:
+        data = request.get_json() or {}
+        required = ["account_number", "start_date", "end_date"]
+        for field in required:
+            if not data.get(field):
+                return jsonify({"error": f"{field} is required"}), 400
+
+        user = request.current_user
+        try:
+            sdate = datetime.strptime(data["start_date"], "%Y-%m-%d").date()
+            edate = datetime.strptime(data["end_date"], "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+        if edate < sdate:
+            return jsonify({"error": "end_date must not be before start_date"}), 400
+
+        account = mongo.db.accounts.find_one(
+            {"user_id": ObjectId(user["_id"]), "account_number": data["account_number"]},
+            {"_id": 1}
+        )
+        if not account:
+            return jsonify({"error": "Account not found"}), 404
+
+        job = {
+            "user_id": user["_id"],
+            "account_number": data["account_number"],
+            "start_date": data["start_date"],
+            "end_date": data["end_date"],
+            "start": datetime.combine(sdate, time.min, tzinfo=timezone.utc),
+            "end": datetime.combine(edate, time.max, tzinfo=timezone.utc),
+            "status": "pending_otp",
+            "created_at": datetime.now(UTC),
+            # unverified requests are dropped by the TTL index
+            "expires_at": datetime.now(UTC) + timedelta(minutes=15)
+        }
+        res = mongo.db.statements.insert_one(job)
+        statement_id = str(res.inserted_id)
+
+        otp_record = _store_otp(
+            email=user["email"],
+            purpose="statement",
+            metadata={"statement_id": statement_id, "user_id": user["_id"]},
+            ttl_minutes=10
+        )
+        try:
+            delivery_id = _send_otp_email(
+                to_email=user["email"],
+                subject="Your Statement OTP",
+                body=f"Your statement OTP is {otp_record['code']}. It expires in 10 minutes.",
+                job_id=str(otp_record["_id"])
+            )
+        except MailQueueFull:
+            mongo.db.statements.delete_one({"_id": res.inserted_id})
+            otp_store.delete(otp_record["_id"])
+            return jsonify({"error": "Mail service busy, please retry shortly"}), 503
+        except Exception as e:
+            mongo.db.statements.delete_one({"_id": res.inserted_id})
+            otp_store.delete(otp_record["_id"])
+            return jsonify({"error": "Failed to send OTP email", "detail": str(e)}), 500
+
+        return jsonify({
+            "message": "OTP sent to email",
+            "pending_statement_id": statement_id,
+            "delivery_id": delivery_id
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/statement/verify", methods=["POST"])
+@require_auth
+@rate_limit("statement_verify", ip="60/minute", user="10/minute")
+def statement_verify():
+    try:
+        data = request.get_json() or {}
+        statement_id = data.get("pending_statement_id")
+        code = data.get("otp")
+        if not statement_id or not code:
+            return jsonify({"error": "pending_statement_id and otp are required"}), 400
+        if not ObjectId.is_valid(statement_id):
+            return jsonify({"error": "Pending statement not found"}), 404
+
+        user = request.current_user
+        ok, result = _verify_and_consume_otp(email=user["email"], purpose="statement", code=code,
+                                             metadata={"statement_id": statement_id})
+        if not ok:
+            error = "OTP does not match this statement request" if result == OTP_MISMATCH else result
+            return jsonify({"error": error}), 400
+
+        job = mongo.db.statements.find_one_and_update(
+            {"_id": ObjectId(statement_id), "user_id": user["_id"], "status": "pending_otp"},
+            {"$set": {"status": "queued", "queued_at": datetime.now(UTC)}, "$unset": {"expires_at": ""}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return jsonify({"error": "Pending statement not found"}), 404
+
+        statement_generator.submit(statement_id)
+        return jsonify(_statement_public(job)), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/statement/<statement_id>", methods=["GET"])
+@require_auth
+def statement_status(statement_id):
+    if not ObjectId.is_valid(statement_id):
+        return jsonify({"error": "Statement not found"}), 404
+    job = mongo.db.statements.find_one({"_id": ObjectId(statement_id), "user_id": request.current_user["_id"]})
+    if not job:
+        return jsonify({"error": "Statement not found"}), 404
+    return jsonify(_statement_public(job)), 200
+
+
+@app.route("/api/statement/<statement_id>/download", methods=["GET"])
+@require_auth
+def statement_download(statement_id):
+    if not ObjectId.is_valid(statement_id):
+        return jsonify({"error": "Statement not found"}), 404
+    job = mongo.db.statements.find_one({"_id": ObjectId(statement_id), "user_id": request.current_user["_id"]})
+    if not job:
+        return jsonify({"error": "Statement not found"}), 404
+    if job["status"] != "ready":
+        return jsonify({"error": f"Statement is {job['status']}"}), 409
+    path = statement_generator.path_for(statement_id)
+    if not os.path.exists(path):
+        return jsonify({"error": "Statement file expired"}), 410
+    return send_file(
+        path,
+        mimetype="text/csv",
+        as_attachment=True,
+        download_name=f"statement-{job['account_number']}-{job['start_date']}-{job['end_date']}.csv"
+    )
+
+
+# ---------------------- CLI ----------------------
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create every index declared in indexes.py."""
+    failures = ensure_indexes(mongo.db)
+    for collection, error in failures:
+        click.echo(f"{collection}: {error}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo("Indexes up to date")
+
+
+@app.cli.command("rebuild-rollups")
+@click.option("--account", "account_number", default=None, help="Only rebuild this account number")
+def rebuild_rollups_command(account_number):
+    """Recompute monthly analytics rollups from the transaction history."""
+    written = bank_model.rollups.rebuild(account_number=account_number)
+    click.echo(f"Rebuilt {written} monthly rollup documents")
+
+
+@app.cli.command("snapshot-balances")
+def snapshot_balances_command():
+    """Snapshot every account's ledger balance (run periodically, e.g. nightly from cron)."""
+    written = bank_model.ledger.take_snapshots()
+    click.echo(f"Wrote {written} balance snapshots")
+
+
+@app.cli.command("audit-ledger")
+@click.option("--post-adjustments", is_flag=True, help="Journal opening adjustments for mismatched accounts")
+@click.option("--full", is_flag=True, help="Re-read the whole journal instead of starting from the snapshots")
+def audit_ledger_command(post_adjustments, full):
+    """Check every account balance against the journal and every posting for balance."""
+    report = bank_model.ledger.audit(post_adjustments=post_adjustments, full=full)
+    for row in report["mismatched_accounts"]:
+        click.echo(f"{row['account_number']}: balance {row['balance']} journal {row['journal']}", err=True)
+    for transfer_id in report["unbalanced_postings"]:
+        click.echo(f"unbalanced posting {transfer_id}", err=True)
+    if (report["mismatched_accounts"] and not post_adjustments) or report["unbalanced_postings"]:
+        raise SystemExit(1)
+    click.echo("Ledger balanced")
+
+
+@app.cli.command("backfill-transactions")
+@click.option("--batch-size", default=500, show_default=True, help="Documents rewritten per bulk_write")
+@click.option("--max-rate", default=None, type=float, help="Cap on documents rewritten per second")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches (resume later)")
+@click.option("--restart", is_flag=True, help="Forget saved progress and scan from the start")
+def backfill_transactions_command(batch_size, max_rate, max_batches, restart):
+    """Rewrite legacy transaction documents into the journal shape (resumable)."""
+    backfill = Backfill(mongo.db, batch_size=batch_size, max_per_second=max_rate)
+    if restart:
+        backfill.reset()
+    state = backfill.run(max_batches=max_batches)
+    status = "finished" if state.get("finished_at") else f"paused after _id {state['last_id']}"
+    click.echo(f"Rewrote {state['rewritten']} transaction documents ({status})")
+
+
+@app.cli.command("archive-transactions")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows moved per batch")
+@click.option("--max-rate", default=None, type=float, help="Cap on rows moved per second")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches (run again to continue)")
+def archive_transactions_command(batch_size, max_rate, max_batches):
+    """Move transactions older than TRANSACTIONS_HOT_DAYS into monthly archive collections."""
+    moved = bank_model.archive.archive(batch_size=batch_size, max_batches=max_batches, max_per_second=max_rate)
+    click.echo(f"Archived {moved} transactions (watermark {bank_model.archive.state().get('watermark')})")
+
+
+@app.cli.command("rebuild-beneficiary-directory")
+def rebuild_beneficiary_directory_command():
+    """Rebuild the payee directory from every verified beneficiary."""
+    entries = beneficiary_directory.rebuild()
+    click.echo(f"Beneficiary directory has {entries} entries")
+
+
+@app.cli.command("audit-indexes")
+def audit_indexes_command():
+    """Explain every registered query and fail if any plan is a COLLSCAN."""
+    offenders = audit_query_plans(mongo.db)
+    for name, stages in offenders:
+        click.echo(f"COLLSCAN: {name} ({' -> '.join(stages)})", err=True)
+    if offenders:
+        raise SystemExit(1)
+    click.echo("All registered queries use an index")
+
+
 # ---------------------- START SERVER ----------------------
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG", "true").lower() == "true")
+    # "asgi" serves the async handlers of asgi.py (with this app mounted for the rest)
+    if os.getenv("SERVER_MODE", "wsgi") == "asgi":
+        import uvicorn
+        uvicorn.run("asgi:app", host="0.0.0.0", port=port, workers=int(os.getenv("WEB_CONCURRENCY", 1)))
+    else:
+        app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG", "true").lower() == "true")
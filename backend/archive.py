@@ -0,0 +1,248 @@
+# archive.py
+"""
+Hot/cold tiering of the `transactions` journal.
+
+Rows whose timestamp is older than the hot window are moved, in batches, into
+one archive collection per calendar month (`transactions_YYYY_MM`), each with
+the same user_timestamp_id index. `transactions` then only holds the recent
+history, so it and its index stay small enough to remain in memory.
+
+`archive_state` records the watermark (every row older than it may be in the
+archive) and the archive months that exist. Readers go through
+TransactionArchive: a query whose date range starts at or after the watermark
+reads `transactions` alone; otherwise the archive months overlapping the range
+are read too, newest first, and merged with the hot rows on (timestamp, _id).
+A page stops reading months as soon as it is full with rows newer than the
+next month, so paging through recent history never touches the archive.
+
+Every read needs the watermark and the list of months, so each process keeps
+`archive_state` in a TTLCache for state_ttl seconds (ARCHIVE_STATE_TTL_SECONDS)
+instead of reading it on every query.
+
+archive() raises the watermark and registers the months it is about to fill
+before it moves anything, then waits out state_ttl so that no process still
+reads with the previous state. It copies each batch into its months
+(re-inserting a row that is already there is a no-op) and only then deletes it
+from `transactions`, so an interrupted run is resumed by running it again. A
+row that briefly exists in both tiers is returned once. Rows are selected by
+timestamp on the timestamp_id index, so rows journaled late with an old
+timestamp (backfills, audit adjustments) are archived like any other.
+"""
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, UTC
+from itertools import chain
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import BulkWriteError
+
+from cache import TTLCache
+from pagination import KEYSET_SORT
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "transactions"
+
+# Same index as `transactions` (see indexes.py)
+ARCHIVE_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+               name="user_timestamp_id"),
+    IndexModel([("timestamp", ASCENDING), ("_id", ASCENDING)], name="timestamp_id"),
+]
+
+
+def as_utc(value):
+    return value.replace(tzinfo=UTC) if value.tzinfo is None else value.astimezone(UTC)
+
+
+def month_start(value):
+    value = as_utc(value)
+    return datetime(value.year, value.month, 1, tzinfo=UTC)
+
+
+def next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=UTC)
+
+
+def collection_name(start):
+    return f"transactions_{start.year:04d}_{start.month:02d}"
+
+
+def _unique(rows, key):
+    """Drop consecutive rows with the same key (a row caught in both tiers mid-move)."""
+    last = None
+    for row in rows:
+        k = key(row)
+        if k != last:
+            yield row
+        last = k
+
+
+def month_of(name):
+    return datetime(int(name[-7:-3]), int(name[-2:]), 1, tzinfo=UTC)
+
+
+class TransactionArchive:
+    def __init__(self, db, hot_days=365, state_ttl=5, state_cache=None):
+        self.db = db
+        self.hot_days = hot_days
+        self.state_ttl = state_ttl
+        self.state_cache = TTLCache(maxsize=1, ttl=state_ttl) if state_cache is None else state_cache
+
+    def with_db(self, db):
+        """The same archive (and cached state) read through `db` (e.g. with another read preference)."""
+        return TransactionArchive(db, self.hot_days, self.state_ttl, self.state_cache)
+
+    def cached_state(self):
+        """The cached archive_state, or None once it has expired."""
+        return self.state_cache.get(STATE_ID)
+
+    def state(self):
+        state = self.cached_state()
+        if state is None:
+            state = self.db.archive_state.find_one({"_id": STATE_ID}) or {}
+            self.state_cache.set(STATE_ID, state)
+        return state
+
+    # ---------------------- READ PATH ----------------------
+    def months(self, start=None, end=None, newest_first=True):
+        """
+        (collection, month start, month end) of every archive month a query
+        over [start, end] has to read; empty when the range is all hot.
+        """
+        state = self.state()
+        watermark = state.get("watermark")
+        if watermark is None or (start is not None and as_utc(start) >= as_utc(watermark)):
+            return []
+        months = []
+        for name in state.get("months", []):
+            begin = month_of(name)
+            finish = next_month(begin)
+            if (start is None or finish > as_utc(start)) and (end is None or begin <= as_utc(end)):
+                months.append((self.db[name], begin, finish))
+        months.sort(key=lambda m: m[1], reverse=newest_first)
+        return months
+
+    def collections(self, start=None, end=None):
+        """`transactions` plus the archive months holding rows in [start, end], for aggregations."""
+        return [self.db.transactions] + [collection for collection, _, _ in self.months(start, end)]
+
+    def find(self, query, limit=None, start=None, end=None, ascending=False, batch_size=None, projection=None):
+        """
+        Rows matching `query` across tiers in KEYSET_SORT order (oldest first
+        with `ascending`). `start` / `end` bound the timestamps `query`
+        selects, so months outside them are skipped. With a limit returns a
+        list, otherwise a lazy iterator.
+        """
+        sort = [(field, -direction) for field, direction in KEYSET_SORT] if ascending else KEYSET_SORT
+
+        def run(collection, n):
+            cursor = collection.find(query, projection).sort(sort)
+            if batch_size:
+                cursor = cursor.batch_size(batch_size)
+            return cursor.limit(n) if n else cursor
+
+        return self._merge(run, "timestamp", limit, start, end, ascending)
+
+    def aggregate(self, pipeline, limit=None, start=None, end=None, batch_size=None):
+        """
+        Run `pipeline` on every tier and merge the results newest first. Its
+        output rows must be in KEYSET_SORT order and carry the raw timestamp
+        as `_ts`; a `limit` must already be applied by the pipeline.
+        """
+        def run(collection, n):
+            return collection.aggregate(pipeline, **({"batchSize": batch_size} if batch_size else {}))
+
+        return self._merge(run, "_ts", limit, start, end)
+
+    def count(self, query, start=None, end=None):
+        return sum(c.count_documents(query) for c in self.collections(start, end))
+
+    def _merge(self, run, field, limit, start, end, ascending=False):
+        months = self.months(start, end, newest_first=not ascending)
+
+        def key(row):
+            return as_utc(row[field]), row["_id"]
+
+        if not months:
+            hot = run(self.db.transactions, limit)
+            return list(hot) if limit else hot
+        if not limit:
+            # Months are disjoint and in order, so one chained stream of them merges with the hot rows
+            cold = chain.from_iterable(run(collection, None) for collection, _, _ in months)
+            return _unique(heapq.merge(run(self.db.transactions, None), cold, key=key, reverse=not ascending), key)
+
+        rows = list(run(self.db.transactions, limit))
+        for collection, begin, finish in months:
+            if len(rows) >= limit and (key(rows[limit - 1])[0] >= finish if not ascending
+                                       else key(rows[limit - 1])[0] < begin):
+                break
+            rows = sorted([*rows, *run(collection, limit)], key=key, reverse=not ascending)
+            rows = list(_unique(rows, key))[:limit]
+        return rows
+
+    # ---------------------- ARCHIVING ----------------------
+    def archive(self, cutoff=None, batch_size=1000, max_batches=None, max_per_second=None):
+        """
+        Move rows stamped before `cutoff` (default: hot_days ago) into their
+        archive months. Returns the number of rows moved.
+        """
+        cutoff = as_utc(cutoff or datetime.now(UTC) - timedelta(days=self.hot_days))
+        query = {"timestamp": {"$lt": cutoff}}
+        # Readers must look in the archive below the new cutoff, and in every month
+        # about to be filled, before any row leaves the hot tier
+        previous = self.db.archive_state.find_one_and_update(
+            {"_id": STATE_ID}, {"$max": {"watermark": cutoff}}, upsert=True
+        ) or {}
+        planned = {
+            collection_name(datetime(row["_id"]["year"], row["_id"]["month"], 1, tzinfo=UTC))
+            for row in self.db.transactions.aggregate([
+                {"$match": query},
+                {"$group": {"_id": {"year": {"$year": "$timestamp"}, "month": {"$month": "$timestamp"}}}},
+            ])
+        }
+        known = set(previous.get("months", []))
+        self._add_months(planned - known)
+        if planned - known or previous.get("watermark") is None or as_utc(previous["watermark"]) < cutoff:
+            self._settle()
+        known |= planned
+
+        moved = batches = 0
+        while max_batches is None or batches < max_batches:
+            started = time.monotonic()
+            rows = list(self.db.transactions.find(query).sort([("timestamp", 1), ("_id", 1)]).limit(batch_size))
+            if not rows:
+                break
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(collection_name(month_start(row["timestamp"])), []).append(row)
+            if set(by_month) - known:
+                # A row backfilled into a new month since the run started
+                self._add_months(set(by_month) - known)
+                known |= set(by_month)
+                self._settle()
+            for name, month_rows in by_month.items():
+                try:
+                    self.db[name].insert_many(month_rows, ordered=False)
+                except BulkWriteError as e:
+                    # Rows copied by an earlier, interrupted run are already there
+                    if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                        raise
+            self.db.transactions.delete_many({"_id": {"$in": [row["_id"] for row in rows]}})
+            moved += len(rows)
+            batches += 1
+            logger.info("archive: moved %d rows, up to %s", moved, rows[-1]["timestamp"])
+            if max_per_second:
+                time.sleep(max(0.0, len(rows) / max_per_second - (time.monotonic() - started)))
+        return moved
+
+    def _add_months(self, names):
+        for name in sorted(names):
+            self.db[name].create_indexes(ARCHIVE_INDEXES)
+            self.db.archive_state.update_one({"_id": STATE_ID}, {"$addToSet": {"months": name}})
+
+    def _settle(self):
+        """Wait until every process's cached state includes the latest change, then refresh ours."""
+        time.sleep(self.state_ttl)
+        self.state_cache.clear()
@@ -0,0 +1,484 @@
+# asgi.py
+"""
+Async (ASGI) serving mode.
+
+    uvicorn asgi:app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:app
+    SERVER_MODE=asgi python app.py
+
+The hot endpoints run as async handlers on Motor (see async_models.py), so a
+worker keeps serving other requests while one waits on Mongo, the password
+hasher or the mail server:
+
+  POST /api/auth/login           GET /api/user/profile
+  GET  /api/user/balance         GET /api/user/accounts
+  GET  /api/transactions         POST /api/transfer/initiate
+  POST /api/transfer/verify      GET  /api/events (SSE)
+
+An open event stream is a coroutine awaiting its subscription, so a worker
+holds thousands of them without a thread each. Every other route, and the streamed variants of the listings (?stream=1 or
+NDJSON), falls through to the Flask app mounted as WSGI, so both modes serve
+the same API. The OTP, rate-limit and mail components are the ones app.py
+configured; the async handlers run their blocking calls in threads.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, UTC
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+
+import app as wsgi
+from async_models import AsyncBankingModel
+from events import format_event
+from hashing import HasherBusy
+from mailer import MailQueueFull
+from otp_store import OTP_MISMATCH
+from pagination import DEFAULT_PAGE_SIZE
+from ratelimit import MemoryBackend
+from streaming import NDJSON_MIMETYPE
+
+flask_app = wsgi.app
+
+
+# ---------------------- HELPERS ----------------------
+def json_response(payload, status=200, headers=None):
+    """A JSON response rendered exactly as Flask's jsonify renders it."""
+    return Response(flask_app.json.encoder.encode(payload), status_code=status,
+                    media_type="application/json", headers=headers)
+
+
+def conditional_json(request, payload):
+    """200 with an ETag, or 304 when If-None-Match already holds it (see app._conditional_json)."""
+    body, etag = wsgi._etag_body(payload)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    if parse_etags(request.headers.get("If-None-Match")).contains_weak(etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def json_body(request):
+    """The request's JSON object, or {} (Flask's `request.get_json() or {}`)."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def in_app_context(fn, *args, **kwargs):
+    """Call a Flask-side helper (e.g. one that sends mail) from a worker thread."""
+    with flask_app.app_context():
+        return fn(*args, **kwargs)
+
+
+def busy_response():
+    return json_response({"error": "Server busy, please retry shortly"}, 429, {"Retry-After": "1"})
+
+
+# ---------------------- AUTH DECORATOR ----------------------
+def require_auth(handler):
+    """Async twin of app.require_auth; the user lands on request.state.current_user."""
+    @wraps(handler)
+    async def decorated(request):
+        auth_header = request.headers.get("Authorization")
+        if not auth_header:
+            return json_response({"error": "Authorization header required"}, 401)
+        parts = auth_header.split()
+        if len(parts) != 2 or parts[0].lower() != "bearer":
+            return json_response({"error": "Invalid Authorization header"}, 401)
+        ok, result = wsgi.decode_jwt(parts[1])
+        if not ok:
+            return json_response({"error": result}, 401)
+        user_id = result.get("user_id")
+        if not user_id or result.get("scope"):
+            return json_response({"error": "Invalid token payload"}, 401)
+
+        claims = result.get("user")
+        if wsgi.JWT_TRUST_CLAIMS and claims and request.method in ("GET", "HEAD"):
+            request.state.current_user = claims
+            return await handler(request)
+
+        try:
+            user, status = await request.app.state.bank_model.get_public_user(user_id)
+        except Exception:
+            return json_response({"error": "Failed to fetch user"}, 500)
+        if status != 200 or not user:
+            return json_response({"error": "Invalid or expired token"}, 401)
+        request.state.current_user = user
+        return await handler(request)
+    return decorated
+
+
+# ---------------------- RATE LIMIT DECORATOR ----------------------
+def _client_ip(request):
+    forwarded = request.headers.get("X-Forwarded-For")
+    if flask_app.config["RATE_LIMIT_TRUST_PROXY"] and forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def _rate_limit_user(request):
+    user = getattr(request.state, "current_user", None)
+    if user:
+        return str(user["_id"])
+    email = (await json_body(request)).get("email")
+    return str(email).strip().lower() if email else None
+
+
+def rate_limit(name, ip=None, user=None):
+    """Async twin of app.rate_limit, sharing its limiter, limits and env overrides."""
+    limits = wsgi._rate_limits(name, ip, user)
+    # The in-process limiter answers from memory; a Mongo-backed one is a round trip
+    in_process = isinstance(wsgi.rate_limiter.backend, MemoryBackend)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def decorated(request):
+            if flask_app.config["RATE_LIMIT_ENABLED"]:
+                for scope, limit in limits.items():
+                    if not limit:
+                        continue
+                    key = _client_ip(request) if scope == "ip" else await _rate_limit_user(request)
+                    if key is None:
+                        continue
+                    if in_process:
+                        allowed, retry_after = wsgi.rate_limiter.check(f"{name}:{scope}", key, limit)
+                    else:
+                        allowed, retry_after = await asyncio.to_thread(
+                            wsgi.rate_limiter.check, f"{name}:{scope}", key, limit
+                        )
+                    if not allowed:
+                        return json_response({"error": "Too many requests, please retry later"}, 429,
+                                             {"Retry-After": str(retry_after)})
+            return await handler(request)
+        return decorated
+    return decorator
+
+
+# ---------------------- AUTH ROUTES ----------------------
+@rate_limit("login", ip="60/minute", user="10/minute")
+async def login(request):
+    try:
+        data = await json_body(request)
+        if not data.get("email") or not data.get("password"):
+            return json_response({"error": "Email and password required"}, 400)
+
+        user, status = await request.app.state.bank_model.authenticate_user(data["email"], data["password"])
+        if status != 200:
+            return json_response(user, status)
+
+        user_public = wsgi._user_doc_to_public(user)
+        token = wsgi.create_jwt_for_user(user_public["_id"], user_public)
+        return json_response({"user": user_public, "token": token})
+    except HasherBusy:
+        return busy_response()
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+# ---------------------- USER ROUTES ----------------------
+@require_auth
+async def get_profile(request):
+    return json_response(request.state.current_user)
+
+
+async def _await_balance_change(request, load):
+    """Long-poll (?since=&wait=) without holding a thread: re-check every poll interval."""
+    since = request.query_params.get("since")
+    try:
+        wait = float(request.query_params.get("wait", 0))
+    except ValueError:
+        wait = 0
+    result, status = await load()
+    if wsgi.balance_cache is None or since is None or wait <= 0:
+        return result, status
+    deadline = time.monotonic() + min(wait, flask_app.config["BALANCE_LONG_POLL_MAX_SECONDS"])
+    while status == 200 and str(result.get("version")) == since and time.monotonic() < deadline:
+        await asyncio.sleep(min(wsgi.balance_cache.poll_interval, max(0.0, deadline - time.monotonic())))
+        result, status = await load()
+    return result, status
+
+
+@require_auth
+async def get_balance(request):
+    model = request.app.state.bank_model
+    user_id = request.state.current_user["_id"]
+    result, status = await _await_balance_change(request, lambda: model.get_user_balance(user_id))
+    return conditional_json(request, result)
+
+
+@require_auth
+async def list_user_accounts(request):
+    model = request.app.state.bank_model
+    user_id = request.state.current_user["_id"]
+    result, status = await _await_balance_change(request, lambda: model.get_user_accounts(user_id))
+    return conditional_json(request, result)
+
+
+# ---------------------- TRANSFERS (with OTP) ----------------------
+@require_auth
+@rate_limit("transfer_initiate", ip="60/minute", user="10/minute")
+async def transfer_initiate(request):
+    try:
+        data = await json_body(request)
+        for field in ["beneficiary_id", "amount", "transfer_mode", "from_acc_number"]:
+            if not data.get(field):
+                return json_response({"error": f"{field} is required"}, 400)
+
+        db = request.app.state.bank_model.db
+        user = request.state.current_user
+        user_id = user["_id"]
+        amount = float(data["amount"])
+        if amount <= 0:
+            return json_response({"error": "Amount must be greater than zero"}, 400)
+
+        # Both checks are independent: issue them together
+        beneficiary, from_acc = await asyncio.gather(
+            db.beneficiaries.find_one({"_id": ObjectId(data["beneficiary_id"]), "user_id": user_id}),
+            db.accounts.find_one({"user_id": ObjectId(user_id), "account_number": data["from_acc_number"]},
+                                 {"balance": 1}),
+        )
+        if not beneficiary:
+            return json_response({"error": "Beneficiary not found"}, 400)
+        if not beneficiary.get("verified", False):
+            return json_response({"error": "Cannot transfer to unverified beneficiary"}, 400)
+        if not from_acc:
+            return json_response({"error": "Source account not found"}, 400)
+        if float(from_acc.get("balance", 0)) < amount:
+            return json_response({"error": "Insufficient balance"}, 400)
+
+        # The pending transfer and its OTP are written concurrently
+        pending_id = ObjectId()
+        pending = {
+            "_id": pending_id,
+            "user_id": user_id,
+            "beneficiary_id": str(beneficiary["_id"]),
+            "from_acc_number": data["from_acc_number"],
+            "amount": amount,
+            "transfer_mode": data["transfer_mode"],
+            "created_at": datetime.now(UTC)
+        }
+        _, otp_record = await asyncio.gather(
+            db.pending_transfers.insert_one(pending),
+            asyncio.to_thread(wsgi._store_otp, email=user["email"], purpose="transfer",
+                              metadata={"pending_transfer_id": str(pending_id), "user_id": user_id},
+                              ttl_minutes=10),
+        )
+        async def discard():
+            await asyncio.gather(db.pending_transfers.delete_one({"_id": pending_id}),
+                                 asyncio.to_thread(wsgi.otp_store.delete, otp_record["_id"]))
+
+        try:
+            delivery_id = await asyncio.to_thread(
+                in_app_context,
+                wsgi._send_otp_email,
+                to_email=user["email"],
+                subject="Your Transfer OTP",
+                body=f"Your transfer OTP is {otp_record['code']}. It expires in 10 minutes.",
+                job_id=str(otp_record["_id"])
+            )
+        except MailQueueFull:
+            await discard()
+            return json_response({"error": "Mail service busy, please retry shortly"}, 503)
+        except Exception as e:
+            await discard()
+            return json_response({"error": "Failed to send OTP email", "detail": str(e)}, 500)
+
+        return json_response({
+            "message": "OTP sent to email",
+            "pending_transfer_id": str(pending_id),
+            "delivery_id": delivery_id
+        })
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+@require_auth
+@rate_limit("transfer_verify", ip="60/minute", user="10/minute")
+async def transfer_verify(request):
+    try:
+        data = await json_body(request)
+        pending_id = data.get("pending_transfer_id")
+        code = data.get("otp")
+        if not pending_id or not code:
+            return json_response({"error": "pending_transfer_id and otp are required"}, 400)
+
+        model = request.app.state.bank_model
+        user = request.state.current_user
+        ok, result = await asyncio.to_thread(wsgi._verify_and_consume_otp, email=user["email"],
+                                             purpose="transfer", code=code,
+                                             metadata={"pending_transfer_id": pending_id})
+        if not ok:
+            error = "OTP does not match this transfer" if result == OTP_MISMATCH else result
+            return json_response({"error": error}, 400)
+
+        # Claim the pending transfer atomically so it can only ever execute once
+        pending = await model.db.pending_transfers.find_one_and_delete(
+            {"_id": ObjectId(pending_id), "user_id": user["_id"]}
+        )
+        if not pending:
+            return json_response({"error": "Pending transfer not found"}, 404)
+        beneficiary = await model.db.beneficiaries.find_one({"_id": ObjectId(pending["beneficiary_id"])})
+        if not beneficiary:
+            return json_response({"error": "Beneficiary not found"}, 400)
+
+        result, status = await model.transfers.transfer(
+            source_filter={"user_id": ObjectId(user["_id"]), "account_number": pending["from_acc_number"]},
+            beneficiary=beneficiary,
+            amount=float(pending["amount"]),
+            transfer_mode=pending["transfer_mode"],
+            user_id=user["_id"],
+        )
+        if status != 200:
+            return json_response(result, status)
+        flask_app.logger.info("transfer %s completed in %.1f ms", result["transfer_id"], result["latency_ms"])
+        return json_response({
+            "message": "Transfer completed successfully",
+            "transfer_id": result["transfer_id"],
+            "latency_ms": result["latency_ms"]
+        })
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+# ---------------------- TRANSACTIONS ----------------------
+@require_auth
+async def transactions(request):
+    try:
+        limit = int(request.query_params.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    result, status = await request.app.state.bank_model.get_transactions(
+        request.state.current_user["_id"], limit, request.query_params.get("cursor")
+    )
+    return json_response(result, status)
+
+
+# ---------------------- EVENTS (SSE) ----------------------
+async def events_stream(request):
+    """Async twin of app.events_stream (header or ?ticket= authentication, same frames)."""
+    ticket = request.query_params.get("ticket")
+    if ticket is None:
+        return await _authorised_event_stream(request)
+    ok, result = wsgi.decode_jwt(ticket)
+    if not ok or result.get("scope") != "events" or not result.get("user_id"):
+        return json_response({"error": "Invalid or expired ticket"}, 401)
+    return await _open_event_stream(request, result["user_id"])
+
+
+@require_auth
+async def _authorised_event_stream(request):
+    return await _open_event_stream(request, request.state.current_user["_id"])
+
+
+async def _open_event_stream(request, user_id):
+    event_hub = wsgi.event_hub
+    subscription = event_hub.subscribe(user_id, loop=asyncio.get_running_loop())
+    if subscription is None:
+        return json_response({"error": "Too many open event streams, retry shortly"}, 503, {"Retry-After": "5"})
+    model = request.app.state.bank_model
+    last_event_id = request.headers.get("Last-Event-ID")
+    heartbeat = flask_app.config["EVENTS_HEARTBEAT_SECONDS"]
+
+    def frame(event, data, event_id=None):
+        return in_app_context(format_event, event, data, event_id)
+
+    async def balance_frame():
+        # Sent right after a transfer: read the primary, not a lagging secondary
+        result, _ = await model.get_user_balance(user_id, fresh=True)
+        return frame("balance", result)
+
+    async def generate():
+        try:
+            yield f"retry: {heartbeat * 1000}\n\n"
+            # Rows written while a reconnecting client was away; the hub may deliver them again
+            replayed = await asyncio.to_thread(event_hub.replay, user_id, last_event_id) if last_event_id else []
+            for row in replayed:
+                yield frame("transaction", row, row["_id"])
+            seen = {row["_id"] for row in replayed}
+            yield await balance_frame()
+            while True:
+                events, overflowed = await subscription.wait(heartbeat)
+                if overflowed:
+                    yield frame("resync", {"reason": "Too many pending events"})
+                for row in events:
+                    if row["_id"] not in seen:
+                        yield frame("transaction", row, row["_id"])
+                if events or overflowed:
+                    yield await balance_frame()
+                else:
+                    # Keeps proxies from closing the stream and detects gone clients
+                    yield ": keepalive\n\n"
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------------------- APP ----------------------
+@asynccontextmanager
+async def lifespan(app):
+    # One Motor client per worker process, created on its event loop, with the
+    # pool settings of the PyMongo client (its pool is reported as "motor")
+    client = AsyncIOMotorClient(flask_app.config["MONGO_URI"], **wsgi.mongo.client_options("motor"))
+    db = client.get_default_database()
+    app.state.bank_model = AsyncBankingModel(
+        db, wsgi.bank_model, read_db=db.with_options(read_preference=wsgi.mongo.read_preference)
+    )
+    yield
+    client.close()
+
+
+routes = [
+    Route("/api/auth/login", login, methods=["POST"]),
+    Route("/api/user/profile", get_profile, methods=["GET"]),
+    Route("/api/user/balance", get_balance, methods=["GET"]),
+    Route("/api/user/accounts", list_user_accounts, methods=["GET"]),
+    Route("/api/transfer/initiate", transfer_initiate, methods=["POST"]),
+    Route("/api/transfer/verify", transfer_verify, methods=["POST"]),
+    Route("/api/transactions", transactions, methods=["GET"]),
+    Route("/api/events", events_stream, methods=["GET"]),
+]
+ROUTE_PATHS = {route.endpoint: route.path for route in routes}
+
+legacy = WSGIMiddleware(flask_app)
+native = Starlette(routes=routes + [Mount("/", app=legacy)], lifespan=lifespan)
+
+
+def _wants_stream(scope):
+    request = Request(scope)
+    return request.query_params.get("stream") in ("1", "true") or NDJSON_MIMETYPE in request.headers.get("accept", "")
+
+
+async def app(scope, receive, send):
+    """Streamed listings go to Flask; everything else is routed (and timed) by Starlette."""
+    if scope["type"] != "http":
+        return await native(scope, receive, send)
+    if _wants_stream(scope):
+        return await legacy(scope, receive, send)
+
+    started = time.perf_counter()
+    status = [500]
+
+    async def send_with_status(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+        await send(message)
+
+    try:
+        await native(scope, receive, send_with_status)
+    finally:
+        # Requests handed to Flask are recorded by its own before/after_request hooks
+        route = ROUTE_PATHS.get(scope.get("endpoint"))
+        if route is not None:
+            wsgi.request_metrics.observe_request(scope["method"], route, status[0], time.perf_counter() - started)
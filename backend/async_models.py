@@ -0,0 +1,181 @@
+# async_models.py
+"""
+Motor (asyncio) counterpart of the hot paths of BankingModel, used by asgi.py.
+
+AsyncBankingModel wraps the synchronous BankingModel and shares its caches,
+hasher and transfer listeners, so both serving modes keep the same derived
+data (monthly rollups, balance snapshots, event streams). Reads and the
+transfer writes go through Motor and never block the event loop; work that
+is CPU-bound or only has a synchronous implementation (password hashing,
+transfer listeners, a Mongo-backed balance cache, multi-document
+transactions) runs in the default thread pool via asyncio.to_thread.
+"""
+import asyncio
+import logging
+import time
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from archive import as_utc, month_start, next_month
+from balances import MemoryBalanceStore
+from journal import posting, write_journal
+from models import USER_PUBLIC_PROJECTION
+from pagination import KEYSET_SORT, clamp_page_size, encode_cursor, keyset_filter
+from transfers import TransferAborted
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTransferEngine:
+    def __init__(self, db, engine):
+        """`engine` is the synchronous TransferEngine whose listeners every transfer feeds."""
+        self.db = db
+        self.engine = engine
+
+    async def transfer(self, source_filter, beneficiary, amount, transfer_mode, user_id):
+        """Same contract as TransferEngine.transfer."""
+        if self.engine.use_transactions:
+            # Listeners join the transaction through a PyMongo session
+            return await asyncio.to_thread(self.engine.transfer, source_filter, beneficiary, amount,
+                                           transfer_mode, user_id)
+        started = time.perf_counter()
+        try:
+            transfer_id, entries = await self._execute(source_filter, beneficiary, amount, transfer_mode, user_id)
+        except TransferAborted as e:
+            return {"error": e.error}, e.status
+        for listener in self.engine.listeners:
+            try:
+                await asyncio.to_thread(listener, entries, None)
+            except Exception:
+                logger.exception("Transfer listener %r failed", listener)
+        return {
+            "message": "Transfer successful",
+            "transfer_id": str(transfer_id),
+            "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+        }, 200
+
+    async def _execute(self, source_filter, beneficiary, amount, transfer_mode, user_id):
+        source = await self.db.accounts.find_one_and_update(
+            {**source_filter, "balance": {"$gte": amount}},
+            {"$inc": {"balance": -amount}},
+            projection={"_id": 1, "user_id": 1, "account_number": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if source is None:
+            if await self.db.accounts.find_one(source_filter, {"_id": 1}) is None:
+                raise TransferAborted("Source account not found", 400)
+            raise TransferAborted("Insufficient balance", 400)
+
+        receiver = None
+        try:
+            receiver = await self.db.accounts.find_one_and_update(
+                {"account_number": beneficiary["account_number"]},
+                {"$inc": {"balance": amount}},
+                projection={"_id": 1, "user_id": 1, "account_number": 1},
+            )
+            entries, journal = posting(user_id, source["account_number"], receiver, beneficiary["_id"],
+                                       amount, transfer_mode)
+            await write_journal(self.db.transactions, journal)
+        except Exception:
+            # Undo the balance changes of a transfer that failed part-way
+            await self.db.accounts.update_one({"_id": source["_id"]}, {"$inc": {"balance": amount}})
+            if receiver:
+                await self.db.accounts.update_one({"_id": receiver["_id"]}, {"$inc": {"balance": -amount}})
+            raise
+        return entries[0]["transfer_id"], entries
+
+
+class AsyncBankingModel:
+    def __init__(self, db, model, read_db=None):
+        """
+        `db` is a Motor database; `model` the synchronous BankingModel of this
+        process. Read-only listings go to `read_db`, as in BankingModel.
+        """
+        self.db = db
+        self.read_db = db if read_db is None else read_db
+        self.model = model
+        self.transfers = AsyncTransferEngine(db, model.transfers)
+
+    # ---------------------- USER ----------------------
+    async def authenticate_user(self, email, password):
+        user = await self.db.users.find_one({"email": email})
+        hasher = self.model.hasher
+        if not user or not await asyncio.to_thread(hasher.verify, password, user["password"]):
+            return {"error": "Invalid credentials"}, 401
+        if hasher.needs_rehash(user["password"]):
+            await self.db.users.update_one(
+                {"_id": user["_id"], "password": user["password"]},
+                {"$set": {"password": await asyncio.to_thread(hasher.hash, password)}}
+            )
+        user["_id"] = str(user["_id"])
+        del user["password"]
+        return user, 200
+
+    async def get_public_user(self, user_id):
+        """Same contract (and cache) as BankingModel.get_public_user."""
+        cache = self.model.user_cache
+        if cache is not None:
+            cached = cache.get(user_id)
+            if cached is not None:
+                return cached, 200
+        user = await self.db.users.find_one({"_id": ObjectId(user_id)}, USER_PUBLIC_PROJECTION)
+        if not user:
+            return {"error": "User not found"}, 404
+        user["_id"] = str(user["_id"])
+        if cache is not None:
+            cache.set(user_id, user)
+        return user, 200
+
+    # ---------------------- ACCOUNT ----------------------
+    async def _balance_snapshot(self, user_id):
+        cache = self.model.balance_cache
+        if isinstance(cache.store, MemoryBalanceStore):
+            snapshot = cache.store.get(str(user_id))
+            if snapshot is not None:
+                return snapshot
+        return await asyncio.to_thread(cache.snapshot, user_id)
+
+    async def get_user_accounts(self, user_id):
+        if self.model.balance_cache is not None:
+            snapshot = await self._balance_snapshot(user_id)
+            return {"accounts": list(snapshot["accounts"].values()), "version": str(snapshot["version"])}, 200
+        return {"accounts": await self.read_db.accounts.find({"user_id": ObjectId(user_id)}).to_list(None)}, 200
+
+    async def get_user_balance(self, user_id, fresh=False):
+        """`fresh` reads the primary even when listings are routed to secondaries."""
+        if self.model.balance_cache is not None:
+            snapshot = await self._balance_snapshot(user_id)
+            balances = {number: acc["balance"] for number, acc in snapshot["accounts"].items()}
+            return {"balances": balances, "version": str(snapshot["version"])}, 200
+        accounts = await (self.db if fresh else self.read_db).accounts.find(
+            {"user_id": ObjectId(user_id)}, {"account_number": 1, "balance": 1}
+        ).to_list(None)
+        return {"balances": {acc["account_number"]: acc["balance"] for acc in accounts}}, 200
+
+    # ---------------------- TRANSACTIONS ----------------------
+    async def get_transactions(self, user_id, limit=50, cursor=None):
+        """Newest-first page of a user's transactions; same contract as BankingModel.get_transactions."""
+        limit = clamp_page_size(limit)
+        query = {"user_id": ObjectId(user_id)}
+        try:
+            after = keyset_filter(cursor)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if after:
+            query = {"$and": [query, after]}
+        transactions = await self.read_db.transactions.find(query).sort(KEYSET_SORT).limit(limit + 1).to_list(None)
+        archive = self.model.archive
+        state = archive.cached_state()
+        if state is None:
+            state = await asyncio.to_thread(archive.state)
+        if state and state.get("watermark"):
+            # Archive months all end by the month after the watermark's: a full page newer than that is all hot
+            newest_month_end = next_month(month_start(state["watermark"]))
+            if len(transactions) <= limit or as_utc(transactions[limit]["timestamp"]) < newest_month_end:
+                return await asyncio.to_thread(self.model.get_transactions, user_id, limit, cursor)
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            next_cursor = encode_cursor(transactions[-1])
+        return {"transactions": transactions, "next_cursor": next_cursor}, 200
@@ -0,0 +1,215 @@
+# balances.py
+"""
+Per-user account/balance snapshots for /api/user/balance and /api/user/accounts.
+
+A snapshot is every account of one user (keyed by account number) plus a
+version stamp. It is loaded from `accounts` on the first read and then kept
+current write-through: BalanceCache.record() is a TransferEngine listener
+that applies each transfer's debits and credits to the cached snapshots, and
+account_created() adds new accounts. Each change gets a new version, which
+the API exposes for ETags and long-polling (wait_for_change). Versions are
+nanosecond timestamps sent as strings: as JSON numbers they exceed 2**53 and
+a JavaScript client would round them, so its ?since= would never match.
+
+Stores:
+  mongo  - `balance_snapshots` collection shared by every worker; updates are
+           $inc's on the snapshot document and join the transfer's transaction
+           when one is used. The default.
+  memory - LRU in this process. Only writes made by this process are applied;
+           snapshots changed by other workers would be served (and revalidated
+           with 304s) until their TTL runs out, so app.py allows it only with a
+           single worker.
+
+A write that cannot be applied to a snapshot (not cached, unknown account,
+or an in-process store inside a transaction that may still abort) leaves a
+tombstone instead, and a read that started before the tombstone is not
+allowed to cache what it loaded.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from cache import TTLCache
+
+
+def new_version():
+    return str(time.time_ns())
+
+
+class MemoryBalanceStore:
+    def __init__(self, maxsize=10000, ttl=30):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        snapshot = self._cache.get(user_id)
+        return snapshot if snapshot and "accounts" in snapshot else None
+
+    def put(self, user_id, snapshot, loaded_at):
+        with self._lock:
+            current = self._cache.get(user_id)
+            if current is None or current.get("invalidated_at", float("inf")) < loaded_at:
+                self._cache.set(user_id, snapshot)
+
+    def apply(self, user_id, deltas, version, session=None):
+        with self._lock:
+            current = self.get(user_id)
+            if current is None or session is not None or not all(n in current["accounts"] for n in deltas):
+                self._cache.set(user_id, {"invalidated_at": time.time()})
+                return
+            accounts = dict(current["accounts"])
+            for number, delta in deltas.items():
+                accounts[number] = {**accounts[number], "balance": accounts[number]["balance"] + delta}
+            # Readers may hold the previous snapshot: replace it rather than mutate it
+            self._cache.set(user_id, {"version": version, "accounts": accounts})
+
+    def add_account(self, user_id, account, version):
+        with self._lock:
+            current = self.get(user_id)
+            if current is None:
+                self._cache.set(user_id, {"invalidated_at": time.time()})
+                return
+            accounts = {**current["accounts"], account["account_number"]: account}
+            self._cache.set(user_id, {"version": version, "accounts": accounts})
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._cache.set(user_id, {"invalidated_at": time.time()})
+
+
+class MongoBalanceStore:
+    def __init__(self, db, ttl=300):
+        self.db = db
+        self.ttl = timedelta(seconds=ttl)
+
+    def get(self, user_id):
+        snapshot = self.db.balance_snapshots.find_one({"_id": user_id, "accounts": {"$exists": True}})
+        if snapshot is None:
+            return None
+        expires_at = snapshot.get("expires_at")
+        if expires_at is not None and expires_at.replace(tzinfo=UTC) <= datetime.now(UTC):
+            return None
+        return snapshot
+
+    def put(self, user_id, snapshot, loaded_at):
+        try:
+            # Matches an expired snapshot or an older tombstone; otherwise the
+            # upsert collides with the existing document and is dropped
+            self.db.balance_snapshots.update_one(
+                {"_id": user_id, "$or": [
+                    {"expires_at": {"$lte": datetime.now(UTC)}},
+                    {"accounts": {"$exists": False}, "invalidated_at": {"$lt": loaded_at}},
+                ]},
+                {"$set": {**snapshot, "expires_at": datetime.now(UTC) + self.ttl}, "$unset": {"invalidated_at": ""}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass
+
+    def apply(self, user_id, deltas, version, session=None):
+        result = self.db.balance_snapshots.update_one(
+            {"_id": user_id, **{f"accounts.{n}": {"$exists": True} for n in deltas}},
+            {"$inc": {f"accounts.{n}.balance": delta for n, delta in deltas.items()},
+             "$set": {"version": version}},
+            session=session,
+        )
+        if result.matched_count == 0:
+            self._tombstone(user_id, session)
+
+    def add_account(self, user_id, account, version):
+        result = self.db.balance_snapshots.update_one(
+            {"_id": user_id, "accounts": {"$exists": True}},
+            {"$set": {f"accounts.{account['account_number']}": account, "version": version}},
+        )
+        if result.matched_count == 0:
+            self._tombstone(user_id)
+
+    def invalidate(self, user_id):
+        self._tombstone(user_id)
+
+    def _tombstone(self, user_id, session=None):
+        self.db.balance_snapshots.update_one(
+            {"_id": user_id},
+            {"$set": {"invalidated_at": time.time(), "expires_at": datetime.now(UTC) + self.ttl},
+             "$unset": {"accounts": "", "version": ""}},
+            upsert=True,
+            session=session,
+        )
+
+
+class BalanceCache:
+    def __init__(self, db, store, poll_interval=1.0):
+        self.db = db
+        self.store = store
+        self.poll_interval = poll_interval
+        self._changed = threading.Condition()
+
+    def snapshot(self, user_id):
+        """{"version", "accounts": {account_number: account}} for a user, cached."""
+        user_id = str(user_id)
+        snapshot = self.store.get(user_id)
+        if snapshot is not None:
+            return snapshot
+        loaded_at = time.time()
+        accounts = self.db.accounts.find({"user_id": ObjectId(user_id)})
+        snapshot = {
+            "version": new_version(),
+            "accounts": {a["account_number"]: a for a in accounts},
+        }
+        self.store.put(user_id, snapshot, loaded_at)
+        return snapshot
+
+    # ---------------------- WRITE-THROUGH ----------------------
+    def record(self, entries, session=None):
+        """TransferEngine listener: apply journal entries to their owners' snapshots."""
+        deltas = {}
+        for entry in entries:
+            sign = -1 if entry["type"] == "debit" else 1
+            per_user = deltas.setdefault(str(entry["user_id"]), {})
+            per_user[entry["account_number"]] = per_user.get(entry["account_number"], 0) + sign * entry["amount"]
+        version = new_version()
+        for user_id, user_deltas in deltas.items():
+            self.store.apply(user_id, user_deltas, version, session)
+        self._notify()
+
+    def account_created(self, user_id, account):
+        self.store.add_account(str(user_id), dict(account), new_version())
+        self._notify()
+
+    def invalidate(self, user_id):
+        self.store.invalidate(str(user_id))
+        self._notify()
+
+    # ---------------------- LONG-POLL ----------------------
+    def wait_for_change(self, user_id, since, timeout):
+        """
+        Block until the user's snapshot version differs from `since` or
+        `timeout` seconds pass; returns the current snapshot either way.
+        Local writes wake waiters at once, other workers' within poll_interval.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self.snapshot(user_id)
+            remaining = deadline - time.monotonic()
+            if str(snapshot["version"]) != str(since) or remaining <= 0:
+                return snapshot
+            with self._changed:
+                self._changed.wait(min(remaining, self.poll_interval))
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+
+def make_balance_cache(backend, db, ttl):
+    """A BalanceCache on the `backend` store, or None when caching is off."""
+    if backend == "off":
+        return None
+    if backend == "memory":
+        return BalanceCache(db, MemoryBalanceStore(ttl=ttl))
+    if backend == "mongo":
+        return BalanceCache(db, MongoBalanceStore(db, ttl=ttl))
+    raise ValueError(f"Unknown balance cache backend: {backend}")
@@ -0,0 +1,167 @@
+# batches.py
+"""
+Bulk (payroll) transfers approved with a single OTP.
+
+A batch is uploaded as JSON items or a CSV file of (beneficiary_id, amount[,
+reference]). prepare() validates every row up front - all beneficiaries in
+one $in query, the same ownership / verification / balance rules as
+/api/transfer/initiate - and stores a `transfer_batches` job awaiting OTP.
+execute() claims the approved job exactly once and pays it through
+TransferEngine.transfer_many() in chunked bulk writes, recording a result per
+item on the job document.
+"""
+import csv
+import io
+import math
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+CSV_FIELDS = ("beneficiary_id", "amount", "reference")
+
+
+def parse_csv(text):
+    """Rows of a CSV upload with a beneficiary_id,amount[,reference] header."""
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [f for f in CSV_FIELDS[:2] if f not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV header must include {', '.join(missing)}")
+    return [{k: (row.get(k) or "").strip() for k in CSV_FIELDS} for row in reader]
+
+
+def _batch_public(job):
+    return {
+        "batch_id": str(job["_id"]),
+        "status": job["status"],
+        "from_acc_number": job["from_acc_number"],
+        "transfer_mode": job["transfer_mode"],
+        "count": job["count"],
+        "total": job["total"],
+        "summary": job.get("summary"),
+        "results": job.get("results"),
+    }
+
+
+class TransferBatches:
+    def __init__(self, db, engine, max_items=10000, chunk_size=500, approval_minutes=15):
+        self.db = db
+        self.engine = engine
+        self.max_items = max_items
+        self.chunk_size = chunk_size
+        self.approval_window = timedelta(minutes=approval_minutes)
+
+    def prepare(self, user_id, from_acc_number, transfer_mode, rows):
+        """
+        Validate `rows` and store the batch awaiting OTP approval.
+        Returns ({"batch": ...}, 201) or ({"error", "errors"?}, status).
+        """
+        if not rows:
+            return {"error": "Batch has no items"}, 400
+        if len(rows) > self.max_items:
+            return {"error": f"Batch exceeds {self.max_items} items"}, 400
+
+        errors, items = [], []
+        for index, row in enumerate(rows):
+            beneficiary_id = str(row.get("beneficiary_id") or "")
+            try:
+                amount = float(row.get("amount"))
+            except (TypeError, ValueError):
+                amount = None
+            if not ObjectId.is_valid(beneficiary_id):
+                errors.append({"index": index, "error": "Invalid beneficiary_id"})
+            elif amount is None or not math.isfinite(amount) or amount <= 0:
+                errors.append({"index": index, "error": "Amount must be greater than zero"})
+            else:
+                items.append({"index": index, "beneficiary_id": ObjectId(beneficiary_id), "amount": amount,
+                              "reference": row.get("reference") or None})
+
+        ids = list({item["beneficiary_id"] for item in items})
+        beneficiaries = {b["_id"]: b for b in self.db.beneficiaries.find(
+            # Beneficiaries added through the API store user_id as a string, older ones as ObjectId
+            {"_id": {"$in": ids}, "user_id": {"$in": [str(user_id), ObjectId(str(user_id))]}},
+            {"_id": 1, "account_number": 1, "verified": 1}
+        )}
+        for item in items:
+            beneficiary = beneficiaries.get(item["beneficiary_id"])
+            if not beneficiary:
+                errors.append({"index": item["index"], "error": "Beneficiary not found"})
+            elif not beneficiary.get("verified", False):
+                errors.append({"index": item["index"], "error": "Cannot transfer to unverified beneficiary"})
+            else:
+                item["account_number"] = beneficiary["account_number"]
+        if errors:
+            return {"error": "Batch has invalid items", "errors": sorted(errors, key=lambda e: e["index"])}, 400
+
+        account = self.db.accounts.find_one(
+            {"user_id": ObjectId(str(user_id)), "account_number": from_acc_number},
+            {"balance": 1}
+        )
+        if not account:
+            return {"error": "Source account not found"}, 400
+        total = round(sum(item["amount"] for item in items), 2)
+        if float(account.get("balance", 0)) < total:
+            return {"error": "Insufficient balance for the batch total"}, 400
+
+        now = datetime.now(UTC)
+        job = {
+            "user_id": str(user_id),
+            "from_acc_number": from_acc_number,
+            "transfer_mode": transfer_mode,
+            "items": items,
+            "count": len(items),
+            "total": total,
+            "status": "pending_otp",
+            "created_at": now,
+            # unapproved batches are dropped by the TTL index
+            "expires_at": now + self.approval_window,
+        }
+        job["_id"] = self.db.transfer_batches.insert_one(job).inserted_id
+        return {"batch": _batch_public(job)}, 201
+
+    def execute(self, batch_id, user_id):
+        """Pay an OTP-approved batch (at most once). Returns (batch, 200) or ({"error"}, status)."""
+        job = self.db.transfer_batches.find_one_and_update(
+            {"_id": ObjectId(batch_id), "user_id": str(user_id), "status": "pending_otp"},
+            {"$set": {"status": "running", "started_at": datetime.now(UTC)}, "$unset": {"expires_at": ""}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return {"error": "Pending batch not found"}, 404
+
+        results = self.engine.transfer_many(
+            source_filter={"user_id": ObjectId(str(user_id)), "account_number": job["from_acc_number"]},
+            items=[{"beneficiary": {"_id": item["beneficiary_id"], "account_number": item["account_number"]},
+                    "amount": item["amount"]} for item in job["items"]],
+            transfer_mode=job["transfer_mode"],
+            user_id=user_id,
+            chunk_size=self.chunk_size,
+            batch_id=job["_id"],
+        )
+        for item, result in zip(job["items"], results):
+            result["index"] = item["index"]
+            if item["reference"]:
+                result["reference"] = item["reference"]
+        completed = [item for item, result in zip(job["items"], results) if result["status"] == "completed"]
+        job["summary"] = {
+            "completed": len(completed),
+            "failed": len(results) - len(completed),
+            "amount_paid": round(sum(item["amount"] for item in completed), 2),
+        }
+        job["results"] = results
+        job["status"] = "completed"
+        self.db.transfer_batches.update_one({"_id": job["_id"]}, {"$set": {
+            "status": job["status"],
+            "summary": job["summary"],
+            "results": results,
+            "finished_at": datetime.now(UTC),
+        }})
+        return _batch_public(job), 200
+
+    def get(self, batch_id, user_id):
+        job = self.db.transfer_batches.find_one(
+            {"_id": ObjectId(batch_id), "user_id": str(user_id)}, {"items": 0}
+        )
+        if not job:
+            return {"error": "Batch not found"}, 404
+        return _batch_public(job), 200
@@ -0,0 +1,68 @@
+# benchmarks/account_number_bench.py
+"""
+Allocations per second of AccountNumberAllocator across worker processes.
+
+    python benchmarks/account_number_bench.py --processes 4 --per-process 20000 --block-size 100
+
+Each process stands in for a gunicorn worker with its own MongoClient and
+allocator, all sharing one counter document. The script checks that every
+number is unique and Luhn-valid and prints throughput and leases per second
+for a few block sizes if --block-size is given more than once.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from account_numbers import AccountNumberAllocator, is_valid_account_number  # noqa: E402
+
+
+def worker(args):
+    mongo_uri, database, block_size, count = args
+    client = MongoClient(mongo_uri)
+    allocator = AccountNumberAllocator(client[database], block_size=block_size)
+    numbers = [allocator.allocate() for _ in range(count)]
+    client.close()
+    return numbers
+
+
+def run(mongo_uri, database, processes, per_process, block_size):
+    client = MongoClient(mongo_uri)
+    client[database].counters.drop()
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(worker, [(mongo_uri, database, block_size, per_process)] * processes)
+    elapsed = time.perf_counter() - started
+    numbers = [n for chunk in results for n in chunk]
+    unique = len(set(numbers)) == len(numbers)
+    valid = all(is_valid_account_number(n) for n in numbers)
+    leases = -(-per_process // block_size) * processes
+    print(f"block={block_size:>6}  processes={processes}  allocations={len(numbers)}  "
+          f"{len(numbers) / elapsed:,.0f} alloc/s  leases={leases}  unique={unique}  luhn_valid={valid}")
+    client.drop_database(database)
+    client.close()
+    return unique and valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="bank_bench_account_numbers")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--per-process", type=int, default=10000)
+    parser.add_argument("--block-size", type=int, action="append")
+    args = parser.parse_args()
+
+    ok = True
+    for block_size in args.block_size or [1, 10, 100, 1000]:
+        ok = run(args.mongo_uri, args.database, args.processes, args.per_process, block_size) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+# benchmarks/api_bench.py
+"""
+End-to-end load test of the Banking API with a JSON baseline for regressions.
+
+    python benchmarks/api_bench.py --transactions 100000 --output baseline.json
+    python benchmarks/api_bench.py --transactions 100000 --compare baseline.json
+    python benchmarks/api_bench.py --mongomock --users 200 --transactions 10000 --requests 200
+
+Seeds users, accounts, verified beneficiaries and a transaction history at
+the requested scale (10k..10M rows, inserted in batches) into a throwaway
+database, then drives each scenario with --clients concurrent clients:
+
+  login                POST /api/auth/login
+  balance              GET  /api/user/balance
+  transactions         GET  /api/transactions
+  transactions_filter  GET  /api/transactions/filter (debits of one account, last 90 days)
+  transfer             POST /api/transfer/initiate + POST /api/transfer/verify
+
+By default the app runs in-process (Flask test client) against --mongo-uri,
+or against mongomock with --mongomock, and OTP mail goes through the real
+MailDispatcher into a fake SMTP sink started on localhost. With --base-url
+the same scenarios hit an already running server over HTTP; it must use the
+same database as --mongo-uri (the OTP codes are read back from `otps`) and
+should run with RATE_LIMIT_ENABLED=false.
+
+With --server sync|asgi the benchmark starts the server itself on a free
+port - gunicorn sync workers (app:app) or uvicorn running the async mode
+(asgi:app), --workers processes each - with OTP mail going to the sink, and
+records throughput per worker process. Comparing the two at a high --clients
+count shows how many concurrent requests one process can carry:
+
+    python benchmarks/api_bench.py --server sync --workers 1 --clients 64 --output sync.json
+    python benchmarks/api_bench.py --server asgi --workers 1 --clients 64 --compare sync.json
+
+Results (throughput and p50/p95/p99 latency per scenario, plus the commit and
+scale they were measured at) go to --output. --compare exits non-zero when a
+scenario's p95 or throughput is more than --tolerance worse than the baseline.
+Everything random is derived from --seed, so two runs at the same commit and
+scale issue the same requests.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socketserver
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from account_numbers import luhn_check_digit  # noqa: E402
+
+SCENARIOS = ["login", "balance", "transactions", "transactions_filter", "transfer"]
+PASSWORD = "bench-password"
+OPENING_BALANCE = 10 ** 12
+SEED_BATCH = 10000
+
+
+# ---------------------- FAKE SMTP SINK ----------------------
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Accepts and discards mail; just enough SMTP for smtplib."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _SMTPHandler)
+        self.received = 0
+        self.lock = threading.Lock()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 bench-sink\r\n")
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line.rstrip(b"\r\n") == b".":
+                    in_data = False
+                    with self.server.lock:
+                        self.server.received += 1
+                    self.wfile.write(b"250 OK\r\n")
+                continue
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.wfile.write(b"250-bench-sink\r\n250 AUTH PLAIN\r\n")
+            elif command == b"AUTH":
+                # Any credentials from .env are accepted
+                self.wfile.write(b"235 Authentication successful\r\n")
+            elif command == b"DATA":
+                in_data = True
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+# ---------------------- CLIENTS ----------------------
+class InProcessClient:
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        with self.app.test_client() as client:
+            response = client.open(path, method=method, json=body, headers=headers)
+            return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+# ---------------------- SERVERS ----------------------
+def app_env(args, sink):
+    """Environment for the app under test: mail to the sink, no rate limits, quiet logs."""
+    return {
+        "MONGO_URI": args.mongo_uri,
+        "MONGO_BOOTSTRAP_INDEXES": "false",
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": str(sink.server_address[1]),
+        "MAIL_USE_TLS": "false",
+        "MAIL_REQUIRE_AUTH": "false",
+        "MAIL_DEFAULT_SENDER": "bench@localhost",
+        "RATE_LIMIT_ENABLED": "false",
+        "PASSWORD_HASH_ROUNDS": str(args.hash_rounds),
+        "REQUEST_LOG_SAMPLE_RATE": "0",
+        "LOG_LEVEL": "WARNING",
+        "FLASK_DEBUG": "0",
+    }
+
+
+def start_server(kind, workers, env, timeout=60):
+    """Start gunicorn (sync) or uvicorn (asgi) on a free port; returns (process, base_url)."""
+    with socketserver.TCPServer(("127.0.0.1", 0), None) as probe:
+        port = probe.server_address[1]
+    if kind == "sync":
+        command = [sys.executable, "-m", "gunicorn", "--workers", str(workers),
+                   "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--workers", str(workers),
+                   "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, **env})
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{kind} server exited with {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + "/", timeout=1):
+                return process, base_url
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f"{kind} server did not start within {timeout}s")
+
+
+# ---------------------- SEEDING ----------------------
+def account_number(index):
+    base = str(200000000 + index).zfill(9)
+    return base + luhn_check_digit(base)
+
+
+def seed(db, users, transactions, password_hash, rng):
+    """Drop and re-seed the benchmark collections. Returns the seeded user records."""
+    for name in ("users", "accounts", "beneficiaries", "transactions", "otps", "pending_transfers",
+                 "monthly_rollups", "rate_limits"):
+        db[name].drop()
+
+    now = datetime.now(UTC)
+    records = []
+    for i in range(users):
+        records.append({
+            "user_id": ObjectId(),
+            "email": f"bench{i}@example.com",
+            "account_id": ObjectId(),
+            "account_number": account_number(i),
+            "beneficiary_id": ObjectId(),
+        })
+
+    for start in range(0, users, SEED_BATCH):
+        chunk = records[start:start + SEED_BATCH]
+        db.users.insert_many([{
+            "_id": r["user_id"], "name": f"Bench User {start + j}", "email": r["email"],
+            "password": password_hash, "address": "1 Bench Street", "date_of_birth": "1990-01-01",
+            # The app links accounts and beneficiaries by their string ids
+            "accounts": [str(r["account_id"])], "beneficiaries": [str(r["beneficiary_id"])], "created_at": now,
+        } for j, r in enumerate(chunk)], ordered=False)
+        db.accounts.insert_many([{
+            "_id": r["account_id"], "user_id": r["user_id"], "account_type": "savings", "balance": OPENING_BALANCE,
+            "status": "active", "verified": True, "account_number": r["account_number"], "created_at": now,
+        } for r in chunk], ordered=False)
+        # Every user pays the next one, so transfers stay internal and credit a real account.
+        # Same shape as POST /api/beneficiaries writes (string user_id, linked_user_id).
+        db.beneficiaries.insert_many([{
+            "_id": r["beneficiary_id"], "user_id": str(r["user_id"]), "name": "Next Bench User",
+            "account_number": records[(start + j + 1) % users]["account_number"], "ifsc": "BENCH0000001",
+            "email": records[(start + j + 1) % users]["email"], "bank_name": "Bench Bank",
+            "verified": True, "linked_user_id": records[(start + j + 1) % users]["user_id"],
+        } for j, r in enumerate(chunk)], ordered=False)
+
+    batch = []
+    for _ in range(transactions // 2):
+        i = rng.randrange(users)
+        sender, receiver = records[i], records[(i + 1) % users]
+        transfer_id = ObjectId()
+        timestamp = now - timedelta(seconds=rng.randrange(365 * 86400))
+        amount = round(rng.uniform(1, 5000), 2)
+        mode = rng.choice(["IMPS", "NEFT", "RTGS"])
+        for party, kind in ((sender, "debit"), (receiver, "credit")):
+            batch.append({
+                "transfer_id": transfer_id, "user_id": party["user_id"], "account_number": party["account_number"],
+                "beneficiary_id": sender["beneficiary_id"], "amount": amount, "transfer_mode": mode,
+                "type": kind, "timestamp": timestamp,
+            })
+        if len(batch) >= SEED_BATCH:
+            db.transactions.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.transactions.insert_many(batch, ordered=False)
+    return records
+
+
+# ---------------------- SCENARIOS ----------------------
+def latest_otp(db, delivery_id, email):
+    if delivery_id and ObjectId.is_valid(delivery_id):
+        record = db.otps.find_one({"_id": ObjectId(delivery_id)}, {"code": 1})
+        if record:
+            return record["code"]
+    record = db.otps.find_one({"email": email, "purpose": "transfer"}, {"code": 1}, sort=[("created_at", -1)])
+    return record and record["code"]
+
+
+def make_scenario(name, client, db, active, tokens):
+    since = (datetime.now(UTC) - timedelta(days=90)).strftime("%Y-%m-%d")
+    until = datetime.now(UTC).strftime("%Y-%m-%d")
+
+    def run(rng):
+        user = active[rng.randrange(len(active))]
+        token = tokens[user["email"]]
+        if name == "login":
+            return client.request("POST", "/api/auth/login", {"email": user["email"], "password": PASSWORD})[0]
+        if name == "balance":
+            return client.request("GET", "/api/user/balance", token=token)[0]
+        if name == "transactions":
+            return client.request("GET", "/api/transactions?limit=50", token=token)[0]
+        if name == "transactions_filter":
+            return client.request(
+                "GET",
+                f"/api/transactions/filter?account_number={user['account_number']}&type=debit"
+                f"&start_date={since}&end_date={until}&limit=50",
+                token=token,
+            )[0]
+        status, body = client.request("POST", "/api/transfer/initiate", {
+            "beneficiary_id": str(user["beneficiary_id"]), "amount": 1, "transfer_mode": "IMPS",
+            "from_acc_number": user["account_number"],
+        }, token=token)
+        if status != 200:
+            return status
+        code = latest_otp(db, body.get("delivery_id"), user["email"])
+        return client.request("POST", "/api/transfer/verify", {
+            "pending_transfer_id": body["pending_transfer_id"], "otp": code,
+        }, token=token)[0]
+    return run
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def drive(run, requests, clients, seed_value):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    per_client = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+
+    def client_loop(index):
+        rng = random.Random(seed_value * 1000 + index)
+        for _ in range(per_client[index]):
+            started = time.perf_counter()
+            try:
+                status = run(rng)
+            except Exception:
+                status = None
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status is None or status >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client_loop, range(clients)))
+    wall = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print a per-scenario comparison; return the scenarios that regressed."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        p95_change = current["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+        rps_change = current["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0
+        regressed = p95_change > tolerance or rps_change < -tolerance
+        print(f"  {name:<20} p95 {p95_change:+7.1%}  throughput {rps_change:+7.1%}" + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    if baseline.get("meta", {}).get("scale") != results["meta"]["scale"]:
+        print("  warning: baseline was measured at a different scale")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+# ---------------------- MAIN ----------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/bank_bench_api")
+    parser.add_argument("--mongomock", action="store_true", help="run in-process against mongomock")
+    parser.add_argument("--base-url", default=None, help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--server", choices=["sync", "asgi"], default=None,
+                        help="start gunicorn sync workers or the uvicorn async mode and benchmark it over HTTP")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for --server")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--active-users", type=int, default=100, help="users the clients act as")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="repeatable; default all")
+    parser.add_argument("--hash-rounds", type=int, default=4,
+                        help="bcrypt cost for the in-process app (login cost dominates otherwise)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse data seeded by a previous run")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--compare", default=None, help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.server and (args.base_url or args.mongomock):
+        parser.error("--server needs a real MongoDB and cannot be combined with --base-url or --mongomock")
+
+    sink = server = None
+    if args.base_url or args.server:
+        from pymongo import MongoClient
+        db = MongoClient(args.mongo_uri).get_default_database()
+        from hashing import PasswordHasher
+        password_hash = PasswordHasher(rounds=args.hash_rounds, workers=0).hash(PASSWORD)
+        base_url = args.base_url
+        if args.server:
+            sink = SMTPSink(("127.0.0.1", 0))
+            threading.Thread(target=sink.serve_forever, daemon=True).start()
+            server, base_url = start_server(args.server, args.workers, app_env(args, sink))
+        client = HTTPClient(base_url)
+    else:
+        sink = SMTPSink(("127.0.0.1", 0))
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        os.environ.update(app_env(args, sink))
+        if args.mongomock:
+            import connections
+            import mongomock
+            connections.MongoClient = lambda uri, **options: mongomock.MongoClient(uri)
+        import app as appmod
+        db = appmod.mongo.db
+        client = InProcessClient(appmod.app)
+        password_hash = appmod.bank_model.hasher.hash(PASSWORD)
+
+    rng = random.Random(args.seed)
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed(db, args.users, args.transactions, password_hash, rng)
+        from indexes import ensure_indexes
+        ensure_indexes(db)
+        print(f"seeded {args.users} users / {args.transactions} transactions in {time.perf_counter() - started:.1f}s")
+
+    active = [{
+        "email": f"bench{i}@example.com",
+        "account_number": account_number(i),
+        "beneficiary_id": db.users.find_one({"email": f"bench{i}@example.com"}, {"beneficiaries": 1})["beneficiaries"][0],
+    } for i in random.Random(args.seed).sample(range(args.users), min(args.active_users, args.users))]
+    tokens = {}
+    for user in active:
+        status, body = client.request("POST", "/api/auth/login", {"email": user["email"], "password": PASSWORD})
+        if status != 200:
+            sys.exit(f"login for {user['email']} failed with {status}: {body}")
+        tokens[user["email"]] = body["token"]
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "measured_at": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "target": args.base_url or ("mongomock" if args.mongomock else args.mongo_uri),
+            "server": {"mode": args.server, "workers": args.workers} if args.server else None,
+            "scale": {"users": args.users, "transactions": args.transactions, "active_users": len(active),
+                      "requests": args.requests, "clients": args.clients, "seed": args.seed},
+        },
+        "scenarios": {},
+    }
+    for name in args.scenario or SCENARIOS:
+        run = make_scenario(name, client, db, active, tokens)
+        results["scenarios"][name] = stats = drive(run, args.requests, args.clients, args.seed)
+        if args.server:
+            stats["throughput_rps_per_worker"] = round(stats["throughput_rps"] / args.workers, 2)
+        print(f"{name:<20} {stats['throughput_rps']:9.1f} req/s  p50={stats['p50_ms']:8.2f}  "
+              f"p95={stats['p95_ms']:8.2f}  p99={stats['p99_ms']:8.2f} ms  errors={stats['errors']}")
+
+    if server is not None:
+        server.terminate()
+        server.wait(timeout=30)
+    elif sink is not None:
+        appmod.mail_dispatcher.wait_idle(timeout=60)
+    if sink is not None:
+        results["meta"]["otp_mails_received"] = sink.received
+        sink.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        print(f"compared with {args.compare} (commit {baseline.get('meta', {}).get('commit')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
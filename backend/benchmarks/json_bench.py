@@ -0,0 +1,96 @@
+# benchmarks/json_bench.py
+"""
+Serialization throughput of a /api/transactions response body.
+
+    python benchmarks/json_bench.py --rows 10000 --repeat 20
+
+Builds ROWS journal rows shaped like transactions documents (ObjectIds and a
+datetime per row) and times turning them into a response body:
+  legacy     - the old handler path: a per-row loop converting ids with str(),
+               then Flask's default (stdlib json) provider
+  orjson     - json_provider.OrjsonProvider, ids and dates encoded natively,
+               RFC 1123 dates (JSON_DATETIME_FORMAT=http, the default)
+  orjson-iso - the same with ISO 8601 dates (JSON_DATETIME_FORMAT=iso)
+Each encoder gets fresh copies of the rows, as a handler gets from a cursor.
+"""
+import argparse
+import copy
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_provider import OrjsonProvider  # noqa: E402
+
+
+def make_rows(count, seed=1):
+    rng = random.Random(seed)
+    user_id = ObjectId()
+    now = datetime.now(UTC).replace(tzinfo=None)
+    return [{
+        "_id": ObjectId(),
+        "transfer_id": ObjectId(),
+        "user_id": user_id,
+        "account_number": "1000000008",
+        "beneficiary_id": ObjectId(),
+        "amount": round(rng.uniform(1, 5000), 2),
+        "transfer_mode": rng.choice(["IMPS", "NEFT", "RTGS"]),
+        "type": rng.choice(["debit", "credit"]),
+        "timestamp": now - timedelta(seconds=rng.randrange(365 * 86400)),
+    } for _ in range(count)]
+
+
+def legacy(app):
+    provider = DefaultJSONProvider(app)
+
+    def encode(rows):
+        for t in rows:
+            t["_id"] = str(t["_id"])
+            t["user_id"] = str(t["user_id"])
+            t["beneficiary_id"] = str(t.get("beneficiary_id"))
+            if "transfer_id" in t:
+                t["transfer_id"] = str(t["transfer_id"])
+        return provider.dumps({"transactions": rows, "next_cursor": None}).encode("utf-8")
+
+    return encode
+
+
+def native(app, datetime_format):
+    provider = OrjsonProvider(app, datetime_format=datetime_format)
+    return lambda rows: provider.encoder.encode({"transactions": rows, "next_cursor": None})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    rows = make_rows(args.rows)
+    encoders = {"legacy": legacy(app), "orjson": native(app, "http"), "orjson-iso": native(app, "iso")}
+    baseline = None
+    for name, encode in encoders.items():
+        timings, size = [], 0
+        for _ in range(args.repeat):
+            batch = copy.deepcopy(rows)
+            started = time.perf_counter()
+            size = len(encode(batch))
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        baseline = baseline or statistics.median(timings)
+        print(f"{name:<11} median={statistics.median(timings) * 1000:7.2f} ms  best={best * 1000:7.2f} ms  "
+              f"{args.rows / statistics.median(timings):10.0f} rows/s  {size / 1024:7.1f} KiB  "
+              f"x{baseline / statistics.median(timings):.1f}")
+
+
+if __name__ == "__main__":
+    main()
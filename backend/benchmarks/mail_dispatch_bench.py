@@ -0,0 +1,75 @@
+# benchmarks/mail_dispatch_bench.py
+"""
+Push OTP mail through MailDispatcher into a local stand-in SMTP server.
+
+    pip install aiosmtpd
+    python benchmarks/mail_dispatch_bench.py --messages 2000 --workers 4
+
+Starts an aiosmtpd sink on localhost (or uses --smtp-host/--smtp-port for an
+already running one, e.g. `python -m aiosmtpd -n -l localhost:8025`), submits
+the messages and reports submit latency, delivery throughput and how many
+SMTP connections were opened.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailer import MailDispatcher  # noqa: E402
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--smtp-host", default=None, help="use an external SMTP sink instead of starting one")
+    parser.add_argument("--smtp-port", type=int, default=8025)
+    args = parser.parse_args()
+
+    controller = handler = None
+    host = args.smtp_host
+    if host is None:
+        from aiosmtpd.controller import Controller
+        handler = CountingHandler()
+        controller = Controller(handler, hostname="127.0.0.1", port=args.smtp_port)
+        controller.start()
+        host = "127.0.0.1"
+
+    dispatcher = MailDispatcher(
+        server=host, port=args.smtp_port, default_sender="bench@localhost",
+        workers=args.workers, batch_size=args.batch_size, queue_size=args.messages,
+    )
+
+    submit_ms = []
+    started = time.perf_counter()
+    for i in range(args.messages):
+        t0 = time.perf_counter()
+        dispatcher.submit(f"user{i}@example.com", "Your Transfer OTP", f"Your transfer OTP is {i:06d}.")
+        submit_ms.append((time.perf_counter() - t0) * 1000)
+    dispatcher.wait_idle(timeout=300)
+    elapsed = time.perf_counter() - started
+
+    print(f"messages: {args.messages}  workers: {args.workers}  batch size: {args.batch_size}")
+    print(f"submit latency ms: p50={statistics.median(submit_ms):.3f} max={max(submit_ms):.3f}")
+    print(f"delivery throughput: {args.messages / elapsed:.0f} msg/s over {elapsed:.2f}s")
+    print(f"dispatcher stats: {dispatcher.stats}")
+    if handler is not None:
+        print(f"received by sink: {handler.received}")
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/password_hash_bench.py
+"""
+Logins per second through PasswordHasher at several cost settings.
+
+    python benchmarks/password_hash_bench.py --algorithm bcrypt --rounds 8 --rounds 10 --rounds 12 --workers 4
+
+For each cost, CLIENTS threads verify a password against a stored hash for
+DURATION seconds, as concurrent logins on one gunicorn worker would. Reports
+successful verifies per second and how many calls were shed with HasherBusy
+(what the API turns into 429s) at the configured --max-pending.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashing import HasherBusy, PasswordHasher  # noqa: E402
+
+
+def run(algorithm, rounds, workers, max_pending, clients, duration):
+    hasher = PasswordHasher(algorithm=algorithm, rounds=rounds, workers=workers, max_pending=max_pending)
+    stored = hasher.hash("correct horse battery staple")
+    ok, shed, latencies = [0], [0], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                assert hasher.verify("correct horse battery staple", stored)
+            except HasherBusy:
+                with lock:
+                    shed[0] += 1
+                time.sleep(0.001)
+                continue
+            with lock:
+                ok[0] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    p50 = statistics.median(latencies) if latencies else 0
+    print(f"{algorithm:<7} rounds={rounds:<7} workers={workers} clients={clients}  "
+          f"{ok[0] / duration:8.1f} logins/s  p50={p50:7.1f} ms  shed={shed[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--algorithm", default="bcrypt", choices=["bcrypt", "pbkdf2", "scrypt"])
+    parser.add_argument("--rounds", type=int, action="append")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--max-pending", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    defaults = {"bcrypt": [8, 10, 12], "pbkdf2": [100000, 300000, 600000], "scrypt": [0]}
+    for rounds in args.rounds or defaults[args.algorithm]:
+        run(args.algorithm, rounds, args.workers, args.max_pending, args.clients, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# benchmarks/transfer_bench.py
+"""
+Hammer one hot account with concurrent transfers and check nothing is lost.
+
+    python benchmarks/transfer_bench.py --transfers 5000 --workers 64
+    python benchmarks/transfer_bench.py --mongo-uri mongodb://localhost:27017/?replicaSet=rs0 --transactions
+
+Seeds a throwaway database, runs the transfers through TransferEngine from a
+thread pool, then verifies that the sender balance, receiver balance and the
+journal all agree with the number of successful transfers. Reports latency
+percentiles and Mongo commands per transfer.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient, monitoring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers import TransferEngine  # noqa: E402
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(db, opening_balance):
+    db.accounts.drop()
+    db.transactions.drop()
+    sender_user, receiver_user = ObjectId(), ObjectId()
+    db.accounts.insert_many([
+        {"user_id": sender_user, "account_number": "1000000001", "balance": opening_balance, "status": "active"},
+        {"user_id": receiver_user, "account_number": "1000000002", "balance": 0, "status": "active"},
+    ])
+    db.accounts.create_index("account_number", unique=True)
+    db.accounts.create_index([("user_id", 1), ("account_number", 1)])
+    beneficiary = {"_id": ObjectId(), "account_number": "1000000002"}
+    return sender_user, beneficiary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="bank_bench_transfers")
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--amount", type=float, default=1.0)
+    parser.add_argument("--opening-balance", type=float, default=None,
+                        help="defaults to 3/4 of the total so some transfers must be refused")
+    parser.add_argument("--transactions", action="store_true", help="use multi-document transactions")
+    args = parser.parse_args()
+
+    opening = args.opening_balance
+    if opening is None:
+        opening = args.amount * (args.transfers * 3 // 4)
+
+    counter = CommandCounter()
+    client = MongoClient(args.mongo_uri, event_listeners=[counter], maxPoolSize=args.workers)
+    db = client[args.database]
+    sender_user, beneficiary = seed(db, opening)
+    engine = TransferEngine(db, use_transactions=args.transactions)
+    source_filter = {"user_id": sender_user, "account_number": "1000000001"}
+
+    commands_before = counter.count
+
+    def one(_):
+        result, status = engine.transfer(source_filter, beneficiary, args.amount, "IMPS", sender_user)
+        return status, result.get("latency_ms")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        outcomes = list(pool.map(one, range(args.transfers)))
+    elapsed = time.perf_counter() - started
+
+    ok = [latency for status, latency in outcomes if status == 200]
+    refused = len(outcomes) - len(ok)
+    sender = db.accounts.find_one({"account_number": "1000000001"})
+    receiver = db.accounts.find_one({"account_number": "1000000002"})
+    debits = db.transactions.count_documents({"type": "debit"})
+    credits = db.transactions.count_documents({"type": "credit"})
+
+    expected_moved = len(ok) * args.amount
+    consistent = (
+        abs(sender["balance"] - (opening - expected_moved)) < 1e-6
+        and abs(receiver["balance"] - expected_moved) < 1e-6
+        and debits == credits == len(ok)
+        and sender["balance"] >= 0
+    )
+
+    print(f"transfers: {len(outcomes)}  ok: {len(ok)}  refused: {refused}  workers: {args.workers}")
+    print(f"throughput: {len(outcomes) / elapsed:.0f} transfers/s over {elapsed:.2f}s")
+    if ok:
+        print(f"latency ms: p50={statistics.median(ok):.2f} p95={percentile(ok, 95):.2f} p99={percentile(ok, 99):.2f}")
+    print(f"mongo commands per transfer: {(counter.count - commands_before) / len(outcomes):.2f}")
+    print(f"balances: sender={sender['balance']} receiver={receiver['balance']}  journal: {debits} debit / {credits} credit")
+    print("consistent: " + ("yes" if consistent else "NO - lost or duplicated updates"))
+
+    client.drop_database(args.database)
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# connections.py
+"""
+Per-process MongoDB clients, pool sizing and read routing.
+
+A MongoClient must not be used across a fork: its pooled sockets and monitor
+threads belong to the process that opened them. app.py builds every component
+at import time, which under `gunicorn --preload` (and for the index bootstrap)
+happens in the master before the workers fork. MongoConnections therefore
+creates its client lazily, the first time a process touches the database, and
+again in every forked worker (the same per-pid check as the mail dispatcher and
+hasher pools). Components are handed `db` / `read_db`, handles that resolve to
+the current process's database on each access, so they can still be built at
+import time.
+
+Pool sizing and timeouts come from the app config (MONGO_MAX_POOL_SIZE,
+MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS). Every pool is
+per worker: a deployment opens up to workers x MONGO_MAX_POOL_SIZE connections
+per server.
+
+`read_db` is the same database with MONGO_READ_PREFERENCE (default "primary")
+and, for the secondary modes, MONGO_MAX_STALENESS_SECONDS (at least 90, or -1
+for no bound). Read-only listings use it; anything written through it still
+goes to the primary. To try it against a local replica set:
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0-1
+    mongosh --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}]})'
+    MONGO_URI="mongodb://localhost:27017,localhost:27018/bank_app?replicaSet=rs0" \\
+    MONGO_READ_PREFERENCE=secondaryPreferred MONGO_MAX_STALENESS_SECONDS=90 \\
+        gunicorn -w 4 --preload app:app
+
+GET /health lists each server's role, and the mongo_pool_* metrics on
+/metrics show which server's pool the listings check connections out of.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+# Smallest bound the server accepts (heartbeat + idle write period)
+MIN_MAX_STALENESS_SECONDS = 90
+
+
+def make_read_preference(mode, max_staleness_seconds=-1):
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        return Primary()
+    if max_staleness_seconds != -1 and max_staleness_seconds < MIN_MAX_STALENESS_SECONDS:
+        raise ValueError(f"maxStalenessSeconds must be at least {MIN_MAX_STALENESS_SECONDS} (or -1 for no bound)")
+    return READ_PREFERENCES[mode](max_staleness=max_staleness_seconds)
+
+
+def _address(address):
+    return f"{address[0]}:{address[1]}"
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool (CMAP) events of one client, counted per server."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._servers = defaultdict(lambda: {"open": 0, "in_use": 0, "checkouts": 0, "wait_seconds": 0.0,
+                                             "cleared": 0, "failures": defaultdict(int)})
+
+    def snapshot(self):
+        """{server: {open, in_use, checkouts, wait_seconds, cleared, failures: {reason: n}}}"""
+        with self._lock:
+            return {address: {**stats, "failures": dict(stats["failures"])}
+                    for address, stats in self._servers.items()}
+
+    def _add(self, address, field, amount=1):
+        with self._lock:
+            self._servers[_address(address)][field] += amount
+
+    def _waited(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return 0.0 if started is None else time.perf_counter() - started
+
+    def connection_created(self, event):
+        self._add(event.address, "open")
+
+    def connection_closed(self, event):
+        self._add(event.address, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            stats = self._servers[_address(event.address)]
+            stats["in_use"] += 1
+            stats["checkouts"] += 1
+            stats["wait_seconds"] += waited
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited()
+        with self._lock:
+            stats = self._servers[_address(event.address)]
+            stats["failures"][event.reason] += 1
+            stats["wait_seconds"] += waited
+
+    def connection_checked_in(self, event):
+        self._add(event.address, "in_use", -1)
+
+    def pool_cleared(self, event):
+        self._add(event.address, "cleared")
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+class DatabaseHandle:
+    """Stands in for a pymongo Database: every access goes to the current process's client."""
+
+    def __init__(self, connections, read=False):
+        self._connections = connections
+        self._read = read
+
+    def _database(self):
+        return self._connections.database(self._read)
+
+    def __getattr__(self, name):
+        return getattr(self._database(), name)
+
+    def __getitem__(self, name):
+        return self._database()[name]
+
+    def __repr__(self):
+        return f"DatabaseHandle({self._connections.uri!r}, read={self._read})"
+
+
+class MongoConnections:
+    def __init__(self, uri, max_pool_size=100, min_pool_size=0, max_idle_time_ms=None,
+                 wait_queue_timeout_ms=None, server_selection_timeout_ms=30000, connect_timeout_ms=20000,
+                 read_preference="primary", max_staleness_seconds=-1, event_listeners=()):
+        self.uri = uri
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.server_selection_timeout_ms = server_selection_timeout_ms
+        self.connect_timeout_ms = connect_timeout_ms
+        self.read_preference = make_read_preference(read_preference, max_staleness_seconds)
+        self.event_listeners = list(event_listeners)
+        self.pools = {}
+        self.db = DatabaseHandle(self)
+        self.read_db = DatabaseHandle(self, read=True)
+        self._client = None
+        self._database = None
+        self._read_database = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            uri=config.get("MONGO_URI"),
+            max_pool_size=config.get("MONGO_MAX_POOL_SIZE", 100),
+            min_pool_size=config.get("MONGO_MIN_POOL_SIZE", 0),
+            max_idle_time_ms=config.get("MONGO_MAX_IDLE_TIME_MS") or None,
+            wait_queue_timeout_ms=config.get("MONGO_WAIT_QUEUE_TIMEOUT_MS") or None,
+            server_selection_timeout_ms=config.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000),
+            connect_timeout_ms=config.get("MONGO_CONNECT_TIMEOUT_MS", 20000),
+            read_preference=config.get("MONGO_READ_PREFERENCE", "primary"),
+            max_staleness_seconds=config.get("MONGO_MAX_STALENESS_SECONDS", -1),
+            **kwargs
+        )
+
+    # ---------------------- CLIENTS ----------------------
+    @property
+    def client(self):
+        self._ensure_client()
+        return self._client
+
+    def database(self, read=False):
+        self._ensure_client()
+        return self._read_database if read else self._database
+
+    def client_options(self, name):
+        """
+        MongoClient keyword arguments with the configured pool and timeouts, for
+        another client of this process (the Motor client in asgi.py); its pool
+        is reported as `name`.
+        """
+        self._ensure_client()
+        return self._options(name)
+
+    def _options(self, name):
+        monitor = self.pools[name] = PoolMonitor()
+        options = {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "maxIdleTimeMS": self.max_idle_time_ms,
+            "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+        }
+        return {**{k: v for k, v in options.items() if v is not None},
+                "event_listeners": [*self.event_listeners, monitor]}
+
+    def _ensure_client(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A client inherited from the parent is left alone: closing it here
+            # would shut sockets the parent is still using
+            self.pools = {}
+            self._client = MongoClient(self.uri, **self._options("pymongo"))
+            self._database = self._client.get_default_database()
+            self._read_database = self._database.with_options(read_preference=self.read_preference)
+            self._pid = os.getpid()
+
+    # ---------------------- HEALTH ----------------------
+    def pool_stats(self):
+        """{client name: PoolMonitor.snapshot()} for this process (empty before its first query)."""
+        if self._pid != os.getpid():
+            return {}
+        return {name: monitor.snapshot() for name, monitor in self.pools.items()}
+
+    def health(self):
+        """Ping the deployment and describe the servers and this worker's pools."""
+        client = self.client
+        try:
+            self._database.command("ping")
+            status, error = "ok", None
+        except PyMongoError as e:
+            status, error = "unavailable", str(e)
+        servers = {
+            _address(address): {
+                "type": description.server_type_name,
+                "round_trip_ms": None if description.round_trip_time is None
+                else round(description.round_trip_time * 1000, 1),
+            }
+            for address, description in client.topology_description.server_descriptions().items()
+        }
+        result = {
+            "status": status,
+            "pid": os.getpid(),
+            "topology": client.topology_description.topology_type_name,
+            "read_preference": self.read_preference.document,
+            "servers": servers,
+            "pools": self.pool_stats(),
+        }
+        if error:
+            return {**result, "error": error}, 503
+        return result, 200
@@ -0,0 +1,126 @@
+# directory.py
+"""
+Bank-wide directory of verified beneficiary accounts.
+
+One `beneficiary_directory` document per account number (the _id), written
+when add_beneficiary verifies an account, so the directory holds each payee
+once however many customers have added it. Lookups are prefix searches on
+the account number (_id index) or the lower-cased name (name_lower index),
+keyset-paginated, instead of pulling every other user's beneficiaries.
+
+rebuild() backfills the directory from `beneficiaries`.
+"""
+import base64
+import json
+import re
+from datetime import datetime, UTC
+
+from pymongo import ASCENDING, UpdateOne
+
+from pagination import clamp_page_size
+
+PUBLIC_FIELDS = ("account_number", "name", "bank_name")
+
+
+def _encode(values):
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode("ascii")))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+class BeneficiaryDirectory:
+    def __init__(self, db):
+        self.db = db
+
+    # ---------------------- WRITE PATH ----------------------
+    @staticmethod
+    def _entry_update(beneficiary):
+        """(filter, update) upserting `beneficiary`'s account into the directory."""
+        name = beneficiary.get("name") or ""
+        return (
+            {"_id": beneficiary["account_number"]},
+            {
+                # The first verified name wins; later adders do not rename the payee
+                "$setOnInsert": {
+                    "account_number": beneficiary["account_number"],
+                    "name": name,
+                    "name_lower": name.lower(),
+                    "bank_name": beneficiary.get("bank_name"),
+                    "created_at": datetime.now(UTC),
+                },
+                "$inc": {"added_by": 1},
+            },
+        )
+
+    def record(self, beneficiary):
+        """Add a newly verified beneficiary's account to the directory."""
+        self.db.beneficiary_directory.update_one(*self._entry_update(beneficiary), upsert=True)
+
+    def rebuild(self, batch_size=1000):
+        """Rebuild the directory from every verified beneficiary. Returns the entry count."""
+        self.db.beneficiary_directory.delete_many({})
+        ops = []
+        cursor = self.db.beneficiaries.find(
+            {"verified": True}, {"account_number": 1, "name": 1, "bank_name": 1}
+        ).sort("_id", ASCENDING).batch_size(batch_size)
+        for beneficiary in cursor:
+            ops.append(UpdateOne(*self._entry_update(beneficiary), upsert=True))
+            if len(ops) >= batch_size:
+                self.db.beneficiary_directory.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.db.beneficiary_directory.bulk_write(ops, ordered=False)
+        return self.db.beneficiary_directory.count_documents({})
+
+    # ---------------------- READ PATH ----------------------
+    def search(self, q, limit=None, cursor=None):
+        """
+        Directory entries whose account number (all-digit `q`) or name starts
+        with `q`, in key order. Returns ({"entries", "next_cursor"}, 200) or
+        ({"error"}, 400).
+        """
+        q = (q or "").strip()
+        if not q:
+            return {"error": "q is required"}, 400
+        limit = clamp_page_size(limit)
+        try:
+            after = _decode(cursor) if cursor else None
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        if q.isdigit():
+            keys = ["_id"]
+            query = {"_id": {"$regex": f"^{re.escape(q)}"}}
+        else:
+            keys = ["name_lower", "_id"]
+            query = {"name_lower": {"$regex": f"^{re.escape(q.lower())}"}}
+        if after:
+            if len(after) != len(keys):
+                return {"error": "Invalid cursor"}, 400
+            if len(keys) == 1:
+                query = {"$and": [query, {"_id": {"$gt": after[0]}}]}
+            else:
+                query = {"$and": [query, {"$or": [
+                    {"name_lower": {"$gt": after[0]}},
+                    {"name_lower": after[0], "_id": {"$gt": after[1]}},
+                ]}]}
+
+        docs = list(self.db.beneficiary_directory
+                    .find(query, {"name_lower": 1, **{field: 1 for field in PUBLIC_FIELDS}})
+                    .sort([(k, ASCENDING) for k in keys])
+                    .limit(limit + 1))
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = _encode([docs[-1][k] for k in keys])
+        entries = [{field: doc.get(field) for field in PUBLIC_FIELDS} for doc in docs]
+        return {"entries": entries, "next_cursor": next_cursor}, 200
@@ -0,0 +1,237 @@
+# events.py
+"""
+Server-sent events push channel for balance and transaction updates.
+
+EventHub keeps, per user, the set of open event streams and fans each new
+journal row out only to that user's streams. Every stream owns a small
+bounded queue; publishing appends to it and wakes the stream, so the cost of
+a transfer is proportional to the streams of the two users involved, not to
+the number of connected clients. A stream that falls too far behind is told
+to resync (refetch over REST) instead of buffering without bound.
+
+Rows reach the hub from one of two sources (EVENTS_SOURCE):
+  local        - a TransferEngine listener; sees the transfers written by this
+                 process only, so app.py refuses it with WEB_CONCURRENCY > 1.
+  changestream - one watcher thread per process on a `transactions` change
+                 stream; sees every worker's writes (needs a replica set). The
+                 default when there is more than one worker.
+
+Open streams wait to be woken rather than polling Mongo. Under WSGI each one
+still holds a worker thread for as long as the client stays connected; asgi.py
+serves GET /api/events natively, where a stream is an AsyncSubscription
+awaited on the event loop and costs no thread at all.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+
+from streaming import encode_row
+
+logger = logging.getLogger(__name__)
+
+# Journal fields pushed to clients as a "transaction" event
+TRANSACTION_FIELDS = ("_id", "transfer_id", "account_number", "beneficiary_id", "amount",
+                      "transfer_mode", "type", "timestamp", "batch_id")
+
+# How much earlier than its _id a journal row's timestamp may be (slow inserts)
+REPLAY_SLACK = timedelta(minutes=5)
+
+
+def format_event(event, data, event_id=None):
+    """One text/event-stream frame."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {encode_row(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def transaction_event(entry):
+    return {field: entry[field] for field in TRANSACTION_FIELDS if field in entry}
+
+
+class Subscription:
+    def __init__(self, user_id, max_pending):
+        self.user_id = user_id
+        self.max_pending = max_pending
+        self.overflowed = False
+        self._events = deque()
+        self._ready = threading.Condition()
+
+    def push(self, event):
+        with self._ready:
+            if len(self._events) >= self.max_pending:
+                self._events.clear()
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._ready.notify()
+        self._wake()
+
+    def _wake(self):
+        pass
+
+    def _pending(self):
+        with self._ready:
+            return bool(self._events) or self.overflowed
+
+    def _take(self):
+        with self._ready:
+            events, overflowed = list(self._events), self.overflowed
+            self._events.clear()
+            self.overflowed = False
+        return events, overflowed
+
+    def wait(self, timeout):
+        """
+        Block up to `timeout` seconds for events. Returns (events, overflowed);
+        an overflowed stream has lost events and should resync.
+        """
+        with self._ready:
+            if not self._events and not self.overflowed:
+                self._ready.wait(timeout)
+        return self._take()
+
+
+class AsyncSubscription(Subscription):
+    """
+    A Subscription awaited on an event loop (asgi.py). Rows are still pushed
+    from other threads (transfer listeners run in the default executor, the
+    change stream has its own thread), so a push wakes the loop thread-safely.
+    """
+
+    def __init__(self, user_id, max_pending, loop):
+        super().__init__(user_id, max_pending)
+        self._loop = loop
+        self._pushed = asyncio.Event()
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._pushed.set)
+        except RuntimeError:
+            # The loop has shut down, and the stream with it
+            pass
+
+    async def wait(self, timeout):
+        """Same contract as Subscription.wait, without blocking the loop."""
+        if not self._pending():
+            try:
+                await asyncio.wait_for(self._pushed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        # Cleared before taking the rows: a push after this point wakes the next wait
+        self._pushed.clear()
+        return self._take()
+
+
+class EventHub:
+    def __init__(self, db, source="local", max_streams=1000, max_pending=100):
+        if source not in ("local", "changestream"):
+            raise ValueError(f"Unknown event source: {source}")
+        self.db = db
+        self.source = source
+        self.max_streams = max_streams
+        self.max_pending = max_pending
+        self.stats = {"published": 0, "delivered": 0, "overflowed": 0, "rejected": 0}
+        self._streams = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def connected(self):
+        return self._count
+
+    # ---------------------- STREAMS ----------------------
+    def subscribe(self, user_id, loop=None):
+        """
+        A Subscription for `user_id` (an AsyncSubscription woken on `loop`, if
+        given), or None when this worker is at max_streams.
+        """
+        if self.source == "changestream":
+            self._ensure_watching()
+        if loop is None:
+            subscription = Subscription(str(user_id), self.max_pending)
+        else:
+            subscription = AsyncSubscription(str(user_id), self.max_pending, loop)
+        with self._lock:
+            if self._count >= self.max_streams:
+                self.stats["rejected"] += 1
+                return None
+            self._streams[subscription.user_id].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            streams = self._streams.get(subscription.user_id)
+            if streams and subscription in streams:
+                streams.discard(subscription)
+                self._count -= 1
+                if not streams:
+                    del self._streams[subscription.user_id]
+
+    # ---------------------- PUBLISHING ----------------------
+    def publish(self, user_id, event):
+        with self._lock:
+            streams = list(self._streams.get(str(user_id), ()))
+            self.stats["published"] += 1
+            self.stats["delivered"] += len(streams)
+        for subscription in streams:
+            if subscription.overflowed:
+                continue
+            subscription.push(event)
+            if subscription.overflowed:
+                with self._lock:
+                    self.stats["overflowed"] += 1
+
+    def record(self, entries, session=None):
+        """TransferEngine listener (local source): publish each journal row to its owner."""
+        for entry in entries:
+            self.publish(entry["user_id"], transaction_event(entry))
+
+    def replay(self, user_id, last_event_id, limit=100):
+        """Journal rows of `user_id` written after event `last_event_id` (a reconnecting client's Last-Event-ID)."""
+        if not ObjectId.is_valid(last_event_id or ""):
+            return []
+        after = ObjectId(last_event_id)
+        # A row's _id is assigned at insert, just after its timestamp: bounding the
+        # timestamp too keeps the scan to the tail of the user's journal index range
+        rows = self.db.transactions.find({
+            "user_id": ObjectId(str(user_id)),
+            "timestamp": {"$gte": after.generation_time - REPLAY_SLACK},
+            "_id": {"$gt": after},
+        }).sort("_id", 1).limit(limit)
+        return [transaction_event(row) for row in rows]
+
+    # ---------------------- CHANGE STREAM ----------------------
+    def _ensure_watching(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive a fork: start this process's watcher
+            threading.Thread(target=self._watch, name="events-change-stream", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _watch(self):
+        resume_token = None
+        # Rows without a user_id are the bank's own ledger legs (see ledger.py)
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.user_id": {"$ne": None}}}]
+        while True:
+            try:
+                with self.db.transactions.watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        row = change["fullDocument"]
+                        self.publish(row["user_id"], transaction_event(row))
+            except PyMongoError:
+                logger.exception("Transaction change stream failed; reconnecting")
+                time.sleep(1)
@@ -0,0 +1,104 @@
+# hashing.py
+"""
+Password hashing off the request thread.
+
+PasswordHasher runs every hash and verify in a small process pool so that a
+login storm burns pool CPU rather than pinning every gunicorn worker, and
+caps how many hashing calls a worker may have in flight. Past that cap calls
+raise HasherBusy straight away (the routes answer 429) instead of queueing
+without bound.
+
+Supported algorithms:
+  bcrypt - `rounds` is the bcrypt cost factor (default)
+  pbkdf2 - werkzeug pbkdf2:sha256, `rounds` is the iteration count
+  scrypt - werkzeug scrypt with its default parameters
+
+verify() accepts hashes from any of them, including the werkzeug hashes
+stored before this module existed; needs_rehash() tells the login path
+when a stored hash should be upgraded to the configured algorithm/cost.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    import bcrypt
+except ImportError:  # pragma: no cover - bcrypt is in requirements.txt
+    bcrypt = None
+
+ALGORITHMS = ("bcrypt", "pbkdf2", "scrypt")
+
+
+class HasherBusy(Exception):
+    """Raised when this worker already has the maximum number of hashing calls in flight."""
+
+
+# Module-level so they can be pickled into the process pool
+def _hash(password, algorithm, rounds):
+    if algorithm == "bcrypt":
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("ascii")
+    if algorithm == "pbkdf2":
+        return generate_password_hash(password, method=f"pbkdf2:sha256:{rounds}")
+    return generate_password_hash(password, method="scrypt")
+
+
+def _verify(password, hashed):
+    if hashed.startswith(("$2a$", "$2b$", "$2y$")):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("ascii"))
+    return check_password_hash(hashed, password)
+
+
+class PasswordHasher:
+    def __init__(self, algorithm="bcrypt", rounds=12, workers=2, max_pending=8):
+        """
+        `workers` is the process pool size (0 hashes inline on the calling
+        thread); `max_pending` caps in-flight hash/verify calls per process.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+        if algorithm == "bcrypt" and bcrypt is None:
+            raise RuntimeError("bcrypt is not installed")
+        self.algorithm = algorithm
+        self.rounds = rounds
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self._call(_hash, password, self.algorithm, self.rounds)
+
+    def verify(self, password, hashed):
+        if not hashed:
+            return False
+        return self._call(_verify, password, hashed)
+
+    def needs_rehash(self, hashed):
+        if self.algorithm == "bcrypt":
+            # $2b$<cost>$...
+            return not hashed.startswith(f"$2b${self.rounds:02d}$")
+        if self.algorithm == "pbkdf2":
+            return not hashed.startswith(f"pbkdf2:sha256:{self.rounds}$")
+        return not hashed.startswith("scrypt:")
+
+    def _call(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password operations in progress")
+        try:
+            if not self.workers:
+                return fn(*args)
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # A pool inherited across fork belongs to the parent
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._pool
@@ -0,0 +1,207 @@
+# indexes.py
+"""
+Index declarations for every collection the Banking API queries, plus a
+query-plan audit that fails if a registered query falls back to a COLLSCAN.
+
+Each entry in INDEXES names the queries in models.py / app.py it serves so the
+two can be kept in step when a query shape changes.
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from archive import ARCHIVE_INDEXES, STATE_ID as ARCHIVE_STATE_ID
+
+# How long an unconfirmed transfer is kept before the TTL monitor removes it.
+# Matches the 10 minute OTP lifetime with some slack for slow mail delivery.
+PENDING_TRANSFER_TTL_SECONDS = 15 * 60
+
+
+INDEXES = {
+    "users": [
+        # create_user / authenticate_user / register_initiate duplicate check
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "accounts": [
+        # transfers and add_beneficiary look accounts up by number
+        IndexModel([("account_number", ASCENDING)], name="account_number_unique", unique=True),
+        # get_user_accounts / get_user_balance / transfer_money (user_id + status)
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status"),
+        # transfer_initiate / transfer_verify (user_id + account_number)
+        IndexModel([("user_id", ASCENDING), ("account_number", ASCENDING)], name="user_account_number"),
+    ],
+    "beneficiaries": [
+        # get_beneficiaries (own list) and the add_beneficiary duplicate check
+        IndexModel([("user_id", ASCENDING), ("account_number", ASCENDING)], name="user_account_number"),
+    ],
+    "beneficiary_directory": [
+        # BeneficiaryDirectory.search by name prefix (account number prefixes use _id)
+        IndexModel([("name_lower", ASCENDING), ("_id", ASCENDING)], name="name_lower_id"),
+    ],
+    "otps": [
+        # MongoOTPStore: the live OTP for (email, purpose); create() supersedes by (created_at, _id)
+        IndexModel(
+            [("email", ASCENDING), ("purpose", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="email_purpose_created_id",
+        ),
+        # expired OTPs are removed by the TTL monitor instead of on next verify
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "pending_transfers": [
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=PENDING_TRANSFER_TTL_SECONDS,
+        ),
+    ],
+    "transactions": [
+        # Every customer read of the journal (see journal.py) filters on user_id
+        # and a timestamp range and sorts on (timestamp, _id) either way:
+        # get_transactions, transactions_filter, statement generation, event
+        # replay and Ledger.balance_as_of
+        IndexModel(
+            [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="user_timestamp_id",
+        ),
+        # Whole-journal windows: Ledger.take_snapshots / audit since the last
+        # snapshot, and TransactionArchive.archive selecting rows to move
+        IndexModel([("timestamp", ASCENDING), ("_id", ASCENDING)], name="timestamp_id"),
+    ],
+    "monthly_rollups": [
+        # /api/analytics/monthly: one account (or all of a user's accounts) for a year
+        IndexModel([("account_number", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)],
+                   name="account_year_month"),
+    ],
+    "statements": [
+        # unverified requests and finished statements both carry an expiry
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "transfer_batches": [
+        # unapproved batches carry an expiry; it is removed once the OTP is verified
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "rate_limits": [
+        # ratelimit.MongoBackend window counters, kept for two windows
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "balance_snapshots": [
+        # balances.MongoBalanceStore snapshots and tombstones, reloaded after their TTL
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "ledger_snapshots": [
+        # ledger.Ledger.balance_as_of: latest snapshot of one account at or before an instant
+        IndexModel([("account_number", ASCENDING), ("as_of", DESCENDING)], name="account_number_as_of"),
+    ],
+}
+
+
+# Indexes that served query shapes no longer issued; ensure_indexes drops them
+RETIRED_INDEXES = {
+    "transactions": ["user_account_timestamp_id", "beneficiary_account_timestamp_id",
+                     "account_number_timestamp_id"],
+    "otps": ["email_purpose_created"],
+}
+
+
+# Representative shapes of every query the API issues. Values are
+# placeholders; only the shape matters to the planner.
+_SAMPLE_ID = "000000000000000000000000"
+
+AUDIT_QUERIES = [
+    {"name": "user_by_email", "collection": "users", "filter": {"email": "audit@example.com"}},
+    {"name": "accounts_by_user", "collection": "accounts", "filter": {"user_id": _SAMPLE_ID}},
+    {"name": "active_account_by_user", "collection": "accounts",
+     "filter": {"user_id": _SAMPLE_ID, "status": "active"}},
+    {"name": "account_by_number", "collection": "accounts", "filter": {"account_number": "0000000000"}},
+    {"name": "account_by_user_and_number", "collection": "accounts",
+     "filter": {"user_id": _SAMPLE_ID, "account_number": "0000000000"}},
+    {"name": "beneficiaries_by_user", "collection": "beneficiaries", "filter": {"user_id": _SAMPLE_ID}},
+    {"name": "beneficiary_duplicate_check", "collection": "beneficiaries",
+     "filter": {"account_number": "0000000000", "user_id": _SAMPLE_ID}},
+    {"name": "directory_by_name_prefix", "collection": "beneficiary_directory",
+     "filter": {"name_lower": {"$regex": "^audit"}}, "sort": [("name_lower", 1), ("_id", 1)]},
+    {"name": "latest_otp", "collection": "otps",
+     "filter": {"email": "audit@example.com", "purpose": "transfer"}, "sort": [("created_at", -1), ("_id", -1)]},
+    {"name": "transactions_by_user", "collection": "transactions",
+     "filter": {"user_id": _SAMPLE_ID}, "sort": [("timestamp", -1), ("_id", -1)]},
+    {"name": "transactions_by_account", "collection": "transactions",
+     "filter": {"user_id": _SAMPLE_ID, "account_number": {"$in": ["0000000000"]}, "type": "credit"},
+     "sort": [("timestamp", -1), ("_id", -1)]},
+    {"name": "monthly_rollups_for_year", "collection": "monthly_rollups",
+     "filter": {"account_number": {"$in": ["0000000000"]}, "year": 2000}},
+    {"name": "statement_rows", "collection": "transactions",
+     "filter": {"user_id": _SAMPLE_ID, "account_number": "0000000000", "timestamp": {"$gte": 0}},
+     "sort": [("timestamp", 1), ("_id", 1)]},
+    {"name": "journal_window", "collection": "transactions",
+     "filter": {"timestamp": {"$gte": 0, "$lt": 0}}},
+    {"name": "archive_move_batch", "collection": "transactions",
+     "filter": {"timestamp": {"$lt": 0}}, "sort": [("timestamp", 1), ("_id", 1)]},
+    {"name": "journal_postings_since", "collection": "transactions",
+     "filter": {"timestamp": {"$gte": 0}, "transfer_id": {"$exists": True}}},
+    {"name": "journal_unsnapshotted_accounts", "collection": "transactions",
+     "filter": {"user_id": {"$in": [_SAMPLE_ID, None]}, "account_number": {"$in": ["0000000000"]},
+                "timestamp": {"$lt": 0}}},
+    {"name": "ledger_snapshot_as_of", "collection": "ledger_snapshots",
+     "filter": {"account_number": "0000000000", "as_of": {"$lte": 0}}, "sort": [("as_of", -1)]},
+]
+
+
+def ensure_indexes(db):
+    """
+    Create every declared index and drop the retired ones. create_indexes is
+    a no-op for indexes that already exist, so this is safe to call on every
+    startup.
+    Returns a list of (collection, error) for indexes that could not be built,
+    e.g. a unique index over data that still holds duplicates.
+    """
+    failures = []
+    # Archive months (see archive.py) carry the journal's indexes too
+    months = (db.archive_state.find_one({"_id": ARCHIVE_STATE_ID}) or {}).get("months", [])
+    declared = {**INDEXES, **{name: ARCHIVE_INDEXES for name in months}}
+    for collection, models in declared.items():
+        for model in models:
+            try:
+                db[collection].create_indexes([model])
+            except OperationFailure as e:
+                failures.append((collection, f"{model.document['name']}: {e}"))
+    for collection, names in RETIRED_INDEXES.items():
+        existing = db[collection].index_information()
+        for name in names:
+            if name in existing:
+                db[collection].drop_index(name)
+    return failures
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    stage = plan.get("stage")
+    if stage:
+        yield stage
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def explain_query(db, query):
+    cursor = db[query["collection"]].find(query["filter"])
+    if query.get("sort"):
+        cursor = cursor.sort(query["sort"])
+    explained = cursor.explain()
+    winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+    return list(_plan_stages(winning))
+
+
+def audit_query_plans(db, queries=None):
+    """
+    Explain every registered query and return (name, stages) for those whose
+    winning plan contains a COLLSCAN. An empty list means the audit passed.
+    """
+    offenders = []
+    for query in queries or AUDIT_QUERIES:
+        stages = explain_query(db, query)
+        if "COLLSCAN" in stages:
+            offenders.append((query["name"], stages))
+    return offenders
@@ -0,0 +1,217 @@
+# journal.py
+"""
+The one writer of `transactions` rows, and the backfill that brings older
+documents to the same shape.
+
+Every row is a single leg of a balanced posting (see ledger.py):
+  transfer_id, user_id (ObjectId; None on the bank's own ledger accounts),
+  account_number, type ("debit" | "credit"), amount, transfer_mode,
+  beneficiary_id, timestamp, plus optional extras such as batch_id.
+The transfer engines (sync and Motor), batch transfers and the ledger build
+their rows with posting() / opening_entries() and insert them with write_journal(), so
+every read path can filter on user_id and sort on (timestamp, _id) and one
+index serves them all.
+
+Documents written before this module come in two legacy shapes:
+  - OTP transfers from before the transfer engine: string user_id and
+    `created_at`, with no type, account_number or counter-leg
+  - `user_account_id` / `beneficiary_account_id` pairs naming both accounts
+Backfill rewrites them in place in _id order, one bulk_write per batch, and
+adds the missing counter-leg of each posting. Progress is kept in the
+`migrations` collection, so an interrupted run resumes where it stopped; an
+optional rate limit keeps it from starving live traffic.
+"""
+import logging
+import time
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+EXTERNAL_CLEARING = "EXTERNAL_CLEARING"
+CASH_DEPOSITS = "CASH_DEPOSITS"
+
+# Any document matching this still has a legacy shape
+LEGACY_FILTER = {"$or": [
+    {"type": {"$exists": False}},
+    {"timestamp": {"$exists": False}},
+    {"user_account_id": {"$exists": True}},
+    {"user_id": {"$type": "string"}},
+]}
+
+
+def object_id(value):
+    """ObjectId of a user/account id stored as an ObjectId or its string form."""
+    return None if value is None else ObjectId(str(value))
+
+
+def entry(transfer_id, user_id, account_number, type, amount, transfer_mode,
+          beneficiary_id=None, timestamp=None, **extra):
+    """One journal row in the unified shape."""
+    return {
+        "transfer_id": transfer_id,
+        "user_id": object_id(user_id),
+        "account_number": account_number,
+        "beneficiary_id": beneficiary_id,
+        "amount": amount,
+        "transfer_mode": transfer_mode,
+        "type": type,
+        "timestamp": timestamp or datetime.now(UTC),
+        **extra,
+    }
+
+
+def contra_entry(row, account_number):
+    """The bank-side leg balancing a customer `row`, on one of the bank's ledger accounts."""
+    contra = {k: v for k, v in row.items() if k != "_id"}
+    contra.update({
+        "user_id": None,
+        "account_number": account_number,
+        "type": "credit" if row["type"] == "debit" else "debit",
+    })
+    return contra
+
+
+def posting(user_id, account_number, receiver, beneficiary_id, amount, transfer_mode,
+            transfer_id=None, timestamp=None, **extra):
+    """
+    Rows of one transfer out of `account_number`: the debit, then the credit
+    to `receiver` (an accounts document) or, for an account held elsewhere,
+    the EXTERNAL_CLEARING leg. Returns (customer entries, all rows to write).
+    """
+    debit = entry(transfer_id or ObjectId(), user_id, account_number, "debit", amount, transfer_mode,
+                  beneficiary_id, timestamp, **extra)
+    if receiver:
+        entries = [debit, {**debit, "user_id": object_id(receiver["user_id"]),
+                           "account_number": receiver["account_number"], "type": "credit"}]
+        return entries, entries
+    return [debit], [debit, contra_entry(debit, EXTERNAL_CLEARING)]
+
+
+def opening_entries(account, amount, timestamp=None, transfer_mode="DEPOSIT"):
+    """Balanced posting of `amount` paid into `account` from cash deposits (negative: paid out)."""
+    row = entry(ObjectId(), account["user_id"], account["account_number"], "credit" if amount >= 0 else "debit",
+                abs(amount), transfer_mode, None, timestamp)
+    return [row, contra_entry(row, CASH_DEPOSITS)]
+
+
+def write_journal(collection, rows, session=None):
+    """
+    Insert the rows of one or more postings in a single ordered insert_many.
+    Returns the driver's result (a coroutine for a Motor collection).
+    """
+    return collection.insert_many(rows, ordered=True, session=session)
+
+
+# ---------------------- BACKFILL ----------------------
+class Backfill:
+    MIGRATION_ID = "transactions_unified_shape"
+
+    def __init__(self, db, batch_size=500, max_per_second=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_per_second = max_per_second
+
+    def progress(self):
+        return self.db.migrations.find_one({"_id": self.MIGRATION_ID})
+
+    def reset(self):
+        self.db.migrations.delete_one({"_id": self.MIGRATION_ID})
+
+    def run(self, max_batches=None):
+        """
+        Rewrite legacy documents batch by batch from the saved position.
+        Returns the progress document.
+        """
+        state = self.progress() or {"_id": self.MIGRATION_ID, "last_id": None, "rewritten": 0,
+                                    "started_at": datetime.now(UTC)}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            started = time.monotonic()
+            query = LEGACY_FILTER if state["last_id"] is None else {"$and": [
+                {"_id": {"$gt": state["last_id"]}}, LEGACY_FILTER]}
+            docs = list(self.db.transactions.find(query).sort("_id", 1).limit(self.batch_size))
+            if not docs:
+                state["finished_at"] = datetime.now(UTC)
+                self._save(state)
+                break
+            ops = self._rewrite_ops(docs)
+            if ops:
+                # Counter-legs are upserts placed before the rewrite of their source
+                # document, so a batch cut short is simply redone on resume
+                self.db.transactions.bulk_write(ops, ordered=True)
+            state["last_id"] = docs[-1]["_id"]
+            state["rewritten"] += len(docs)
+            state.pop("finished_at", None)
+            self._save(state)
+            batches += 1
+            logger.info("backfill: %d rewritten, last _id %s", state["rewritten"], state["last_id"])
+            if self.max_per_second:
+                time.sleep(max(0.0, len(docs) / self.max_per_second - (time.monotonic() - started)))
+        return state
+
+    def _save(self, state):
+        state["updated_at"] = datetime.now(UTC)
+        self.db.migrations.replace_one({"_id": self.MIGRATION_ID}, state, upsert=True)
+
+    def _rewrite_ops(self, docs):
+        account_ids = {d[f] for d in docs for f in ("user_account_id", "beneficiary_account_id") if d.get(f)}
+        user_ids = {object_id(d["user_id"]) for d in docs if d.get("user_id") and "type" not in d}
+        beneficiary_ids = {d["beneficiary_id"] for d in docs
+                           if d.get("beneficiary_id") and "user_account_id" not in d and "type" not in d}
+        accounts = {a["_id"]: a for a in self.db.accounts.find(
+            {"_id": {"$in": [object_id(i) for i in account_ids]}}, {"user_id": 1, "account_number": 1}
+        )} if account_ids else {}
+        user_accounts = {}
+        # accounts.user_id is an ObjectId or, on older accounts, its string form
+        for a in self.db.accounts.find({"user_id": {"$in": [*user_ids, *map(str, user_ids)]}},
+                                       {"user_id": 1, "account_number": 1}) if user_ids else []:
+            user_accounts.setdefault(object_id(a["user_id"]), []).append(a)
+        beneficiaries = {b["_id"]: b for b in self.db.beneficiaries.find(
+            {"_id": {"$in": [object_id(i) for i in beneficiary_ids]}}, {"account_number": 1}
+        )} if beneficiary_ids else {}
+        receivers = {a["account_number"]: a for a in self.db.accounts.find(
+            {"account_number": {"$in": [b["account_number"] for b in beneficiaries.values()]}},
+            {"user_id": 1, "account_number": 1}
+        )} if beneficiaries else {}
+
+        ops = []
+        for doc in docs:
+            timestamp = doc.get("timestamp") or doc.get("created_at") or doc["_id"].generation_time
+            if "user_account_id" in doc:
+                source = accounts.get(object_id(doc["user_account_id"]))
+                receiver = accounts.get(object_id(doc.get("beneficiary_account_id")))
+                user_id = source["user_id"] if source else doc.get("user_id")
+                account_number = source["account_number"] if source else None
+            elif "type" not in doc:
+                # Pre-engine OTP transfer: the debited account was not recorded, but
+                # it is unambiguous for a user with a single account
+                user_id = doc.get("user_id")
+                owned = user_accounts.get(object_id(user_id), [])
+                account_number = owned[0]["account_number"] if len(owned) == 1 else None
+                beneficiary = beneficiaries.get(object_id(doc.get("beneficiary_id")))
+                receiver = receivers.get(beneficiary["account_number"]) if beneficiary else None
+            else:
+                # Already a journal leg, only with a string user_id or `created_at`
+                ops.append(UpdateOne({"_id": doc["_id"]}, {
+                    "$set": {"user_id": object_id(doc.get("user_id")), "timestamp": timestamp},
+                    "$unset": {"created_at": ""},
+                }))
+                continue
+
+            transfer_id = doc.get("transfer_id") or doc["_id"]
+            extra = {k: doc[k] for k in ("batch_id",) if k in doc}
+            _, rows = posting(user_id, account_number, receiver, doc.get("beneficiary_id"), doc.get("amount"),
+                              doc.get("transfer_mode"), transfer_id, timestamp, **extra)
+            for leg in rows[1:]:
+                # user_id + timestamp pin the lookup to a point in the journal index
+                ops.append(UpdateOne({k: leg[k] for k in ("user_id", "timestamp", "transfer_id", "type",
+                                                          "account_number")},
+                                     {"$setOnInsert": leg}, upsert=True))
+            ops.append(UpdateOne({"_id": doc["_id"]}, {
+                "$set": rows[0],
+                "$unset": {"created_at": "", "user_account_id": "", "beneficiary_account_id": ""},
+            }))
+        return ops
@@ -0,0 +1,231 @@
+# ledger.py
+"""
+Double-entry view of the `transactions` journal, with periodic per-account
+balance snapshots.
+
+Every posting is balanced: for each transfer_id the debits equal the credits,
+and all rows of a posting are written in one insert_many. Money entering or
+leaving the bank is posted against the bank's own ledger accounts (rows with
+user_id None, never returned to customers; see journal.py):
+  EXTERNAL_CLEARING - credited for transfers to accounts held elsewhere
+  CASH_DEPOSITS     - debited for the opening deposit of a new account
+so the journal alone explains every account balance.
+
+`ledger_snapshots` holds, per account and `as_of` instant, the balance of all
+entries stamped before it. take_snapshots() (the `snapshot-balances` CLI,
+meant for cron) rolls every account forward from its previous snapshot with
+one $group over the new window. balance_as_of() starts from the latest
+snapshot at or before the requested instant and sums only the entries since,
+so point-in-time balances and statement opening balances cost
+O(entries since the last snapshot) rather than a scan of the whole history.
+The windows are read on the journal's (timestamp, _id) index (indexes.py).
+
+audit() compares the journal with the mutable `balance` field and can post
+opening adjustments for accounts created before their deposits were journaled.
+
+Listeners registered with add_listener() see the customer entries of every
+opening and adjustment posting, as TransferEngine listeners see transfers, so
+incremental rollups and local event streams agree with a rebuild from the
+journal. These postings leave `accounts.balance` as it is (a new account is
+inserted holding its deposit; an adjustment brings the journal in line with
+the balance), so the balance cache is not one of them.
+"""
+import logging
+from datetime import datetime, timedelta, UTC
+
+from pymongo import DESCENDING, UpdateOne
+
+from journal import CASH_DEPOSITS, EXTERNAL_CLEARING, object_id, opening_entries, write_journal
+
+logger = logging.getLogger(__name__)
+
+# Credits add to an account, debits subtract
+SIGNED_AMOUNT = {"$cond": [{"$eq": ["$type", "credit"]}, "$amount", {"$multiply": [-1, "$amount"]}]}
+
+
+class Ledger:
+    def __init__(self, db, snapshot_lag_seconds=300, archive=None):
+        """
+        Snapshots stop `snapshot_lag_seconds` short of now, so journal rows
+        still being written by in-flight transfers are not skipped. With an
+        archive.TransactionArchive, sums also cover the archived months.
+        """
+        self.db = db
+        self.archive = archive
+        self.snapshot_lag = timedelta(seconds=snapshot_lag_seconds)
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """Register listener(entries, session), called with the customer rows of each posting."""
+        self.listeners.append(listener)
+
+    # ---------------------- POSTING ----------------------
+    def post_opening(self, account, amount):
+        """Journal the initial deposit of a newly created account."""
+        if amount:
+            self._post(opening_entries(account, amount))
+
+    def _post(self, rows):
+        write_journal(self.db.transactions, rows)
+        # The bank-side legs (user_id None) are not customer entries
+        entries = [row for row in rows if row["user_id"] is not None]
+        for listener in self.listeners:
+            try:
+                listener(entries, None)
+            except Exception:
+                logger.exception("Ledger listener %r failed", listener)
+
+    # ---------------------- READ PATH ----------------------
+    def _collections(self, start=None, end=None):
+        if self.archive is None:
+            return [self.db.transactions]
+        return self.archive.collections(start, end)
+
+    def _net(self, match, start=None, end=None):
+        """
+        {account_number: (net amount, entry count)} for the journal rows
+        matching `match`, whose timestamps lie within [start, end].
+        """
+        totals = {}
+        for collection in self._collections(start, end):
+            for row in collection.aggregate([
+                {"$match": match},
+                {"$group": {"_id": "$account_number", "net": {"$sum": SIGNED_AMOUNT}, "count": {"$sum": 1}}},
+            ]):
+                net, count = totals.get(row["_id"], (0, 0))
+                totals[row["_id"]] = (net + row["net"], count + row["count"])
+        return totals
+
+    def balance_as_of(self, account_number, at):
+        """Balance of `account_number` from the entries stamped before `at`."""
+        owner = self.db.accounts.find_one({"account_number": account_number}, {"user_id": 1})
+        snapshot = self.db.ledger_snapshots.find_one(
+            {"account_number": account_number, "as_of": {"$lte": at}},
+            sort=[("as_of", DESCENDING)],
+        )
+        window = {"$lt": at}
+        if snapshot:
+            window["$gte"] = snapshot["as_of"]
+        # user_id keeps the scan on the journal's one index (None for the bank's own accounts)
+        match = {"user_id": object_id(owner["user_id"]) if owner else None,
+                 "account_number": account_number, "timestamp": window}
+        net, count = self._net(match, window.get("$gte"), at).get(account_number, (0, 0))
+        return {
+            "account_number": account_number,
+            "as_of": at,
+            "balance": round((snapshot["balance"] if snapshot else 0) + net, 2),
+            "snapshot_as_of": snapshot["as_of"] if snapshot else None,
+            "entries_since_snapshot": count,
+        }
+
+    # ---------------------- SNAPSHOTS ----------------------
+    def _latest_snapshots(self):
+        """{account_number: its most recent snapshot}"""
+        return {row["_id"]: row for row in self.db.ledger_snapshots.aggregate([
+            {"$sort": {"account_number": 1, "as_of": -1}},
+            {"$group": {"_id": "$account_number", "as_of": {"$first": "$as_of"}, "balance": {"$first": "$balance"}}},
+        ])}
+
+    def _journal_balances(self, as_of, latest, batch_size=1000):
+        """
+        {account_number: balance of its entries stamped before `as_of`} for every
+        account with entries. An account in `latest` is rolled forward from that
+        snapshot; accounts share a previous as_of, so that is one $group per
+        window on the journal's timestamp index. Accounts without a snapshot
+        (new ones, or ones whose snapshots an adjustment dropped) are summed in
+        full, a batch of owners at a time on the user_timestamp_id index.
+        """
+        windows = {}
+        for number, snapshot in latest.items():
+            if snapshot["as_of"].replace(tzinfo=UTC) < as_of:
+                windows.setdefault(snapshot["as_of"], []).append(number)
+        balances = {}
+        for since, numbers in windows.items():
+            net = self._net({"timestamp": {"$gte": since, "$lt": as_of}}, since, as_of)
+            for number in numbers:
+                balances[number] = latest[number]["balance"] + net.get(number, (0, 0))[0]
+
+        # Every journal row is owned by its account's user (None for the bank's own accounts)
+        owners = {EXTERNAL_CLEARING: None, CASH_DEPOSITS: None}
+        for account in self.db.accounts.find({}, {"account_number": 1, "user_id": 1}):
+            owners[account["account_number"]] = object_id(account["user_id"])
+        fresh = [(number, owner) for number, owner in owners.items() if number not in latest]
+        for i in range(0, len(fresh), batch_size):
+            chunk = fresh[i:i + batch_size]
+            match = {"user_id": {"$in": list({owner for _, owner in chunk})},
+                     "account_number": {"$in": [number for number, _ in chunk]},
+                     "timestamp": {"$lt": as_of}}
+            for number, (net, _) in self._net(match, None, as_of).items():
+                balances[number] = net
+        return balances
+
+    def take_snapshots(self, as_of=None, batch_size=1000):
+        """
+        Snapshot every account with journal rows at `as_of` (default: now minus
+        the lag). Returns the number of snapshots written.
+        """
+        as_of = as_of or datetime.now(UTC) - self.snapshot_lag
+        balances = self._journal_balances(as_of, self._latest_snapshots(), batch_size)
+
+        ops = []
+        written = 0
+        for number, balance in balances.items():
+            ops.append(UpdateOne(
+                {"_id": f"{number}:{as_of.isoformat()}"},
+                {"$set": {"account_number": number, "as_of": as_of, "balance": round(balance, 2),
+                          "created_at": datetime.now(UTC)}},
+                upsert=True,
+            ))
+            if len(ops) >= batch_size:
+                self.db.ledger_snapshots.bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+        if ops:
+            self.db.ledger_snapshots.bulk_write(ops, ordered=False)
+            written += len(ops)
+        return written
+
+    # ---------------------- AUDIT ----------------------
+    def audit(self, post_adjustments=False, full=False):
+        """
+        Accounts whose `balance` differs from their journal, and postings whose
+        debits and credits do not match. The journal balances start from the
+        latest snapshots and only postings since the oldest of them are
+        checked, so an audit costs what a snapshot does; `full` re-reads the
+        whole journal instead. With post_adjustments, journal the difference
+        as an opening adjustment dated at the account's creation and drop its
+        snapshots (the next take_snapshots() rebuilds them).
+        """
+        now = datetime.now(UTC) + timedelta(seconds=1)
+        latest = {} if full else self._latest_snapshots()
+        journal = self._journal_balances(now, latest)
+        mismatched = []
+        for account in self.db.accounts.find({}, {"account_number": 1, "balance": 1, "user_id": 1, "created_at": 1}):
+            expected = round(account.get("balance", 0), 2)
+            actual = round(journal.get(account["account_number"], 0), 2)
+            if expected == actual:
+                continue
+            mismatched.append({"account_number": account["account_number"], "balance": expected, "journal": actual})
+            if post_adjustments:
+                created_at = account.get("created_at") or datetime(1970, 1, 1)
+                self._post(opening_entries(
+                    account, round(expected - actual, 2), created_at.replace(tzinfo=UTC), "OPENING_ADJUSTMENT"
+                ))
+                self.db.ledger_snapshots.delete_many({"account_number": account["account_number"]})
+
+        # Every leg of a posting carries the same timestamp, so a window never splits one
+        since = min((snapshot["as_of"] for snapshot in latest.values()), default=None)
+        match = {"transfer_id": {"$exists": True}}
+        if since is not None:
+            match = {"timestamp": {"$gte": since}, **match}
+        # A posting caught mid-archive has legs in two tiers: net the tiers' leftovers together
+        leftovers = {}
+        for collection in self._collections(since):
+            for row in collection.aggregate([
+                {"$match": match},
+                {"$group": {"_id": "$transfer_id", "net": {"$sum": SIGNED_AMOUNT}}},
+                {"$match": {"$expr": {"$gt": [{"$abs": "$net"}, 0.005]}}},
+            ]):
+                leftovers[row["_id"]] = leftovers.get(row["_id"], 0) + row["net"]
+        unbalanced = [str(transfer_id) for transfer_id, net in leftovers.items() if abs(net) > 0.005]
+        return {"mismatched_accounts": mismatched, "unbalanced_postings": unbalanced}
@@ -0,0 +1,227 @@
+# mailer.py
+"""
+Background dispatcher for OTP mail.
+
+Request handlers call MailDispatcher.submit(), which only puts the message on
+a bounded queue and returns a job id. A small pool of worker threads drains
+the queue in batches, each worker keeping one SMTP connection open across
+batches, and retries failed sends with exponential backoff. Job status can be
+polled with MailDispatcher.status() and is also pushed to an optional
+on_status callback (app.py stores it on the OTP record so any worker can
+answer a poll); an optional on_send callback receives each SMTP send time.
+
+Workers are started lazily on the first submit in each process, so the
+dispatcher is safe to create before gunicorn forks.
+"""
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+
+from cache import TTLCache
+
+
+class MailQueueFull(Exception):
+    """Raised by submit() when the dispatch queue is at capacity."""
+
+
+class MailDispatcher:
+    def __init__(self, server, port, use_tls=False, use_ssl=False, username=None,
+                 password=None, default_sender=None, workers=2, queue_size=1000,
+                 batch_size=20, max_retries=3, backoff_seconds=1.0,
+                 idle_timeout=30, timeout=10, on_status=None, on_send=None):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.default_sender = default_sender or username
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.on_status = on_status
+        self.on_send = on_send
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._statuses = TTLCache(maxsize=queue_size * 10, ttl=3600)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "connections": 0}
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            server=config.get("MAIL_SERVER"),
+            port=config.get("MAIL_PORT"),
+            use_tls=config.get("MAIL_USE_TLS", False),
+            use_ssl=config.get("MAIL_USE_SSL", False),
+            username=config.get("MAIL_USERNAME"),
+            password=config.get("MAIL_PASSWORD"),
+            default_sender=config.get("MAIL_DEFAULT_SENDER"),
+            **kwargs
+        )
+
+    # ---------------------- PUBLIC API ----------------------
+    def submit(self, to_email, subject, body, job_id=None):
+        """
+        Queue a message for delivery and return its job id.
+        Raises MailQueueFull instead of blocking when the queue is full.
+        """
+        self._ensure_started()
+        job = {
+            "id": job_id or uuid.uuid4().hex,
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "attempts": 0,
+        }
+        # Record the status first so a fast worker's "sending" is never overwritten
+        self._set_status(job, "queued")
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._set_status(job, "failed", "Mail queue is full")
+            raise MailQueueFull("Mail queue is full")
+        return job["id"]
+
+    def status(self, job_id):
+        """Last known status of a job in this process, or None if unknown."""
+        return self._statuses.get(job_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued job has been handled (used by scripts and benchmarks)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # ---------------------- WORKERS ----------------------
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive a fork: start a fresh pool in this process
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"mail-dispatch-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _worker(self):
+        connection = None
+        last_used = 0.0
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if connection is not None and time.monotonic() - last_used > self.idle_timeout:
+                connection = self._close(connection)
+
+            for job in batch:
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    self._set_status(job, "sending")
+                    started = time.perf_counter()
+                    connection.send_message(self._build_message(job))
+                    self._report_send(time.perf_counter() - started)
+                    self._count("sent")
+                    self._set_status(job, "sent")
+                except Exception as e:
+                    connection = self._close(connection)
+                    self._retry_or_fail(job, e)
+                finally:
+                    self._queue.task_done()
+            last_used = time.monotonic()
+
+    def _retry_or_fail(self, job, error):
+        job["attempts"] += 1
+        if job["attempts"] > self.max_retries:
+            self._count("failed")
+            self._set_status(job, "failed", str(error))
+            return
+        self._count("retried")
+        self._set_status(job, "retrying", str(error))
+        delay = self.backoff_seconds * (2 ** (job["attempts"] - 1))
+        timer = threading.Timer(delay, self._requeue, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("failed")
+            self._set_status(job, "failed", "Mail queue is full")
+
+    # ---------------------- SMTP ----------------------
+    def _connect(self):
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+            if self.use_tls:
+                connection.starttls()
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        self._count("connections")
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.quit()
+            except Exception:
+                pass
+        return None
+
+    def _build_message(self, job):
+        msg = EmailMessage()
+        msg["Subject"] = job["subject"]
+        msg["From"] = self.default_sender
+        msg["To"] = job["to"]
+        msg.set_content(job["body"])
+        return msg
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _report_send(self, seconds):
+        if self.on_send:
+            try:
+                self.on_send(seconds)
+            except Exception:
+                pass
+
+    def _set_status(self, job, state, error=None):
+        status = {"status": state, "attempts": job["attempts"]}
+        if error:
+            status["error"] = error
+        self._statuses.set(job["id"], status)
+        if self.on_status:
+            try:
+                self.on_status(job["id"], status)
+            except Exception:
+                pass
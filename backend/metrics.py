@@ -0,0 +1,205 @@
+# metrics.py
+"""
+Request, MongoDB and SMTP instrumentation.
+
+RequestMetrics hooks into Flask (before/after_request) and PyMongo command
+monitoring to record, per request:
+  - wall time, in a latency histogram per (method, route, status)
+  - the number of Mongo commands issued and the time spent in them
+  - time spent handing OTP mail to SMTP (or to the mail dispatcher queue)
+
+render() serves everything in the Prometheus text exposition format for
+/metrics, and the per-request totals can also be echoed in a Server-Timing
+header. Metrics are per process: scrape each worker, or aggregate in the
+collector.
+
+log_event() writes one JSON log line per event and samples the noisy ones.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from pymongo import monitoring
+
+# Seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f"{name}_bucket", {**labels, "le": str(bound)}, cumulative
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, cumulative
+
+
+class _RequestStats:
+    __slots__ = ("started", "elapsed", "db_count", "db_seconds", "smtp_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.db_count = 0
+        self.db_seconds = 0.0
+        self.smtp_seconds = 0.0
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Charges each Mongo command to the request running on the issuing thread."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        stats = self.metrics.current()
+        if stats is not None:
+            stats.db_count += 1
+            stats.db_seconds += seconds
+        self.metrics.observe_command(event.command_name, outcome, seconds)
+
+
+class RequestMetrics:
+    def __init__(self, server_timing=False):
+        self.server_timing = server_timing
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._db_time = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._db_commands = defaultdict(lambda: Histogram(COUNT_BUCKETS))
+        self._smtp = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._commands = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._collectors = []
+
+    def command_listener(self):
+        """A PyMongo CommandListener; register it before the MongoClient is created."""
+        return MongoCommandTimer(self)
+
+    def add_collector(self, collector):
+        """Register collector() -> [(name, type, help, [(labels, value), ...])] for render()."""
+        self._collectors.append(collector)
+
+    # ---------------------- RECORDING ----------------------
+    def current(self):
+        return getattr(self._local, "stats", None)
+
+    def start_request(self):
+        self._local.stats = _RequestStats()
+
+    def finish_request(self, method, route, status):
+        """Record the current request and return its stats (None outside a request)."""
+        stats = self.current()
+        if stats is None:
+            return None
+        self._local.stats = None
+        stats.elapsed = time.perf_counter() - stats.started
+        labels = (method, route, str(status))
+        with self._lock:
+            self._latency[labels].observe(stats.elapsed)
+            self._db_time[(method, route)].observe(stats.db_seconds)
+            self._db_commands[(method, route)].observe(stats.db_count)
+        return stats
+
+    def observe_request(self, method, route, status, seconds):
+        """Record a request timed by the caller (the ASGI app, which has no per-thread stats)."""
+        with self._lock:
+            self._latency[(method, route, str(status))].observe(seconds)
+
+    def observe_command(self, command, outcome, seconds):
+        with self._lock:
+            self._commands[(command, outcome)].observe(seconds)
+
+    def observe_smtp(self, mode, seconds):
+        stats = self.current()
+        if stats is not None:
+            stats.smtp_seconds += seconds
+        with self._lock:
+            self._smtp[mode].observe(seconds)
+
+    @staticmethod
+    def server_timing_header(stats):
+        parts = [
+            f"app;dur={stats.elapsed * 1000:.1f}",
+            f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_count} commands"',
+        ]
+        if stats.smtp_seconds:
+            parts.append(f"smtp;dur={stats.smtp_seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+    # ---------------------- EXPOSITION ----------------------
+    def render(self):
+        families = []
+        with self._lock:
+            for name, help_text, histograms, label_names in (
+                ("http_request_duration_seconds", "Request wall time",
+                 self._latency, ("method", "route", "status")),
+                ("http_request_db_seconds", "Mongo time per request", self._db_time, ("method", "route")),
+                ("http_request_db_commands", "Mongo commands per request", self._db_commands, ("method", "route")),
+                ("mongo_command_duration_seconds", "Mongo command round trip",
+                 self._commands, ("command", "outcome")),
+                ("otp_mail_send_seconds", "Time to hand OTP mail to SMTP", self._smtp, ("mode",)),
+            ):
+                samples = []
+                for key, histogram in sorted(histograms.items()):
+                    key = (key,) if isinstance(key, str) else key
+                    samples.extend(histogram.samples(name, dict(zip(label_names, key))))
+                families.append((name, "histogram", help_text, samples))
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(_line(sample, labels, value) for sample, labels, value in samples)
+        for collector in self._collectors:
+            for name, kind, help_text, values in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_line(name, labels, value) for labels, value in values)
+        return "\n".join(lines) + "\n"
+
+
+def _line(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        return f"{name}{{{rendered}}} {value}"
+    return f"{name} {value}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def log_event(logger, event, level=logging.INFO, sample_rate=1.0, **fields):
+    """Log `event` with `fields` as one JSON object, keeping only `sample_rate` of calls."""
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, default=str))
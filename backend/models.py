@@ -1,11 +1,48 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from bson.objectid import ObjectId
 from datetime import datetime
-import random
+from pymongo.errors import DuplicateKeyError
+
+from account_numbers import AccountNumberAllocator
+from archive import TransactionArchive
+from hashing import PasswordHasher
+from ledger import Ledger
+from pagination import KEYSET_SORT, clamp_page_size, decode_cursor, encode_cursor, keyset_filter
+from rollups import MonthlyRollups
+from transfers import TransferEngine
+
+# Fields of a user document that are safe and cheap to hand to request handlers.
+# The accounts/beneficiaries arrays grow without bound and are looked up on demand.
+USER_PUBLIC_PROJECTION = {"password": 0, "hashed_password": 0, "accounts": 0, "beneficiaries": 0}
+
+
+def _history_end(end, cursor):
+    """Latest timestamp a history query can return: `end`, or the cursor's position if earlier."""
+    if not cursor:
+        return end
+    position = decode_cursor(cursor)[0]
+    return position if end is None or position < end else end
 
 class BankingModel:
-    def __init__(self, db):
+    def __init__(self, db, use_transactions=False, user_cache=None, account_number_block_size=100,
+                 hasher=None, balance_cache=None, archive=None, read_db=None):
         self.db = db
+        # Read-only listings go to `read_db` (e.g. `db` with a secondary read preference)
+        self.read_db = db if read_db is None else read_db
+        # Every history read goes through the archive, which adds cold tiers only when the range reaches them
+        self.archive = archive or TransactionArchive(db)
+        self.read_archive = self.archive if read_db is None else self.archive.with_db(read_db)
+        self.hasher = hasher or PasswordHasher(workers=0)
+        self.account_numbers = AccountNumberAllocator(db, block_size=account_number_block_size)
+        self.transfers = TransferEngine(db, use_transactions=use_transactions)
+        self.rollups = MonthlyRollups(db, archive=self.archive)
+        self.ledger = Ledger(db, archive=self.archive)
+        self.transfers.add_listener(self.rollups.record)
+        self.ledger.add_listener(self.rollups.record)
+        self.user_cache = user_cache
+        # Write-through: every transfer updates the cached balance snapshots it touches
+        self.balance_cache = balance_cache
+        if balance_cache is not None:
+            self.transfers.add_listener(balance_cache.record)
 
     # ---------------------- USER ----------------------
     def create_user(self, data):
@@ -14,7 +51,7 @@ class BankingModel:
         user = {
             "name": data["name"],
             "email": data["email"],
-            "password": generate_password_hash(data["password"]),
+            "password": self.hasher.hash(data["password"]),
             "address": data["address"],
             "date_of_birth": data["date_of_birth"],
             "accounts": [],
@@ -28,8 +65,14 @@ class BankingModel:
 
     def authenticate_user(self, email, password):
         user = self.db.users.find_one({"email": email})
-        if not user or not check_password_hash(user["password"], password):
+        if not user or not self.hasher.verify(password, user["password"]):
             return {"error": "Invalid credentials"}, 401
+        if self.hasher.needs_rehash(user["password"]):
+            # Upgrade legacy / weaker hashes while the plaintext is at hand
+            self.db.users.update_one(
+                {"_id": user["_id"], "password": user["password"]},
+                {"$set": {"password": self.hasher.hash(password)}}
+            )
         user["_id"] = str(user["_id"])
         del user["password"]
         return user, 200
@@ -42,16 +85,38 @@ class BankingModel:
         del user["password"]
         return user, 200
 
+    def get_public_user(self, user_id):
+        """
+        Projected public user record, served from user_cache when one is set.
+        The returned dict may be shared with other requests; do not mutate it.
+        """
+        if self.user_cache is not None:
+            cached = self.user_cache.get(user_id)
+            if cached is not None:
+                return cached, 200
+        user = self.db.users.find_one({"_id": ObjectId(user_id)}, USER_PUBLIC_PROJECTION)
+        if not user:
+            return {"error": "User not found"}, 404
+        user["_id"] = str(user["_id"])
+        if self.user_cache is not None:
+            self.user_cache.set(user_id, user)
+        return user, 200
+
+    def invalidate_user(self, user_id):
+        if self.user_cache is not None:
+            self.user_cache.invalidate(str(user_id))
+
     def change_password(self, user_id, old_password, new_password):
         user = self.db.users.find_one({"_id": ObjectId(user_id)})
         if not user:
             return {"error": "User not found"}, 404
-        if not check_password_hash(user["password"], old_password):
+        if not self.hasher.verify(old_password, user["password"]):
             return {"error": "Old password is incorrect"}, 400
         self.db.users.update_one(
             {"_id": ObjectId(user_id)},
-            {"$set": {"password": generate_password_hash(new_password)}}
+            {"$set": {"password": self.hasher.hash(new_password)}}
         )
+        self.invalidate_user(user_id)
         return {"message": "Password updated successfully"}, 200
 
     # ---------------------- ACCOUNT ----------------------
@@ -64,7 +129,7 @@ class BankingModel:
             "balance": initial_deposit,
             "status": "active",
             "verified": account_type.lower() == "savings",
-            "account_number": self._generate_account_number(),
+            "account_number": None,
             "created_at": datetime.utcnow(),
             "purpose": purpose,
             "business_name": business_name,
@@ -72,7 +137,11 @@ class BankingModel:
             "gst_number": gst_number,
             "pan_number": pan_number
         }
-        result = self.db.accounts.insert_one(account)
+        result = self._insert_with_account_number(account)
+        # The opening deposit is journaled so the ledger explains the balance from day one
+        self.ledger.post_opening(account, initial_deposit)
+        if self.balance_cache is not None:
+            self.balance_cache.account_created(user_id, account)
         account["_id"] = str(result.inserted_id)
         account["user_id"] = str(account["user_id"])
 
@@ -81,20 +150,42 @@ class BankingModel:
             {"_id": ObjectId(user_id)},
             {"$push": {"accounts": account["_id"]}}
         )
+        self.invalidate_user(user_id)
         return {"message": f"{account_type.capitalize()} account created successfully", "account": account}, 201
 
-    def _generate_account_number(self):
-        return str(random.randint(1000000000, 9999999999))
+    def _insert_with_account_number(self, account, attempts=5):
+        """
+        Insert `account` under a freshly allocated number. The unique index
+        rejects numbers already taken by legacy randomly generated accounts;
+        those are simply skipped.
+        """
+        for _ in range(attempts):
+            account["account_number"] = self.account_numbers.allocate()
+            account.pop("_id", None)
+            try:
+                return self.db.accounts.insert_one(account)
+            except DuplicateKeyError as e:
+                if "account_number" not in str(e):
+                    raise
+        raise RuntimeError("Could not allocate a unique account number")
 
     def get_user_accounts(self, user_id):
-        accounts = list(self.db.accounts.find({"user_id": ObjectId(user_id)}))
-        for acc in accounts:
-            acc["_id"] = str(acc["_id"])
-            acc["user_id"] = str(acc["user_id"])
-        return {"accounts": accounts}, 200
-
-    def get_user_balance(self, user_id):
-        accounts = list(self.db.accounts.find({"user_id": ObjectId(user_id)}))
+        if self.balance_cache is not None:
+            snapshot = self.balance_cache.snapshot(user_id)
+            return {"accounts": list(snapshot["accounts"].values()), "version": str(snapshot["version"])}, 200
+        return {"accounts": list(self.read_db.accounts.find({"user_id": ObjectId(user_id)}))}, 200
+
+    def iter_user_accounts(self, user_id, batch_size=500):
+        """Cursor over a user's accounts, for streaming responses."""
+        return self.read_db.accounts.find({"user_id": ObjectId(user_id)}).batch_size(batch_size)
+
+    def get_user_balance(self, user_id, fresh=False):
+        """`fresh` reads the primary even when listings are routed to secondaries."""
+        if self.balance_cache is not None:
+            snapshot = self.balance_cache.snapshot(user_id)
+            balances = {number: acc["balance"] for number, acc in snapshot["accounts"].items()}
+            return {"balances": balances, "version": str(snapshot["version"])}, 200
+        accounts = list((self.db if fresh else self.read_db).accounts.find({"user_id": ObjectId(user_id)}))
         balances = {acc["account_number"]: acc["balance"] for acc in accounts}
         return {"balances": balances}, 200
 
@@ -119,63 +210,143 @@ class BankingModel:
             {"_id": ObjectId(user_id)},
             {"$push": {"beneficiaries": beneficiary["_id"]}}
         )
+        self.invalidate_user(user_id)
         return {"message": "Beneficiary added successfully", "beneficiary": beneficiary}, 201
 
     def get_beneficiaries(self, user_id):
         beneficiaries = list(self.db.beneficiaries.find({"user_id": ObjectId(user_id)}))
-        for b in beneficiaries:
-            b["_id"] = str(b["_id"])
-            b["user_id"] = str(b["user_id"])
         return {"beneficiaries": beneficiaries}, 200
 
     # ---------------------- TRANSFER ----------------------
     def transfer_money(self, sender_id, beneficiary_id, amount, transfer_mode):
-        sender_account = self.db.accounts.find_one({"user_id": ObjectId(sender_id), "status": "active"})
-        if not sender_account:
-            return {"error": "Sender account not found"}, 404
-        if sender_account["balance"] < amount:
-            return {"error": "Insufficient funds"}, 400
-
         beneficiary = self.db.beneficiaries.find_one({"_id": ObjectId(beneficiary_id), "user_id": ObjectId(sender_id)})
         if not beneficiary:
             return {"error": "Beneficiary not found"}, 404
 
-        # Deduct amount from sender
-        self.db.accounts.update_one({"_id": sender_account["_id"]}, {"$inc": {"balance": -amount}})
-
-        # Credit receiver if internal
-        receiver_account = self.db.accounts.find_one({"account_number": beneficiary["account_number"]})
-        if receiver_account:
-            self.db.accounts.update_one({"_id": receiver_account["_id"]}, {"$inc": {"balance": amount}})
-
-        # Record transaction
-        self.db.transactions.insert_one({
-            "user_id": ObjectId(sender_id),
-            "account_number": sender_account["account_number"],
-            "beneficiary_id": ObjectId(beneficiary_id),
-            "amount": amount,
-            "transfer_mode": transfer_mode,
-            "type": "debit",
-            "timestamp": datetime.utcnow()
-        })
-        if receiver_account:
-            self.db.transactions.insert_one({
-                "user_id": receiver_account["user_id"],
-                "account_number": receiver_account["account_number"],
-                "beneficiary_id": ObjectId(beneficiary_id),
-                "amount": amount,
-                "transfer_mode": transfer_mode,
-                "type": "credit",
-                "timestamp": datetime.utcnow()
-            })
-
-        return {"message": "Transfer successful"}, 200
+        result, status = self.transfers.transfer(
+            source_filter={"user_id": ObjectId(sender_id), "status": "active"},
+            beneficiary=beneficiary,
+            amount=amount,
+            transfer_mode=transfer_mode,
+            user_id=sender_id,
+        )
+        if status != 200:
+            if result["error"] == "Source account not found":
+                return {"error": "Sender account not found"}, 404
+            if result["error"] == "Insufficient balance":
+                return {"error": "Insufficient funds"}, 400
+        return result, status
 
     # ---------------------- TRANSACTIONS ----------------------
-    def get_transactions(self, user_id, limit=50):
-        transactions = list(self.db.transactions.find({"user_id": ObjectId(user_id)}).sort("timestamp", -1).limit(limit))
+    def get_transactions(self, user_id, limit=50, cursor=None):
+        """Newest-first page of a user's transactions; pass next_cursor back to continue."""
+        limit = clamp_page_size(limit)
+        query = {"user_id": ObjectId(user_id)}
+        try:
+            after = keyset_filter(cursor)
+            end = _history_end(None, cursor)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if after:
+            query = {"$and": [query, after]}
+        transactions = self.read_archive.find(query, limit + 1, end=end)
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            next_cursor = encode_cursor(transactions[-1])
+        return {"transactions": transactions, "next_cursor": next_cursor}, 200
+
+    def iter_transactions(self, user_id, cursor=None, batch_size=500):
+        """
+        Cursor over a user's whole history newest-first (optionally resuming
+        after a keyset cursor), for streaming responses. Raises ValueError for
+        a malformed cursor.
+        """
+        query = {"user_id": ObjectId(user_id)}
+        after = keyset_filter(cursor)
+        if after:
+            query = {"$and": [query, after]}
+        return self.read_archive.find(query, end=_history_end(None, cursor), batch_size=batch_size)
+
+    def filter_transactions(self, user_id, account_number=None, ttype="all",
+                            start=None, end=None, limit=50, cursor=None):
+        """
+        One keyset page of transactions touching the user's account(s), with the
+        debit/credit classification, account number, type and date filters all
+        evaluated by Mongo in a single aggregation.
+        """
+        try:
+            pipeline = self._transaction_filter_pipeline(user_id, account_number, ttype, start, end, cursor)
+            until = _history_end(end, cursor)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if pipeline is None:
+            return {"transactions": [], "next_cursor": None, "message": "No account found"}, 200
+
+        limit = clamp_page_size(limit)
+        # $match, $sort, then cap the page before anything is projected
+        pipeline.insert(2, {"$limit": limit + 1})
+        transactions = self.read_archive.aggregate(pipeline, limit + 1, start=start, end=until)
+
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            last = transactions[-1]
+            next_cursor = encode_cursor({"timestamp": last["_ts"], "_id": last["_id"]})
         for t in transactions:
-            t["_id"] = str(t["_id"])
-            t["user_id"] = str(t["user_id"])
-            t["beneficiary_id"] = str(t.get("beneficiary_id"))
-        return {"transactions": transactions}, 200
+            del t["_ts"]
+        return {"transactions": transactions, "next_cursor": next_cursor}, 200
+
+    def iter_filtered_transactions(self, user_id, account_number=None, ttype="all",
+                                   start=None, end=None, cursor=None, batch_size=500):
+        """
+        Iterator over every transaction filter_transactions would page through,
+        for streaming responses. Returns None if the user has no matching account.
+        """
+        pipeline = self._transaction_filter_pipeline(user_id, account_number, ttype, start, end, cursor)
+        if pipeline is None:
+            return None
+        rows = self.read_archive.aggregate(pipeline, start=start, end=_history_end(end, cursor), batch_size=batch_size)
+        return ({k: v for k, v in row.items() if k != "_ts"} for row in rows)
+
+    def _transaction_filter_pipeline(self, user_id, account_number, ttype, start, end, cursor):
+        """
+        $match / $sort / $project stages for filter_transactions, or None if the
+        user has no matching account. Raises ValueError for a malformed cursor.
+        """
+        user_id_str = str(user_id)
+        account_query = {"user_id": {"$in": [user_id_str, ObjectId(user_id_str)]}}
+        if account_number:
+            account_query["account_number"] = account_number
+        accounts = list(self.read_db.accounts.find(account_query, {"_id": 1, "account_number": 1}))
+        if not accounts:
+            return None
+        numbers = [a["account_number"] for a in accounts]
+
+        # Every journal row carries user_id: the whole filter runs on the user_timestamp_id index
+        match = {"user_id": ObjectId(user_id_str), "account_number": {"$in": numbers}}
+        if ttype in ("debit", "credit"):
+            match["type"] = ttype
+        if start and end:
+            match["timestamp"] = {"$gte": start, "$lte": end}
+        after = keyset_filter(cursor)
+        if after:
+            match = {"$and": [match, after]}
+
+        projection = {
+            "_id": 1,
+            "transfer_id": 1,
+            "beneficiary_id": 1,
+            "amount": 1,
+            "transfer_mode": 1,
+            "type": 1,
+            "account_number": 1,
+            "timestamp": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$timestamp"}},
+            # raw timestamp, for merging archive tiers and building the next keyset cursor
+            "_ts": "$timestamp",
+        }
+        return [
+            {"$match": match},
+            {"$sort": dict(KEYSET_SORT)},
+            {"$project": projection},
+        ]
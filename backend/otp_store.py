@@ -0,0 +1,182 @@
+# otp_store.py
+"""
+One-time password storage.
+
+Only the newest OTP for an (email, purpose) is valid: create() deletes every
+earlier one, so at most one is live and a wrong guess is charged to the one
+code that could have matched. Verification is a single conditional
+find_one_and_delete on (email, purpose, code) that is still live, so two
+concurrent verifies of the same code can never both succeed; a miss costs one
+$inc of the live OTP's attempts. A caller that acts on the OTP's metadata
+(e.g. the pending transfer it was issued for) passes it to verify(), so the
+match is part of the same conditional delete and an OTP issued for another
+request is never consumed. Expired and exhausted records are never read
+back; the TTL index on otps.expires_at (indexes.py) removes them.
+
+Backends:
+  mongo  - `otps` collection, shared by every worker process (default)
+  memory - a dict in this process; verify never leaves the process, but an
+           OTP is only valid on the worker that issued it, so use it with a
+           single worker or sticky sessions
+
+Both expose create / verify / delete / set_delivery / delivery.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+MAX_ATTEMPTS = 5
+OTP_MISMATCH = "OTP was issued for another request"
+
+
+def _new_record(code, email, purpose, metadata, ttl_minutes):
+    now = datetime.now(UTC)
+    return {
+        "_id": ObjectId(),
+        "email": email,
+        "purpose": purpose,
+        "code": code,
+        "metadata": metadata or {},
+        "expires_at": now + timedelta(minutes=ttl_minutes),
+        "attempts": 0,
+        "created_at": now,
+    }
+
+
+def _matches(record, metadata):
+    return all(record["metadata"].get(key) == value for key, value in (metadata or {}).items())
+
+
+def _failure(record, metadata=None):
+    if record is None:
+        return False, "OTP not found or expired"
+    if record["attempts"] >= MAX_ATTEMPTS:
+        return False, "Too many attempts"
+    if not _matches(record, metadata):
+        return False, OTP_MISMATCH
+    return False, "Invalid OTP"
+
+
+class MongoOTPStore:
+    def __init__(self, db):
+        self.db = db
+
+    def create(self, code, email, purpose, metadata=None, ttl_minutes=10):
+        """Insert a new OTP, supersede the earlier ones and return the record (with its ObjectId _id)."""
+        record = _new_record(code, email, purpose, metadata, ttl_minutes)
+        self.db.otps.insert_one(record)
+        # Ordered on (created_at, _id), so concurrent creates leave exactly the newest one
+        self.db.otps.delete_many({"email": email, "purpose": purpose, "$or": [
+            {"created_at": {"$lt": record["created_at"]}},
+            {"created_at": record["created_at"], "_id": {"$lt": record["_id"]}},
+        ]})
+        return record
+
+    def verify(self, email, purpose, code, metadata=None):
+        """
+        Consume the live OTP for (email, purpose) if `code` and every key of
+        `metadata` match. Returns (True, record) on success, or (False, reason)
+        on failure (OTP_MISMATCH when the OTP belongs to another request).
+        """
+        live = {"email": email, "purpose": purpose,
+                "expires_at": {"$gt": datetime.now(UTC)}, "attempts": {"$lt": MAX_ATTEMPTS}}
+        bound = {f"metadata.{key}": value for key, value in (metadata or {}).items()}
+        record = self.db.otps.find_one_and_delete({**live, **bound, "code": str(code)})
+        if record:
+            return True, record
+        record = self.db.otps.find_one_and_update(
+            live,
+            {"$inc": {"attempts": 1}},
+            projection={"attempts": 1, "metadata": 1},
+            sort=[("created_at", -1), ("_id", -1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        return _failure(record, metadata)
+
+    def delete(self, otp_id):
+        self.db.otps.delete_one({"_id": ObjectId(str(otp_id))})
+
+    def set_delivery(self, otp_id, status):
+        if ObjectId.is_valid(otp_id):
+            self.db.otps.update_one({"_id": ObjectId(otp_id)}, {"$set": {"delivery": status}})
+
+    def delivery(self, otp_id):
+        if not ObjectId.is_valid(otp_id):
+            return None
+        record = self.db.otps.find_one({"_id": ObjectId(otp_id)}, {"delivery": 1})
+        return (record or {}).get("delivery")
+
+
+class MemoryOTPStore:
+    def __init__(self, sweep_interval=60):
+        self.sweep_interval = sweep_interval
+        self._records = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def create(self, code, email, purpose, metadata=None, ttl_minutes=10):
+        record = _new_record(code, email, purpose, metadata, ttl_minutes)
+        with self._lock:
+            self._sweep()
+            for key in [k for k, r in self._records.items() if r["email"] == email and r["purpose"] == purpose]:
+                del self._records[key]
+            self._records[record["_id"]] = record
+        return record
+
+    def verify(self, email, purpose, code, metadata=None):
+        now = datetime.now(UTC)
+        with self._lock:
+            live = [r for r in self._records.values()
+                    if r["email"] == email and r["purpose"] == purpose
+                    and r["expires_at"] > now and r["attempts"] < MAX_ATTEMPTS]
+            if not live:
+                return _failure(None)
+            newest = max(live, key=lambda r: (r["created_at"], r["_id"]))
+            if newest["code"] == str(code) and _matches(newest, metadata):
+                del self._records[newest["_id"]]
+                return True, newest
+            newest["attempts"] += 1
+            return _failure(newest, metadata)
+
+    def delete(self, otp_id):
+        with self._lock:
+            self._records.pop(ObjectId(str(otp_id)), None)
+
+    def set_delivery(self, otp_id, status):
+        if not ObjectId.is_valid(otp_id):
+            return
+        with self._lock:
+            record = self._records.get(ObjectId(otp_id))
+            if record:
+                record["delivery"] = status
+
+    def delivery(self, otp_id):
+        if not ObjectId.is_valid(otp_id):
+            return None
+        with self._lock:
+            return (self._records.get(ObjectId(otp_id)) or {}).get("delivery")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def _sweep(self):
+        """Drop expired and exhausted OTPs (what the TTL index does for Mongo). Caller holds the lock."""
+        if time.monotonic() < self._next_sweep:
+            return
+        now = datetime.now(UTC)
+        for otp_id in [i for i, r in self._records.items()
+                       if r["expires_at"] <= now or r["attempts"] >= MAX_ATTEMPTS]:
+            del self._records[otp_id]
+        self._next_sweep = time.monotonic() + self.sweep_interval
+
+
+def make_otp_store(backend, db):
+    if backend == "mongo":
+        return MongoOTPStore(db)
+    if backend == "memory":
+        return MemoryOTPStore()
+    raise ValueError(f"Unknown OTP store backend: {backend}")
@@ -0,0 +1,74 @@
+# pagination.py
+"""
+Opaque keyset cursors over (timestamp, _id) for newest-first listings.
+
+A cursor encodes the sort key of the last row on a page; the next page is
+everything strictly older than it. Unlike skip/offset, the cost of a page
+does not grow with how deep into the history it is, as long as the query is
+backed by an index ending in (timestamp -1, _id -1).
+"""
+import base64
+import json
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Sort order every cursor-paginated query must use
+KEYSET_SORT = [("timestamp", -1), ("_id", -1)]
+
+
+def clamp_page_size(limit, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if not limit or limit < 1:
+        return default
+    return min(limit, maximum)
+
+
+def encode_cursor(doc):
+    """Cursor pointing just past `doc` (a row sorted by KEYSET_SORT)."""
+    timestamp = doc["timestamp"]
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=UTC)
+    payload = {"t": int(timestamp.timestamp() * 1000), "i": str(doc["_id"])}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, ObjectId) for a cursor; raises ValueError if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        timestamp = datetime.fromtimestamp(payload["t"] / 1000, UTC)
+        return timestamp, ObjectId(payload["i"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_filter(cursor):
+    """Query fragment selecting rows that sort after the cursor (empty for the first page)."""
+    if not cursor:
+        return {}
+    timestamp, _id = decode_cursor(cursor)
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": _id}},
+    ]}
+
+
+def paginate(collection, query, limit, cursor=None, projection=None):
+    """
+    Fetch one page of `query` newest-first. Returns (docs, next_cursor);
+    next_cursor is None on the last page.
+    """
+    after = keyset_filter(cursor)
+    if after:
+        query = {"$and": [query, after]} if query else after
+    docs = list(collection.find(query, projection).sort(KEYSET_SORT).limit(limit + 1))
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1])
+    return docs, next_cursor
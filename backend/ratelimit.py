@@ -0,0 +1,129 @@
+# ratelimit.py
+"""
+Request rate limiting for the auth, OTP and transfer endpoints.
+
+Limits are written "N/period" where period is second, minute, hour, day or a
+number of seconds ("5/minute", "100/3600"). RateLimiter.check() charges one
+request to a key and reports whether it is allowed and, if not, how many
+seconds to wait; it also keeps allowed/limited counters per limit name for
+monitoring.
+
+Backends:
+  memory - token bucket per key in this process. Each worker enforces the
+           limit on its own, so the effective limit is N x workers.
+  mongo  - sliding-window counter in the `rate_limits` collection, shared by
+           every worker (one $inc upsert plus one _id read per check). Old
+           windows are removed by a TTL index. Point it at a local mongod to
+           stand in for the production cluster.
+
+A backend error never blocks a request: check() logs it and lets the request
+through.
+"""
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+
+from pymongo import ReturnDocument
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_limit(spec):
+    """Parse "10/minute" into (count, seconds) = (10, 60)."""
+    count, _, period = spec.partition("/")
+    period = period.strip().lower()
+    seconds = int(period) if period.isdigit() else PERIODS.get(period.rstrip("s"))
+    if not count.strip().isdigit() or not seconds:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return int(count), seconds
+
+
+class MemoryBackend:
+    def __init__(self, maxsize=100000):
+        # LRU-bounded; an evicted bucket simply starts full again
+        self._buckets = TTLCache(maxsize=maxsize, ttl=PERIODS["day"])
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        rate = limit / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key) or (limit, now)
+            tokens = min(limit, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets.set(key, (tokens - 1, now))
+                return True, 0
+            self._buckets.set(key, (tokens, now))
+        return False, (1 - tokens) / rate
+
+
+class MongoBackend:
+    def __init__(self, db):
+        self.db = db
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+        current = self.db.rate_limits.find_one_and_update(
+            {"_id": f"{key}:{window}"},
+            {"$inc": {"count": 1},
+             "$setOnInsert": {"expires_at": datetime.now(UTC) + timedelta(seconds=2 * period)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )["count"]
+        previous = self.db.rate_limits.find_one({"_id": f"{key}:{window - 1}"}, {"count": 1})
+        # Weight the previous window by how much of it still overlaps the sliding window
+        estimate = current + (previous or {}).get("count", 0) * (1 - elapsed / period)
+        if estimate <= limit:
+            return True, 0
+        return False, period - elapsed
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {"allowed": Counter(), "limited": Counter(), "errors": 0}
+        self._lock = threading.Lock()
+
+    def check(self, name, key, limit):
+        """
+        Charge one request for `key` against `limit` ("N/period").
+        Returns (allowed, retry_after_seconds).
+        """
+        count, period = parse_limit(limit)
+        try:
+            allowed, retry_after = self.backend.hit(f"{name}:{key}", count, period)
+        except Exception:
+            logger.exception("Rate limit backend failed; allowing request")
+            with self._lock:
+                self.stats["errors"] += 1
+            return True, 0
+        with self._lock:
+            self.stats["allowed" if allowed else "limited"][name] += 1
+        if allowed:
+            return True, 0
+        return False, max(1, math.ceil(retry_after))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "allowed": dict(self.stats["allowed"]),
+                "limited": dict(self.stats["limited"]),
+                "errors": self.stats["errors"],
+            }
+
+
+def make_rate_limiter(backend, db):
+    if backend == "memory":
+        return RateLimiter(MemoryBackend())
+    if backend == "mongo":
+        return RateLimiter(MongoBackend(db))
+    raise ValueError(f"Unknown rate limit backend: {backend}")
@@ -0,0 +1,203 @@
+# rollups.py
+"""
+Per-account monthly analytics rollups.
+
+Every journal row written by TransferEngine is folded into one
+`monthly_rollups` document per (account_number, year, month) with $inc, so
+/api/analytics/monthly reads at most twelve small documents per account and
+year instead of scanning the transaction history.
+
+rebuild() recomputes rollups from the journal (`transactions` and any
+archive months) with a server-side $group per tier whose results are $inc'ed
+together; it backfills history and repairs rollups missed while the incremental hook
+was not running (or failed outside a transaction).
+
+Transfers keep $inc'ing the live rollups while a rebuild runs, so it never
+deletes them up front. It aggregates the rows stamped before it started into
+a staging collection and then publishes that in one step: a full rebuild
+renames the staging collection over `monthly_rollups`, and a one-account
+rebuild replaces that account's documents. Readers therefore see the old or
+the new rollups, never a partial set. The rows journaled while it ran are
+then folded in again from the journal, because their live $inc's went to
+the documents it replaced. One case is still not exact: a transfer whose
+listener runs in the instant between the publish and the replay is counted
+twice. So is a posting backdated to before the start (an audit adjustment)
+that commits during the rebuild. Rebuild while transfers are quiet for
+exact totals; a second rebuild repairs a run that raced.
+"""
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from indexes import INDEXES
+
+TOP_PAYEES = 5
+
+
+def rollup_id(account_number, year, month):
+    return f"{account_number}:{year:04d}-{month:02d}"
+
+
+class MonthlyRollups:
+    def __init__(self, db, archive=None):
+        self.db = db
+        self.archive = archive
+
+    # ---------------------- WRITE PATH ----------------------
+    def record(self, entries, session=None):
+        """TransferEngine listener: fold journal entries into their month's rollup."""
+        ops = []
+        for entry in entries:
+            ts = entry["timestamp"]
+            kind = entry["type"]
+            inc = {f"{kind}_total": entry["amount"], f"{kind}_count": 1}
+            if kind == "debit" and entry.get("beneficiary_id"):
+                inc[f"payees.{entry['beneficiary_id']}"] = entry["amount"]
+            ops.append(UpdateOne(
+                {"_id": rollup_id(entry["account_number"], ts.year, ts.month)},
+                {
+                    "$inc": inc,
+                    "$set": {"updated_at": datetime.now(UTC)},
+                    "$setOnInsert": {
+                        "account_number": entry["account_number"],
+                        "user_id": entry["user_id"],
+                        "year": ts.year,
+                        "month": ts.month,
+                    },
+                },
+                upsert=True,
+            ))
+        if ops:
+            self.db.monthly_rollups.bulk_write(ops, ordered=False, session=session)
+
+    def rebuild(self, account_number=None, batch_size=500):
+        """
+        Recompute rollups from the transaction history (optionally for one
+        account). Returns the number of rollup documents written.
+        """
+        started = datetime.now(UTC)
+        # user_id None marks the bank's own ledger accounts (see ledger.py)
+        match = {"type": {"$in": ["debit", "credit"]}, "timestamp": {"$type": "date", "$lt": started},
+                 "account_number": {"$exists": True}, "user_id": {"$ne": None}}
+        if account_number:
+            match["account_number"] = account_number
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "account_number": "$account_number",
+                    "year": {"$year": "$timestamp"},
+                    "month": {"$month": "$timestamp"},
+                    "type": "$type",
+                    "payee": {"$cond": [{"$eq": ["$type", "debit"]}, "$beneficiary_id", None]},
+                },
+                "user_id": {"$first": "$user_id"},
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }},
+            {"$group": {
+                "_id": {
+                    "account_number": "$_id.account_number",
+                    "year": "$_id.year",
+                    "month": "$_id.month",
+                },
+                "user_id": {"$first": "$user_id"},
+                "parts": {"$push": {"type": "$_id.type", "payee": "$_id.payee",
+                                    "total": "$total", "count": "$count"}},
+            }},
+        ]
+
+        staging = self.db[f"monthly_rollups_rebuild_{ObjectId()}"]
+        staging.create_indexes(INDEXES["monthly_rollups"])
+        collections = [self.db.transactions] if self.archive is None else self.archive.collections()
+        written = 0
+        ops = []
+        try:
+            for collection in collections:
+                for group in collection.aggregate(pipeline, allowDiskUse=True):
+                    key = group["_id"]
+                    inc = {"debit_total": 0, "debit_count": 0, "credit_total": 0, "credit_count": 0}
+                    for part in group["parts"]:
+                        inc[f"{part['type']}_total"] += part["total"]
+                        inc[f"{part['type']}_count"] += part["count"]
+                        if part["payee"] is not None:
+                            inc[f"payees.{part['payee']}"] = part["total"]
+                    # A month can be split between an archive month and the hot tier
+                    ops.append(UpdateOne(
+                        {"_id": rollup_id(key["account_number"], key["year"], key["month"])},
+                        {
+                            "$inc": inc,
+                            "$set": {"updated_at": datetime.now(UTC)},
+                            "$setOnInsert": {"account_number": key["account_number"], "user_id": group["user_id"],
+                                             "year": key["year"], "month": key["month"]},
+                        },
+                        upsert=True,
+                    ))
+                    if len(ops) >= batch_size:
+                        staging.bulk_write(ops, ordered=False)
+                        written += len(ops)
+                        ops = []
+            if ops:
+                staging.bulk_write(ops, ordered=False)
+                written += len(ops)
+            published = self._publish(staging, account_number, batch_size)
+        finally:
+            staging.drop()
+        self._replay(account_number, started, published, batch_size)
+        return written
+
+    def _publish(self, staging, account_number, batch_size):
+        """Make the staged rollups the live ones; returns when that happened."""
+        if account_number is None:
+            staging.rename("monthly_rollups", dropTarget=True)
+            return datetime.now(UTC)
+        ops = []
+        for doc in staging.find():
+            ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            if len(ops) >= batch_size:
+                self.db.monthly_rollups.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.db.monthly_rollups.bulk_write(ops, ordered=False)
+        self.db.monthly_rollups.delete_many({"account_number": account_number,
+                                             "_id": {"$nin": staging.distinct("_id")}})
+        return datetime.now(UTC)
+
+    def _replay(self, account_number, since, until, batch_size):
+        """Fold in the journal rows stamped in [since, until], written while the rollups were being rebuilt."""
+        # Inclusive: stored timestamps keep milliseconds, so a row of the publish's own millisecond compares equal
+        match = {"timestamp": {"$gte": since, "$lte": until}, "type": {"$in": ["debit", "credit"]},
+                 "user_id": {"$ne": None}}
+        if account_number:
+            match["account_number"] = account_number
+        entries = []
+        for row in self.db.transactions.find(match).sort([("timestamp", 1), ("_id", 1)]):
+            entries.append(row)
+            if len(entries) >= batch_size:
+                self.record(entries)
+                entries = []
+        self.record(entries)
+
+    # ---------------------- READ PATH ----------------------
+    def monthly(self, year, account_numbers):
+        """
+        Twelve entries (January..December) with debit/credit totals and counts
+        summed over `account_numbers`, plus the top payees for each month.
+        """
+        months = [{"month": m, "debit": 0, "credit": 0, "debit_count": 0, "credit_count": 0, "payees": {}}
+                  for m in range(1, 13)]
+        cursor = self.db.monthly_rollups.find({"account_number": {"$in": account_numbers}, "year": year})
+        for doc in cursor:
+            slot = months[doc["month"] - 1]
+            slot["debit"] += doc.get("debit_total", 0)
+            slot["credit"] += doc.get("credit_total", 0)
+            slot["debit_count"] += doc.get("debit_count", 0)
+            slot["credit_count"] += doc.get("credit_count", 0)
+            for payee, total in doc.get("payees", {}).items():
+                slot["payees"][payee] = slot["payees"].get(payee, 0) + total
+
+        for slot in months:
+            top = sorted(slot.pop("payees").items(), key=lambda item: item[1], reverse=True)[:TOP_PAYEES]
+            slot["top_beneficiaries"] = [{"beneficiary_id": payee, "total": total} for payee, total in top]
+        return months
@@ -0,0 +1,141 @@
+# statements.py
+"""
+Background account-statement generation.
+
+/api/statement/verify only flips a `statements` job document to "queued" and
+hands its id to StatementGenerator. A worker thread then streams the account's
+transactions out of Mongo in batches, writes them to a CSV file on disk and
+records progress on the job document, so any worker process can answer a
+status poll. Neither the request thread nor the worker ever holds more than
+one batch of transactions in memory.
+
+With a Ledger, each statement also records its opening balance (from the
+latest ledger snapshot plus the entries since) and its closing balance.
+"""
+import csv
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+
+CSV_COLUMNS = ["timestamp", "type", "transfer_mode", "amount", "transfer_id", "_id"]
+
+
+class StatementGenerator:
+    def __init__(self, db, output_dir, workers=2, batch_size=1000, retention_hours=24, ledger=None,
+                 archive=None):
+        self.db = db
+        self.ledger = ledger
+        self.archive = archive
+        self.output_dir = output_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retention = timedelta(hours=retention_hours)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, statement_id):
+        """Queue generation of an already-verified statement job."""
+        self._ensure_started()
+        self._executor.submit(self._run, ObjectId(str(statement_id)))
+
+    def path_for(self, statement_id):
+        return os.path.join(self.output_dir, f"statement-{statement_id}.csv")
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Executor threads do not survive a fork: start a fresh pool in this process
+                os.makedirs(self.output_dir, exist_ok=True)
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="statement")
+                self._pid = os.getpid()
+
+    # ---------------------- WORKER ----------------------
+    def _run(self, statement_id):
+        job = self.db.statements.find_one_and_update(
+            {"_id": statement_id, "status": "queued"},
+            {"$set": {"status": "running", "started_at": datetime.now(UTC)}}
+        )
+        if not job:
+            return
+        path = self.path_for(statement_id)
+        try:
+            query = {
+                "user_id": ObjectId(job["user_id"]),
+                "account_number": job["account_number"],
+                "timestamp": {"$gte": job["start"], "$lte": job["end"]},
+            }
+            if self.archive is not None:
+                total = self.archive.count(query, job["start"], job["end"])
+            else:
+                total = self.db.transactions.count_documents(query)
+            progress = {"total": total}
+            if self.ledger is not None:
+                balance = progress["opening_balance"] = self.ledger.balance_as_of(job["account_number"],
+                                                                                  job["start"])["balance"]
+            self.db.statements.update_one({"_id": statement_id}, {"$set": progress})
+
+            written = 0
+            tmp_path = path + ".part"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as fh:
+                writer = csv.writer(fh)
+                writer.writerow(CSV_COLUMNS)
+                projection = {c: 1 for c in CSV_COLUMNS}
+                if self.archive is not None:
+                    cursor = self.archive.find(query, start=job["start"], end=job["end"], ascending=True,
+                                               batch_size=self.batch_size, projection=projection)
+                else:
+                    cursor = (self.db.transactions.find(query, projection)
+                              .sort([("timestamp", 1), ("_id", 1)])
+                              .batch_size(self.batch_size))
+                for t in cursor:
+                    writer.writerow([
+                        t["timestamp"].strftime("%Y-%m-%d %H:%M:%S") if t.get("timestamp") else "",
+                        t.get("type", ""),
+                        t.get("transfer_mode", ""),
+                        t.get("amount", ""),
+                        str(t.get("transfer_id", "")),
+                        str(t["_id"]),
+                    ])
+                    written += 1
+                    if self.ledger is not None:
+                        balance += t.get("amount", 0) if t.get("type") == "credit" else -t.get("amount", 0)
+                    if written % self.batch_size == 0:
+                        self.db.statements.update_one({"_id": statement_id}, {"$set": {"written": written}})
+            os.replace(tmp_path, path)
+
+            done = {
+                "status": "ready",
+                "written": written,
+                "file_path": path,
+                "finished_at": datetime.now(UTC),
+                "expires_at": datetime.now(UTC) + self.retention,
+            }
+            if self.ledger is not None:
+                done["closing_balance"] = round(balance, 2)
+            self.db.statements.update_one({"_id": statement_id}, {"$set": done})
+        except Exception as e:
+            self.db.statements.update_one({"_id": statement_id}, {"$set": {
+                "status": "failed",
+                "error": str(e),
+                "finished_at": datetime.now(UTC),
+            }})
+        self._prune_files()
+
+    def _prune_files(self):
+        """Delete statement files past the retention window (their job docs expire via TTL)."""
+        cutoff = time.time() - self.retention.total_seconds()
+        try:
+            for name in os.listdir(self.output_dir):
+                path = os.path.join(self.output_dir, name)
+                if name.startswith("statement-") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,63 @@
+# streaming.py
+"""
+Streaming responses for list endpoints.
+
+Instead of materialising a cursor into a list and calling jsonify on it, the
+rows are encoded one at a time straight from the PyMongo cursor and written
+to the client as chunked JSON (the same shape the buffered endpoint returns)
+or as NDJSON, one document per line. Memory per request is bounded by the
+cursor batch size rather than the size of the listing.
+
+A client opts in with `?stream=1` (chunked JSON) or with
+`Accept: application/x-ndjson` (NDJSON).
+"""
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Rows fetched per round trip while streaming
+STREAM_BATCH_SIZE = 500
+
+
+def encode_row(row):
+    """One document as compact JSON, encoded like every other response (see json_provider.py)."""
+    return current_app.json.dumps(row)
+
+
+def wants_ndjson():
+    return NDJSON_MIMETYPE in request.headers.get("Accept", "")
+
+
+def wants_stream():
+    """True if the client asked for a streamed rather than a buffered listing."""
+    return request.args.get("stream") in ("1", "true") or wants_ndjson()
+
+
+def stream_rows(rows, key, extra=None):
+    """
+    Stream `rows` (any iterable of documents, typically a PyMongo cursor) as
+    NDJSON or as `{"<key>": [...], **extra}`. `extra` may be a callable,
+    evaluated after the last row, for values only known once iteration ends.
+    """
+    if wants_ndjson():
+        def generate_ndjson():
+            for row in rows:
+                yield encode_row(row) + "\n"
+
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON_MIMETYPE)
+
+    def generate_json():
+        yield '{"' + key + '":['
+        first = True
+        for row in rows:
+            if not first:
+                yield ","
+            first = False
+            yield encode_row(row)
+        yield "]"
+        trailer = extra() if callable(extra) else extra
+        for name, value in (trailer or {}).items():
+            yield "," + current_app.json.dumps(name) + ":" + current_app.json.dumps(value)
+        yield "}\n"
+
+    return Response(stream_with_context(generate_json()), mimetype="application/json")
@@ -0,0 +1,109 @@
+# tests/conftest.py
+"""
+Shared fixtures. The app runs in-process against mongomock and OTP mail is
+captured instead of sent, so the suite needs no mongod or SMTP server:
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.update({
+    "MONGO_URI": "mongodb://localhost:27017/bank_test",
+    "MONGO_BOOTSTRAP_INDEXES": "false",
+    "FLASK_SECRET_KEY": "test-secret-key-0123456789abcdef0123",
+    "MAIL_ASYNC": "false",
+    "MAIL_USERNAME": "bank@example.com",
+    "MAIL_PASSWORD": "unused",
+    "PASSWORD_HASH_WORKERS": "0",
+    "PASSWORD_HASH_ROUNDS": "4",
+    "RATE_LIMIT_ENABLED": "false",
+    "STATEMENT_DIR": tempfile.mkdtemp(prefix="bank-statements-"),
+})
+
+import connections  # noqa: E402
+
+connections.MongoClient = lambda uri, **options: mongomock.MongoClient(uri)
+
+PASSWORD = "correct horse"
+
+
+@pytest.fixture
+def db():
+    """An empty mongomock database, for testing modules on their own."""
+    return mongomock.MongoClient().bank_test
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import flask_mail
+
+    import app as app_module
+
+    app_module.sent_mail = []
+    flask_mail.Mail.send = lambda self, message: app_module.sent_mail.append(message)
+    return app_module
+
+
+@pytest.fixture
+def app_db(app_module):
+    """The app's database, emptied (with the in-process caches) before each test."""
+    database = app_module.mongo.db
+    for name in database.list_collection_names():
+        database.drop_collection(name)
+    app_module.bank_model.user_cache.clear()
+    app_module.beneficiary_cache.clear()
+    app_module.bank_model.archive.state_cache.clear()
+    app_module.sent_mail.clear()
+    return database
+
+
+@pytest.fixture
+def client(app_module, app_db):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def make_user(client):
+    """make_user(email, deposit) registers a user with one account; returns its token, headers and account."""
+    def make(email="alice@example.com", deposit=1000):
+        response = client.post("/api/auth/register", json={
+            "name": email.split("@")[0], "email": email, "password": PASSWORD,
+            "address": "1 Main St", "date_of_birth": "1990-01-01",
+        })
+        assert response.status_code == 201, response.json
+        token = client.post("/api/auth/login", json={"email": email, "password": PASSWORD}).json["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        account = client.post("/api/user/accounts", json={"account_type": "savings", "initial_deposit": deposit},
+                              headers=headers).json["account"]
+        return {"email": email, "token": token, "headers": headers, "account": account}
+    return make
+
+
+@pytest.fixture
+def payer(client, make_user):
+    """A user with ₹1000 and a verified beneficiary: another customer's account."""
+    user = make_user("alice@example.com", deposit=1000)
+    payee = make_user("bob@example.com", deposit=0)
+    response = client.post("/api/beneficiaries", json={
+        "name": "Bob", "account_number": payee["account"]["account_number"], "ifsc": "BANK0001",
+        "email": payee["email"], "bank_name": "Bank",
+    }, headers=user["headers"])
+    user["beneficiary_id"] = response.json["beneficiary_id"]
+    user["payee"] = payee
+    return user
+
+
+@pytest.fixture
+def issued_otp(app_db):
+    """issued_otp(email, purpose): the code of the newest OTP issued to `email`."""
+    def code(email, purpose):
+        return app_db.otps.find_one({"email": email, "purpose": purpose}, sort=[("created_at", -1)])["code"]
+    return code
@@ -0,0 +1,27 @@
+# tests/test_account_numbers.py
+from concurrent.futures import ThreadPoolExecutor
+
+from account_numbers import AccountNumberAllocator, is_valid_account_number, luhn_check_digit
+
+
+def test_luhn_check_digit():
+    assert luhn_check_digit("7992739871") == "3"
+    assert is_valid_account_number("79927398713")
+    assert not is_valid_account_number("79927398731")  # two digits transposed
+    assert not is_valid_account_number("7")
+
+
+def test_allocators_never_hand_out_the_same_number(db):
+    workers = [AccountNumberAllocator(db, block_size=5) for _ in range(3)]
+    with ThreadPoolExecutor(6) as pool:
+        numbers = list(pool.map(lambda i: workers[i % 3].allocate(), range(60)))
+    assert len(set(numbers)) == 60
+    assert all(len(n) == 10 and is_valid_account_number(n) for n in numbers)
+    assert db.counters.find_one({"_id": "account_number"})["next"] >= 100000000 + 60
+
+
+def test_a_forked_worker_leases_its_own_block(db, monkeypatch):
+    allocator = AccountNumberAllocator(db, block_size=10)
+    first = allocator.allocate()
+    monkeypatch.setattr("account_numbers.os.getpid", lambda: -1)
+    assert int(allocator.allocate()[:-1]) == int(first[:-1]) + 10
@@ -0,0 +1,60 @@
+# tests/test_archive.py
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+
+from archive import STATE_ID, TransactionArchive, collection_name, month_start
+
+
+def journal_row(user_id, timestamp, amount=1.0, **fields):
+    return {"_id": ObjectId(), "user_id": user_id, "account_number": "1000000008", "type": "credit",
+            "amount": amount, "timestamp": timestamp, **fields}
+
+
+def test_rows_are_selected_by_timestamp_including_late_backfills(db):
+    user_id = ObjectId()
+    now = datetime.now(UTC)
+    old = now - timedelta(days=400)
+    # Inserted now with an old timestamp, as an audit adjustment or a backfill is: its _id is new
+    backfilled = journal_row(user_id, old + timedelta(hours=1))
+    db.transactions.insert_many([journal_row(user_id, old), backfilled, journal_row(user_id, now)])
+    archive = TransactionArchive(db, hot_days=365, state_ttl=0)
+
+    assert archive.archive() == 2
+    assert db.transactions.count_documents({}) == 1
+    assert db[collection_name(month_start(old))].find_one({"_id": backfilled["_id"]}) is not None
+    rows = archive.find({"user_id": user_id}, limit=10)
+    assert [row["_id"] for row in rows][1] == backfilled["_id"]
+    assert len(rows) == 3
+
+
+def test_a_row_caught_in_both_tiers_is_read_once(db):
+    user_id = ObjectId()
+    old = datetime.now(UTC) - timedelta(days=400)
+    row = journal_row(user_id, old)
+    db.transactions.insert_one(row)
+    archive = TransactionArchive(db, hot_days=365, state_ttl=0)
+    archive.archive()
+    # An interrupted run copied the row but had not yet deleted it from the hot tier
+    db.transactions.insert_one(row)
+
+    assert [r["_id"] for r in archive.find({"user_id": user_id}, limit=10)] == [row["_id"]]
+    assert [r["_id"] for r in archive.find({"user_id": user_id})] == [row["_id"]]
+    assert archive.archive() == 1
+    assert db.transactions.count_documents({}) == 0
+
+
+def test_state_is_cached_and_refreshed_by_archive(db, monkeypatch):
+    archive = TransactionArchive(db, hot_days=365, state_ttl=60)
+    monkeypatch.setattr("archive.time.sleep", lambda seconds: None)  # no other processes to wait for
+    reader = archive.with_db(db)
+    assert archive.months() == []
+    db.archive_state.insert_one({"_id": STATE_ID, "watermark": datetime.now(UTC), "months": ["transactions_2020_01"]})
+    # Served from this process's cache until it expires, whichever handle reads it
+    assert reader.months() == []
+
+    db.transactions.insert_one(journal_row(ObjectId(), datetime(2021, 3, 5, tzinfo=UTC)))
+    archive.archive()
+    # Refreshed for every reader of the same archive
+    assert [collection.name for collection, _, _ in reader.months()] == ["transactions_2021_03",
+                                                                         "transactions_2020_01"]
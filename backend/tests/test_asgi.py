@@ -0,0 +1,29 @@
+# tests/test_asgi.py
+import json
+
+from bson.objectid import ObjectId
+from starlette.testclient import TestClient
+
+
+def test_other_routes_and_streamed_listings_fall_through_to_flask(client, app_module, app_db, payer):
+    import asgi
+
+    source = app_db.accounts.find_one({"account_number": payer["account"]["account_number"]})
+    beneficiary = app_db.beneficiaries.find_one({"_id": ObjectId(payer["beneficiary_id"])})
+    app_module.bank_model.transfers.transfer({"account_number": source["account_number"]}, beneficiary,
+                                             250.0, "IMPS", source["user_id"])
+
+    # Without entering the client's context the lifespan (and its Motor client) never starts:
+    # only requests answered by the mounted Flask app can succeed
+    asgi_client = TestClient(asgi.app)
+    beneficiaries = asgi_client.get("/api/beneficiaries", headers=payer["headers"])
+    assert beneficiaries.status_code == 200
+    assert beneficiaries.json() == client.get("/api/beneficiaries", headers=payer["headers"]).json
+
+    streamed = asgi_client.get("/api/transactions?stream=1", headers=payer["headers"])
+    assert streamed.status_code == 200
+    rows = json.loads(streamed.text)["transactions"]
+    assert "debit" in [row["type"] for row in rows]
+    assert rows == json.loads(client.get("/api/transactions?stream=1", headers=payer["headers"]).get_data())[
+        "transactions"]
+    assert asgi_client.get("/api/nowhere").status_code == 404
@@ -0,0 +1,41 @@
+# tests/test_auth.py
+from conftest import PASSWORD
+
+
+def test_register_and_login(client, make_user):
+    user = make_user()
+    profile = client.get("/api/user/profile", headers=user["headers"])
+    assert profile.status_code == 200
+    assert profile.json["email"] == user["email"]
+    assert "password" not in profile.json
+
+
+def test_login_rejects_wrong_password(client, make_user):
+    user = make_user()
+    response = client.post("/api/auth/login", json={"email": user["email"], "password": PASSWORD + "!"})
+    assert response.status_code == 401
+
+
+def test_protected_route_requires_token(client):
+    assert client.get("/api/user/profile").status_code == 401
+
+
+def test_registration_otp_guesses_are_rate_limited(client, app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "RATE_LIMIT_ENABLED", True)
+    guess = {"email": "mallory@example.com", "otp": "000000"}
+    statuses = [client.post("/api/auth/register/verify", json=guess).status_code for _ in range(11)]
+    assert statuses[:10] == [400] * 10
+    assert statuses[10] == 429
+
+
+def test_profile_is_cached_until_the_user_changes(client, app_db, make_user):
+    user = make_user()
+    client.get("/api/user/profile", headers=user["headers"])
+    # A write that bypasses the model is not seen until the entry is invalidated
+    app_db.users.update_one({"email": user["email"]}, {"$set": {"name": "renamed"}})
+    assert client.get("/api/user/profile", headers=user["headers"]).json["name"] == "alice"
+
+    response = client.post("/api/auth/change_password", json={"old_password": PASSWORD, "new_password": "new horse"},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    assert client.get("/api/user/profile", headers=user["headers"]).json["name"] == "renamed"
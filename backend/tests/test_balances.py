@@ -0,0 +1,69 @@
+# tests/test_balances.py
+import time
+
+from bson.objectid import ObjectId
+
+from balances import make_balance_cache
+
+
+def test_mongo_store_shares_snapshots_across_workers(db):
+    user_id = ObjectId()
+    db.accounts.insert_one({"user_id": user_id, "account_number": "1000000008", "balance": 100.0})
+    # Two workers, each with its own BalanceCache on the shared collection
+    first, second = (make_balance_cache("mongo", db, ttl=300) for _ in range(2))
+    before = second.snapshot(user_id)
+
+    first.record([{"user_id": user_id, "account_number": "1000000008", "type": "debit", "amount": 40.0}])
+
+    after = second.snapshot(user_id)
+    assert after["accounts"]["1000000008"]["balance"] == 60.0
+    assert after["version"] != before["version"]
+
+
+def test_balance_etag_changes_after_a_transfer_elsewhere(client, app_module, make_user):
+    user = make_user(deposit=1000)
+    first = client.get("/api/user/balance", headers=user["headers"])
+    etag = first.headers["ETag"]
+    assert client.get("/api/user/balance", headers={**user["headers"], "If-None-Match": etag}).status_code == 304
+
+    # As another worker would: straight to the shared store, not through this process's cache object
+    number = user["account"]["account_number"]
+    other_worker = make_balance_cache("mongo", app_module.mongo.db, ttl=300)
+    other_worker.record([{"user_id": user["account"]["user_id"], "account_number": number,
+                          "type": "credit", "amount": 5.0}])
+
+    response = client.get("/api/user/balance", headers={**user["headers"], "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["balances"][number] == 1005.0
+
+
+def test_balance_is_written_through_by_transfers(client, payer, issued_otp):
+    first = client.get("/api/user/balance", headers=payer["headers"])
+    etag = first.headers["ETag"]
+    assert client.get("/api/user/balance", headers={**payer["headers"], "If-None-Match": etag}).status_code == 304
+
+    pending = client.post("/api/transfer/initiate", json={
+        "beneficiary_id": payer["beneficiary_id"], "amount": 250, "transfer_mode": "IMPS",
+        "from_acc_number": payer["account"]["account_number"],
+    }, headers=payer["headers"]).json["pending_transfer_id"]
+    client.post("/api/transfer/verify", json={
+        "pending_transfer_id": pending, "otp": issued_otp(payer["email"], "transfer"),
+    }, headers=payer["headers"])
+
+    response = client.get("/api/user/balance", headers={**payer["headers"], "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["balances"][payer["account"]["account_number"]] == 750
+    payee = client.get("/api/user/balance", headers=payer["payee"]["headers"]).json
+    assert payee["balances"][payer["payee"]["account"]["account_number"]] == 250
+
+
+def test_long_poll_waits_on_the_version_a_javascript_client_echoes(client, make_user):
+    user = make_user(deposit=1000)
+    version = client.get("/api/user/balance", headers=user["headers"]).json["version"]
+    # A number above 2**53 would come back rounded from JSON.parse and never match
+    assert isinstance(version, str)
+
+    started = time.monotonic()
+    response = client.get("/api/user/balance", query_string={"since": version, "wait": 0.2}, headers=user["headers"])
+    assert time.monotonic() - started >= 0.2
+    assert response.json["version"] == version
@@ -0,0 +1,61 @@
+# tests/test_batches.py
+from bson.objectid import ObjectId
+
+
+def balances(app_db):
+    return {account["account_number"]: account["balance"] for account in app_db.accounts.find()}
+
+
+def test_batch_is_paid_once_after_its_otp(client, app_db, payer, issued_otp):
+    response = client.post("/api/transfer/batch/initiate", json={
+        "from_acc_number": payer["account"]["account_number"], "transfer_mode": "NEFT",
+        "items": [{"beneficiary_id": payer["beneficiary_id"], "amount": amount, "reference": f"r{amount}"}
+                  for amount in (100, 200, 300)],
+    }, headers=payer["headers"])
+    assert response.status_code == 200, response.json
+    assert (response.json["count"], response.json["total"]) == (3, 600)
+    batch_id = response.json["pending_batch_id"]
+
+    approve = {"pending_batch_id": batch_id, "otp": issued_otp(payer["email"], "transfer_batch")}
+    paid = client.post("/api/transfer/batch/verify", json=approve, headers=payer["headers"])
+    assert paid.status_code == 200, paid.json
+    assert paid.json["summary"] == {"completed": 3, "failed": 0, "amount_paid": 600}
+    assert [result["reference"] for result in paid.json["results"]] == ["r100", "r200", "r300"]
+    assert balances(app_db)[payer["account"]["account_number"]] == 400
+    assert balances(app_db)[payer["payee"]["account"]["account_number"]] == 600
+    assert app_db.transactions.count_documents({"batch_id": ObjectId(batch_id)}) == 6
+
+    # Neither the OTP nor the batch can be used again
+    assert client.post("/api/transfer/batch/verify", json=approve, headers=payer["headers"]).status_code == 400
+    status = client.get(f"/api/transfer/batch/{batch_id}", headers=payer["headers"])
+    assert status.json["status"] == "completed"
+
+
+def test_csv_batch_is_validated_up_front(client, payer):
+    csv = f"beneficiary_id,amount\n{payer['beneficiary_id']},50\nnot-an-id,10\n{payer['beneficiary_id']},-1\n"
+    response = client.post(
+        f"/api/transfer/batch/initiate?from_acc_number={payer['account']['account_number']}&transfer_mode=NEFT",
+        data=csv, content_type="text/csv", headers=payer["headers"])
+    assert response.status_code == 400
+    assert response.json["errors"] == [{"index": 1, "error": "Invalid beneficiary_id"},
+                                       {"index": 2, "error": "Amount must be greater than zero"}]
+
+
+def test_batch_over_the_balance_is_refused(client, payer):
+    response = client.post("/api/transfer/batch/initiate", json={
+        "from_acc_number": payer["account"]["account_number"], "transfer_mode": "NEFT",
+        "items": [{"beneficiary_id": payer["beneficiary_id"], "amount": 600}] * 2,
+    }, headers=payer["headers"])
+    assert (response.status_code, response.json) == (400, {"error": "Insufficient balance for the batch total"})
+
+
+def test_transfer_many_pays_items_in_order_while_the_balance_lasts(app_module, app_db, payer):
+    source = app_db.accounts.find_one({"account_number": payer["account"]["account_number"]})
+    beneficiary = app_db.beneficiaries.find_one({"_id": ObjectId(payer["beneficiary_id"])})
+    results = app_module.bank_model.transfers.transfer_many(
+        {"account_number": source["account_number"]},
+        [{"beneficiary": beneficiary, "amount": amount} for amount in (700, 400, 300)],
+        "NEFT", source["user_id"], chunk_size=2)
+    assert [result["status"] for result in results] == ["completed", "failed", "completed"]
+    assert results[1]["error"] == "Insufficient balance"
+    assert balances(app_db)[source["account_number"]] == 0
@@ -0,0 +1,43 @@
+# tests/test_connections.py
+import mongomock
+import pytest
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+import connections
+from connections import MongoConnections, make_read_preference
+
+
+def test_read_preference_validation():
+    assert make_read_preference("primary", 10) == Primary()
+    preference = make_read_preference("secondaryPreferred", 90)
+    assert (type(preference), preference.max_staleness) == (SecondaryPreferred, 90)
+    assert make_read_preference("nearest").max_staleness == -1
+    with pytest.raises(ValueError, match="at least 90"):
+        make_read_preference("secondary", 30)
+    with pytest.raises(ValueError, match="Unknown read preference"):
+        make_read_preference("secondary_preferred")
+
+
+def test_each_process_opens_its_own_client(monkeypatch):
+    opened = []
+
+    def client(uri, **options):
+        opened.append(options)
+        return mongomock.MongoClient(uri)
+
+    pid = [100]
+    monkeypatch.setattr(connections, "MongoClient", client)
+    monkeypatch.setattr(connections.os, "getpid", lambda: pid[0])
+    mongo = MongoConnections("mongodb://localhost:27017/bank_test", max_pool_size=7, wait_queue_timeout_ms=None)
+    assert opened == []  # nothing is opened at construction, i.e. before a fork
+
+    mongo.db.things.insert_one({"_id": 1})
+    assert mongo.read_db.things.find_one({"_id": 1}) == {"_id": 1}
+    assert len(opened) == 1
+    assert opened[0]["maxPoolSize"] == 7 and "waitQueueTimeoutMS" not in opened[0]
+    assert list(mongo.pool_stats()) == ["pymongo"]
+
+    pid[0] = 101  # a forked worker
+    assert mongo.pool_stats() == {}
+    mongo.db.things.find_one()
+    assert len(opened) == 2
@@ -0,0 +1,63 @@
+# tests/test_directory.py
+from directory import BeneficiaryDirectory
+
+
+def verified(db, account_number, name, user="u1"):
+    beneficiary = {"user_id": user, "account_number": account_number, "name": name,
+                   "bank_name": "Bank", "verified": True}
+    db.beneficiaries.insert_one(dict(beneficiary))
+    return beneficiary
+
+
+def search_all(directory, q, limit):
+    entries, cursor = [], None
+    while True:
+        page, status = directory.search(q, limit=limit, cursor=cursor)
+        assert status == 200, page
+        entries.extend(entry["account_number"] for entry in page["entries"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return entries
+
+
+def test_each_payee_is_listed_once_and_keeps_its_first_name(db):
+    directory = BeneficiaryDirectory(db)
+    directory.record(verified(db, "1000000008", "Bob"))
+    directory.record(verified(db, "1000000008", "Robert", user="u2"))
+    entry = db.beneficiary_directory.find_one({"_id": "1000000008"})
+    assert (entry["name"], entry["added_by"]) == ("Bob", 2)
+
+
+def test_prefix_search_pages_by_number_and_by_name(db):
+    directory = BeneficiaryDirectory(db)
+    for i, name in enumerate(["Carol", "carla", "Bob", "Carl", "Dan"]):
+        verified(db, f"10000000{i}{i}", name)
+    db.beneficiaries.insert_one({"user_id": "u1", "account_number": "1000000099", "name": "Cary",
+                                 "verified": False})
+    assert directory.rebuild() == 5
+
+    assert search_all(directory, "CAR", limit=1) == ["1000000033", "1000000011", "1000000000"]
+    assert search_all(directory, "100000002", limit=2) == ["1000000022"]
+    assert search_all(directory, "1", limit=2) == [f"10000000{i}{i}" for i in range(5)]
+    assert directory.search(" ")[1] == 400
+    assert directory.search("car", cursor="bm90LWEtbGlzdA")[1] == 400
+
+
+def test_beneficiary_list_is_served_with_an_etag(client, payer):
+    first = client.get("/api/beneficiaries", headers=payer["headers"])
+    assert [b["name"] for b in first.json["beneficiaries"]] == ["Bob"]
+    etag = first.headers["ETag"]
+    unchanged = client.get("/api/beneficiaries", headers={**payer["headers"], "If-None-Match": etag})
+    assert unchanged.status_code == 304
+
+    client.post("/api/beneficiaries", json={
+        "name": "Elsewhere", "account_number": "5000000001", "ifsc": "OTHR0001",
+        "email": "e@example.com", "bank_name": "Other",
+    }, headers=payer["headers"])
+    changed = client.get("/api/beneficiaries", headers={**payer["headers"], "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert [(b["name"], b["verified"]) for b in changed.json["beneficiaries"]] == [("Bob", True),
+                                                                                  ("Elsewhere", False)]
+    # Only the verified payee is in the directory
+    found = client.get("/api/beneficiaries/directory", query_string={"q": "e"}, headers=payer["headers"])
+    assert found.json["entries"] == []
@@ -0,0 +1,113 @@
+# tests/test_events.py
+import asyncio
+import threading
+
+from bson.objectid import ObjectId
+
+from events import AsyncSubscription
+
+
+def test_transfers_are_pushed_to_both_parties(app_module, app_db, payer):
+    hub = app_module.event_hub
+    source = app_db.accounts.find_one({"account_number": payer["account"]["account_number"]})
+    receiver = app_db.accounts.find_one({"account_number": payer["payee"]["account"]["account_number"]})
+    beneficiary = app_db.beneficiaries.find_one({"_id": ObjectId(payer["beneficiary_id"])})
+    sent, received = hub.subscribe(source["user_id"]), hub.subscribe(receiver["user_id"])
+    try:
+        app_module.bank_model.transfers.transfer({"account_number": source["account_number"]}, beneficiary,
+                                                 250.0, "IMPS", source["user_id"])
+        (debit,), overflowed = sent.wait(1)
+        assert (debit["type"], debit["amount"], overflowed) == ("debit", 250.0, False)
+        (credit,), _ = received.wait(1)
+        assert (credit["type"], credit["account_number"]) == ("credit", receiver["account_number"])
+        # A reconnecting client is sent what it missed after its Last-Event-ID
+        assert [row["_id"] for row in hub.replay(receiver["user_id"], str(ObjectId("0" * 24)))] == [credit["_id"]]
+    finally:
+        hub.unsubscribe(sent)
+        hub.unsubscribe(received)
+    assert hub.connected() == 0
+
+
+def test_an_overflowed_subscription_asks_for_a_resync(app_module):
+    hub = app_module.event_hub
+    subscription = hub.subscribe("u1")
+    try:
+        for i in range(hub.max_pending + 1):
+            hub.publish("u1", {"n": i})
+        assert subscription.wait(0) == ([], True)
+        assert subscription.wait(0) == ([], False)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def test_async_subscription_is_woken_from_another_thread():
+    async def scenario():
+        subscription = AsyncSubscription("u1", max_pending=10, loop=asyncio.get_running_loop())
+        threading.Timer(0.05, subscription.push, [{"_id": "a"}]).start()
+        assert await subscription.wait(5) == ([{"_id": "a"}], False)
+        assert await subscription.wait(0.01) == ([], False)
+
+    asyncio.run(scenario())
+
+
+def test_async_subscription_overflow_asks_for_a_resync():
+    async def scenario():
+        subscription = AsyncSubscription("u1", max_pending=2, loop=asyncio.get_running_loop())
+        for i in range(3):
+            subscription.push({"_id": i})
+        assert await subscription.wait(1) == ([], True)
+
+    asyncio.run(scenario())
+
+
+def test_asgi_event_stream_runs_on_the_event_loop(client, app_module, make_user):
+    import asgi
+    from async_models import AsyncBankingModel
+
+    user = make_user(deposit=1000)
+    ticket = client.post("/api/events/ticket", headers=user["headers"]).json["ticket"]
+    # A ticket needs no user lookup and the balance frames come from the balance
+    # cache, so the stream runs without a Motor client
+    asgi.native.state.bank_model = AsyncBankingModel(None, app_module.bank_model)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/events", "raw_path": b"/api/events", "root_path": "",
+        "query_string": f"ticket={ticket}".encode(), "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80), "headers": [],
+    }
+    threads_before = threading.active_count()
+
+    async def scenario():
+        gone = asyncio.Event()
+        chunks = asyncio.Queue()
+
+        async def receive():
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                assert message["status"] == 200
+            elif message.get("body"):
+                await chunks.put(message["body"].decode())
+
+        async def next_frame(event):
+            while True:
+                chunk = await asyncio.wait_for(chunks.get(), 5)
+                if chunk.startswith(f"event: {event}"):
+                    return chunk
+
+        stream = asyncio.create_task(asgi.app(scope, receive, send))
+        assert '"balances"' in await next_frame("balance")
+        assert app_module.event_hub.connected() == 1
+        # A second account's opening deposit is pushed from the request's thread
+        response = await asyncio.to_thread(client.post, "/api/user/accounts", headers=user["headers"],
+                                           json={"account_type": "current", "initial_deposit": 250})
+        assert response.status_code == 201, response.json
+        assert '"amount":250' in await next_frame("transaction")
+        gone.set()
+        await asyncio.wait_for(stream, 5)
+
+    asyncio.run(scenario())
+    assert app_module.event_hub.connected() == 0
+    assert threading.active_count() <= threads_before
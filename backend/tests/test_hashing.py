@@ -0,0 +1,44 @@
+# tests/test_hashing.py
+import pytest
+from werkzeug.security import generate_password_hash
+
+from hashing import HasherBusy, PasswordHasher
+
+
+@pytest.mark.parametrize("algorithm, rounds", [("bcrypt", 4), ("pbkdf2", 1000), ("scrypt", 0)])
+def test_hash_and_verify(algorithm, rounds):
+    hasher = PasswordHasher(algorithm, rounds=rounds, workers=0)
+    hashed = hasher.hash("s3cret")
+    assert hasher.verify("s3cret", hashed) and not hasher.verify("wrong", hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert not hasher.verify("s3cret", None)
+
+
+def test_needs_rehash_for_other_algorithms_and_costs():
+    hasher = PasswordHasher("bcrypt", rounds=5, workers=0)
+    legacy = generate_password_hash("s3cret")  # werkzeug's default, as stored before bcrypt
+    assert hasher.verify("s3cret", legacy) and hasher.needs_rehash(legacy)
+    assert hasher.needs_rehash(PasswordHasher("bcrypt", rounds=4, workers=0).hash("s3cret"))
+    with pytest.raises(ValueError):
+        PasswordHasher("md5")
+
+
+def test_calls_past_the_cap_are_refused():
+    hasher = PasswordHasher("pbkdf2", rounds=1000, workers=0, max_pending=1)
+    hasher._slots.acquire()  # one call already in flight
+    with pytest.raises(HasherBusy):
+        hasher.hash("s3cret")
+    hasher._slots.release()
+    assert hasher.hash("s3cret")
+
+
+def test_login_upgrades_a_legacy_hash(client, app_db, make_user):
+    user = make_user()
+    legacy = generate_password_hash("correct horse", method="pbkdf2:sha256:1000")
+    app_db.users.update_one({"email": user["email"]}, {"$set": {"password": legacy}})
+
+    response = client.post("/api/auth/login", json={"email": user["email"], "password": "correct horse"})
+    assert response.status_code == 200
+    upgraded = app_db.users.find_one({"email": user["email"]})["password"]
+    assert upgraded.startswith("$2b$04$")
+    assert client.post("/api/auth/login", json={"email": user["email"], "password": "correct horse"}).status_code == 200
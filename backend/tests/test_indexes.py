@@ -0,0 +1,22 @@
+# tests/test_indexes.py
+from archive import STATE_ID
+from indexes import INDEXES, RETIRED_INDEXES, ensure_indexes
+
+
+def test_declared_indexes_are_created_and_retired_ones_dropped(db):
+    db.transactions.create_index([("user_id", 1), ("account_number", 1)], name="user_account_timestamp_id")
+    db.archive_state.insert_one({"_id": STATE_ID, "months": ["transactions_2020_01"]})
+
+    assert ensure_indexes(db) == []
+    assert ensure_indexes(db) == []  # safe to run on every startup
+    for collection, models in INDEXES.items():
+        assert {m.document["name"] for m in models} <= set(db[collection].index_information())
+    assert not set(RETIRED_INDEXES["transactions"]) & set(db.transactions.index_information())
+    assert "timestamp_id" in db.transactions_2020_01.index_information()
+
+
+def test_a_unique_index_over_duplicates_is_reported(db):
+    db.users.insert_many([{"email": "dup@example.com"}, {"email": "dup@example.com"}])
+    failures = ensure_indexes(db)
+    assert [collection for collection, _ in failures] == ["users"]
+    assert failures[0][1].startswith("email_unique: ")
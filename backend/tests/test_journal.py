@@ -0,0 +1,64 @@
+# tests/test_journal.py
+from datetime import datetime, timedelta, UTC
+
+from bson.objectid import ObjectId
+
+from journal import EXTERNAL_CLEARING, LEGACY_FILTER, Backfill
+
+ALICE, BOB = ObjectId(), ObjectId()
+WHEN = datetime(2023, 5, 1, 12, 0, tzinfo=UTC)
+
+
+def legacy_history(db):
+    """One document of each legacy shape; returns their _ids."""
+    alice = db.accounts.insert_one({"user_id": str(ALICE), "account_number": "1000000008"}).inserted_id
+    bob = db.accounts.insert_one({"user_id": BOB, "account_number": "1000000016"}).inserted_id
+    internal = db.beneficiaries.insert_one({"user_id": str(ALICE), "account_number": "1000000016"}).inserted_id
+    external = db.beneficiaries.insert_one({"user_id": str(ALICE), "account_number": "9999999999"}).inserted_id
+    return db.transactions.insert_many([
+        # Pre-engine OTP transfers, to a customer here and to another bank
+        {"user_id": str(ALICE), "beneficiary_id": str(internal), "amount": 10.0, "transfer_mode": "IMPS",
+         "created_at": WHEN},
+        {"user_id": str(ALICE), "beneficiary_id": str(external), "amount": 20.0, "transfer_mode": "NEFT",
+         "created_at": WHEN + timedelta(minutes=1)},
+        # An account pair
+        {"user_id": str(BOB), "user_account_id": str(bob), "beneficiary_account_id": str(alice),
+         "amount": 5.0, "transfer_mode": "IMPS", "type": "debit", "timestamp": WHEN + timedelta(minutes=2)},
+        # A journal leg with only a string user_id
+        {"user_id": str(BOB), "account_number": "1000000016", "type": "credit", "amount": 1.0,
+         "transfer_mode": "DEPOSIT", "created_at": WHEN + timedelta(minutes=3), "transfer_id": ObjectId()},
+    ]).inserted_ids
+
+
+def legs(db):
+    return sorted((row["account_number"], row["type"], row["amount"]) for row in db.transactions.find())
+
+
+def test_legacy_shapes_are_rewritten_with_their_counter_legs(db):
+    ids = legacy_history(db)
+    state = Backfill(db, batch_size=2).run()
+
+    assert (state["rewritten"], "finished_at" in state) == (4, True)
+    assert db.transactions.count_documents(LEGACY_FILTER) == 0
+    assert legs(db) == sorted([
+        ("1000000008", "debit", 10.0), ("1000000016", "credit", 10.0),
+        ("1000000008", "debit", 20.0), (EXTERNAL_CLEARING, "credit", 20.0),
+        ("1000000016", "debit", 5.0), ("1000000008", "credit", 5.0),
+        ("1000000016", "credit", 1.0),
+    ])
+    first = db.transactions.find_one({"_id": ids[0]})
+    assert (first["user_id"], first["timestamp"].replace(tzinfo=UTC), first["transfer_id"]) == (ALICE, WHEN, ids[0])
+    assert "created_at" not in first
+    assert db.transactions.find_one({"type": "credit", "amount": 10.0})["user_id"] == BOB
+
+
+def test_an_interrupted_backfill_resumes_without_duplicating_legs(db):
+    legacy_history(db)
+    backfill = Backfill(db, batch_size=1)
+    assert backfill.run(max_batches=1)["rewritten"] == 1
+    # The first batch is redone as if it had been cut short after its counter-leg
+    db.migrations.update_one({"_id": Backfill.MIGRATION_ID}, {"$set": {"last_id": None}})
+    db.transactions.update_one({"amount": 10.0, "type": "debit"}, {"$set": {"created_at": WHEN},
+                                                                    "$unset": {"type": ""}})
+    assert backfill.run()["rewritten"] == 5
+    assert len(legs(db)) == 7
@@ -0,0 +1,54 @@
+# tests/test_json_provider.py
+import json
+from datetime import datetime, UTC
+from decimal import Decimal
+
+import pytest
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from werkzeug.http import http_date
+
+import json_provider
+from json_provider import BsonEncoder
+
+OID = ObjectId()
+WHEN = datetime(2024, 2, 29, 13, 5, 9, 250000)
+DOC = {"_id": OID, "amount": Decimal128("1234.50"), "fee": Decimal("0.10"), "raw": b"\x00\xff",
+       "timestamp": WHEN, "aware": WHEN.replace(tzinfo=UTC), "tags": ["a"]}
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def encoder_backend(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(json_provider, "orjson", None)
+    return request.param
+
+
+def test_bson_values_are_encoded(encoder_backend):
+    assert json.loads(BsonEncoder("http").encode(DOC)) == {
+        "_id": str(OID), "amount": "1234.50", "fee": "0.10", "raw": "AP8=",
+        "timestamp": http_date(WHEN.replace(tzinfo=UTC)), "aware": http_date(WHEN.replace(tzinfo=UTC)),
+        "tags": ["a"],
+    }
+    iso = json.loads(BsonEncoder("iso").encode(DOC))
+    assert iso["timestamp"] == iso["aware"] == "2024-02-29T13:05:09.250000+00:00"
+
+
+def test_key_order_is_kept_unless_sorting_is_asked_for(encoder_backend):
+    doc = {"b": 1, "a": {"d": 2, "c": 3}}
+    assert BsonEncoder().encode(doc) == b'{"b":1,"a":{"d":2,"c":3}}'
+    assert BsonEncoder(sort_keys=True).encode(doc) == b'{"a":{"c":3,"d":2},"b":1}'
+
+
+def test_unknown_types_and_formats_are_refused(encoder_backend):
+    with pytest.raises(TypeError):
+        BsonEncoder().encode({"value": object()})
+    with pytest.raises(ValueError):
+        BsonEncoder("epoch")
+
+
+def test_responses_use_the_provider(app_module):
+    with app_module.app.test_request_context():
+        response = app_module.jsonify({"_id": OID, "amount": Decimal128("5")})
+    assert response.mimetype == "application/json"
+    assert response.get_data() == f'{{"_id":"{OID}","amount":"5"}}'.encode()
@@ -0,0 +1,87 @@
+# tests/test_ledger.py
+import time
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+
+
+def test_every_transfer_is_a_balanced_posting(app_module, app_db, payer):
+    ledger = app_module.bank_model.ledger
+    source = app_db.accounts.find_one({"account_number": payer["account"]["account_number"]})
+    internal = app_db.beneficiaries.find_one({"_id": ObjectId(payer["beneficiary_id"])})
+    external = {"_id": ObjectId(), "account_number": "9999999999"}
+    for beneficiary, amount in ((internal, 250.0), (external, 100.0)):
+        result, status = app_module.bank_model.transfers.transfer(
+            {"account_number": source["account_number"]}, beneficiary, amount, "IMPS", source["user_id"])
+        assert status == 200, result
+
+    for transfer_id in app_db.transactions.distinct("transfer_id"):
+        legs = list(app_db.transactions.find({"transfer_id": transfer_id}))
+        assert sum(leg["amount"] for leg in legs if leg["type"] == "debit") == \
+            sum(leg["amount"] for leg in legs if leg["type"] == "credit")
+    assert ledger.audit() == {"mismatched_accounts": [], "unbalanced_postings": []}
+    assert ledger.balance_as_of(source["account_number"], after_last_posting())["balance"] == 650
+
+
+def monthly_credit(client, user):
+    response = client.get("/api/analytics/monthly", headers=user["headers"])
+    assert response.status_code == 200, response.json
+    return response.json["monthly"][datetime.now(UTC).month - 1]["credit"]
+
+
+def test_opening_deposit_reaches_incremental_rollups(client, app_module, make_user):
+    user = make_user(deposit=1000)
+    assert monthly_credit(client, user) == 1000
+    app_module.bank_model.rollups.rebuild()
+    assert monthly_credit(client, user) == 1000
+
+
+def test_opening_deposit_is_not_applied_twice_to_the_balance(client, make_user):
+    user = make_user(deposit=1000)
+    response = client.get("/api/user/balance", headers=user["headers"])
+    assert response.json["balances"] == {user["account"]["account_number"]: 1000}
+
+
+def test_audit_adjustment_is_balanced_and_rolled_up(client, app_module, app_db, make_user):
+    user = make_user(deposit=1000)
+    number = user["account"]["account_number"]
+    # A balance the journal does not explain, e.g. an account from before deposits were journaled
+    app_db.accounts.update_one({"account_number": number}, {"$inc": {"balance": 50}})
+    ledger = app_module.bank_model.ledger
+
+    report = ledger.audit(post_adjustments=True)
+    assert report["mismatched_accounts"] == [{"account_number": number, "balance": 1050, "journal": 1000}]
+    assert ledger.audit() == {"mismatched_accounts": [], "unbalanced_postings": []}
+    assert monthly_credit(client, user) == 1050
+    app_module.bank_model.rollups.rebuild()
+    assert monthly_credit(client, user) == 1050
+
+
+def after_last_posting():
+    """An instant past the newest posting (BSON dates keep milliseconds, so step over the current one)."""
+    time.sleep(0.002)
+    return datetime.now(UTC)
+
+
+def test_snapshots_roll_forward_and_audit_starts_from_them(client, app_module, app_db, make_user):
+    user = make_user(deposit=1000)
+    number = user["account"]["account_number"]
+    ledger = app_module.bank_model.ledger
+    assert ledger.take_snapshots(as_of=after_last_posting()) == 2  # the account and CASH_DEPOSITS
+    assert app_db.ledger_snapshots.find_one({"account_number": number})["balance"] == 1000
+
+    app_module.bank_model.create_user_account(app_db.users.find_one()["_id"], "savings", 250)
+    later = after_last_posting()
+    ledger.take_snapshots(as_of=later)
+    assert ledger.balance_as_of(number, later)["balance"] == 1000
+    assert app_db.ledger_snapshots.find_one({"account_number": "CASH_DEPOSITS", "as_of": later})["balance"] == -1250
+    assert ledger.audit() == {"mismatched_accounts": [], "unbalanced_postings": []}
+    assert ledger.audit(full=True) == {"mismatched_accounts": [], "unbalanced_postings": []}
+
+
+def test_snapshot_and_audit_queries_are_indexed():
+    from indexes import AUDIT_QUERIES, INDEXES
+
+    shapes = {query["name"] for query in AUDIT_QUERIES}
+    assert {"journal_window", "journal_postings_since", "journal_unsnapshotted_accounts"} <= shapes
+    assert "timestamp_id" in {model.document["name"] for model in INDEXES["transactions"]}
@@ -0,0 +1,73 @@
+# tests/test_mailer.py
+import time
+
+import pytest
+
+import mailer
+from mailer import MailDispatcher, MailQueueFull
+
+
+class FakeSMTP:
+    """Records sent messages; the first `failures` sends raise."""
+    sent = []
+    failures = 0
+
+    def __init__(self, server, port, timeout=None):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def send_message(self, message):
+        if FakeSMTP.failures:
+            FakeSMTP.failures -= 1
+            raise OSError("connection reset")
+        FakeSMTP.sent.append(message["To"])
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(mailer.smtplib, "SMTP", FakeSMTP)
+    FakeSMTP.sent, FakeSMTP.failures = [], 0
+    return FakeSMTP
+
+
+def test_queued_mail_is_sent_over_one_connection(smtp):
+    statuses = {}
+    dispatcher = MailDispatcher("smtp.example.com", 25, username="bank@example.com", password="x", workers=1,
+                                on_status=lambda job_id, status: statuses.__setitem__(job_id, status))
+    jobs = [dispatcher.submit(f"user{i}@example.com", "OTP", "123456") for i in range(5)]
+    assert dispatcher.wait_idle(timeout=5)
+    assert sorted(smtp.sent) == [f"user{i}@example.com" for i in range(5)]
+    assert dispatcher.stats["connections"] == 1
+    assert [statuses[job]["status"] for job in jobs] == ["sent"] * 5
+
+
+def test_failed_sends_are_retried_then_given_up(smtp):
+    dispatcher = MailDispatcher("smtp.example.com", 25, workers=1, max_retries=1, backoff_seconds=0.01)
+    smtp.failures = 1
+    retried = dispatcher.submit("a@example.com", "OTP", "1")
+    assert _settled(dispatcher, retried) == {"status": "sent", "attempts": 1}
+
+    smtp.failures = 2
+    failed = dispatcher.submit("b@example.com", "OTP", "2")
+    assert _settled(dispatcher, failed) == {"status": "failed", "attempts": 2, "error": "connection reset"}
+    assert (dispatcher.stats["retried"], dispatcher.stats["failed"]) == (2, 1)
+
+
+def test_a_full_queue_is_refused(smtp):
+    dispatcher = MailDispatcher("smtp.example.com", 25, workers=0, queue_size=1)
+    dispatcher.submit("a@example.com", "OTP", "1")
+    with pytest.raises(MailQueueFull):
+        dispatcher.submit("b@example.com", "OTP", "2")
+
+
+def _settled(dispatcher, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while dispatcher.status(job_id)["status"] not in ("sent", "failed"):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return dispatcher.status(job_id)
@@ -0,0 +1,27 @@
+# tests/test_metrics.py
+from metrics import Histogram
+
+
+def test_requests_are_recorded_per_route(client, app_module, make_user, monkeypatch):
+    user = make_user()
+    monkeypatch.setattr(app_module.request_metrics, "server_timing", True)
+    response = client.get("/api/user/profile", headers=user["headers"])
+    assert response.headers["Server-Timing"].startswith("app;dur=")
+
+    body = client.get("/metrics").get_data(as_text=True)
+    labels = 'method="GET",route="/api/user/profile",status="200"'
+    count = next(line for line in body.splitlines()
+                 if line.startswith(f"http_request_duration_seconds_count{{{labels}}}"))
+    assert int(count.split()[-1]) >= 1
+    assert "# TYPE mail_queue_pending gauge" in body
+    assert "mongo_pool_max_size " in body
+
+
+def test_histograms_are_cumulative():
+    histogram = Histogram((0.005, 0.25, 10.0))
+    for seconds in (0.003, 0.2, 60):
+        histogram.observe(seconds)
+    samples = list(histogram.samples("latency", {"route": "/x"}))
+    assert [(labels["le"], count) for name, labels, count in samples if name == "latency_bucket"] == \
+        [("0.005", 1), ("0.25", 2), ("10.0", 2), ("+Inf", 3)]
+    assert samples[-1] == ("latency_count", {"route": "/x"}, 3)
@@ -0,0 +1,60 @@
+# tests/test_otp_store.py
+import pytest
+
+from otp_store import MAX_ATTEMPTS, OTP_MISMATCH, MemoryOTPStore, MongoOTPStore
+
+
+@pytest.fixture(params=["mongo", "memory"])
+def store(request, db):
+    return MongoOTPStore(db) if request.param == "mongo" else MemoryOTPStore()
+
+
+def test_verify_consumes_the_otp(store):
+    store.create("111111", "a@example.com", "transfer", {"pending_transfer_id": "p1"})
+    ok, record = store.verify("a@example.com", "transfer", "111111")
+    assert ok and record["metadata"] == {"pending_transfer_id": "p1"}
+    assert store.verify("a@example.com", "transfer", "111111") == (False, "OTP not found or expired")
+
+
+def test_a_newer_otp_supersedes_earlier_codes(store):
+    store.create("111111", "a@example.com", "transfer", {"pending_transfer_id": "p1"})
+    store.create("222222", "a@example.com", "transfer", {"pending_transfer_id": "p2"})
+    assert store.verify("a@example.com", "transfer", "111111") == (False, "Invalid OTP")
+    ok, record = store.verify("a@example.com", "transfer", "222222")
+    assert ok and record["metadata"]["pending_transfer_id"] == "p2"
+
+
+def test_wrong_guesses_exhaust_the_newest_otp(store):
+    for code in ("111111", "222222", "333333"):
+        store.create(code, "a@example.com", "transfer")
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert store.verify("a@example.com", "transfer", "000000") == (False, "Invalid OTP")
+    assert store.verify("a@example.com", "transfer", "000000") == (False, "Too many attempts")
+    # Older codes do not become guessable once the newest is exhausted
+    assert store.verify("a@example.com", "transfer", "333333")[0] is False
+    assert store.verify("a@example.com", "transfer", "111111")[0] is False
+
+
+def test_an_otp_is_only_consumed_for_its_own_request(store):
+    store.create("111111", "a@example.com", "transfer", {"pending_transfer_id": "p1"})
+    assert store.verify("a@example.com", "transfer", "111111", {"pending_transfer_id": "p2"}) == (False, OTP_MISMATCH)
+    ok, record = store.verify("a@example.com", "transfer", "111111", {"pending_transfer_id": "p1"})
+    assert ok and record["metadata"] == {"pending_transfer_id": "p1"}
+
+
+def test_create_keeps_only_the_newest_otp(db):
+    store = MongoOTPStore(db)
+    for code in ("111111", "222222", "333333"):
+        store.create(code, "a@example.com", "transfer")
+    store.create("444444", "a@example.com", "statement")
+    assert [r["code"] for r in db.otps.find({"email": "a@example.com", "purpose": "transfer"})] == ["333333"]
+    assert store.verify("a@example.com", "transfer", "000000") == (False, "Invalid OTP")
+    assert db.otps.find_one({"purpose": "transfer"})["attempts"] == 1
+    assert db.otps.find_one({"purpose": "statement"})["attempts"] == 0
+
+
+def test_purposes_are_independent(store):
+    store.create("111111", "a@example.com", "transfer")
+    store.create("222222", "a@example.com", "statement")
+    assert store.verify("a@example.com", "transfer", "111111")[0]
+    assert store.verify("a@example.com", "statement", "222222")[0]
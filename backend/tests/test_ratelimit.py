@@ -0,0 +1,38 @@
+# tests/test_ratelimit.py
+import pytest
+
+from ratelimit import MemoryBackend, MongoBackend, RateLimiter, parse_limit
+
+
+def test_parse_limit():
+    assert parse_limit("10/minute") == (10, 60)
+    assert parse_limit("3/hours") == (3, 3600)
+    assert parse_limit("5/30") == (5, 30)
+    for spec in ("ten/minute", "5/fortnight", "5"):
+        with pytest.raises(ValueError):
+            parse_limit(spec)
+
+
+def test_memory_buckets_are_per_key():
+    limiter = RateLimiter(MemoryBackend())
+    assert [limiter.check("login", "ip-1", "3/minute")[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = limiter.check("login", "ip-1", "3/minute")
+    assert (allowed, 1 <= retry_after <= 20) == (False, True)
+    assert limiter.check("login", "ip-2", "3/minute") == (True, 0)
+    assert limiter.snapshot()["limited"] == {"login": 2}
+
+
+def test_mongo_windows_are_shared_by_every_worker(db):
+    workers = [RateLimiter(MongoBackend(db)) for _ in range(2)]
+    results = [workers[i % 2].check("otp", "user-1", "4/hour")[0] for i in range(6)]
+    assert results == [True] * 4 + [False] * 2
+
+
+def test_a_failing_backend_lets_requests_through():
+    class Broken:
+        def hit(self, key, limit, period):
+            raise ConnectionError("mongo is down")
+
+    limiter = RateLimiter(Broken())
+    assert limiter.check("login", "ip-1", "1/minute") == (True, 0)
+    assert limiter.snapshot()["errors"] == 1
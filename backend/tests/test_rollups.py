@@ -0,0 +1,74 @@
+# tests/test_rollups.py
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+
+from rollups import MonthlyRollups, rollup_id
+
+USER_ID = ObjectId()
+
+
+def transfer(db, rollups, account_number, amount, kind="credit"):
+    """Journal one row and run the live listener on it, as TransferEngine does."""
+    row = {"_id": ObjectId(), "user_id": USER_ID, "account_number": account_number, "type": kind,
+           "amount": amount, "timestamp": datetime.now(UTC)}
+    db.transactions.insert_one(row)
+    rollups.record([row])
+
+
+def credit(db, account_number):
+    now = datetime.now(UTC)
+    doc = db.monthly_rollups.find_one({"_id": rollup_id(account_number, now.year, now.month)})
+    return doc and (doc["credit_total"], doc["credit_count"])
+
+
+def test_transfers_during_a_rebuild_are_counted_once(db):
+    class RacedRollups(MonthlyRollups):
+        def _publish(self, staging, account_number, batch_size):
+            # Lands after the history was aggregated; its $inc goes to the rollups about to be replaced
+            transfer(db, self, "A", 5.0)
+            return super()._publish(staging, account_number, batch_size)
+
+    rollups = MonthlyRollups(db)
+    transfer(db, rollups, "A", 100.0)
+    RacedRollups(db).rebuild()
+    assert credit(db, "A") == (105.0, 2)
+    assert [name for name in db.list_collection_names() if name.startswith("monthly_rollups_rebuild")] == []
+
+
+def test_rebuild_of_one_account_leaves_the_others_alone(db):
+    rollups = MonthlyRollups(db)
+    transfer(db, rollups, "A", 100.0)
+    transfer(db, rollups, "B", 7.0)
+    db.monthly_rollups.update_one({"_id": rollup_id("A", 2001, 1)},
+                                  {"$set": {"account_number": "A", "year": 2001, "month": 1}}, upsert=True)
+    now = datetime.now(UTC)
+    db.monthly_rollups.update_one({"_id": rollup_id("A", now.year, now.month)}, {"$inc": {"credit_total": 999}})
+    db.monthly_rollups.update_one({"_id": rollup_id("B", now.year, now.month)}, {"$inc": {"credit_total": 1}})
+
+    rollups.rebuild(account_number="A")
+    assert credit(db, "A") == (100.0, 1)
+    assert db.monthly_rollups.find_one({"_id": rollup_id("A", 2001, 1)}) is None
+    assert credit(db, "B") == (8.0, 1)
+
+
+def test_monthly_analytics_are_served_from_the_rollups(client, payer, issued_otp):
+    account_number = payer["account"]["account_number"]
+    response = client.post("/api/transfer/initiate", json={
+        "beneficiary_id": payer["beneficiary_id"], "amount": 300, "transfer_mode": "IMPS",
+        "from_acc_number": account_number,
+    }, headers=payer["headers"])
+    client.post("/api/transfer/verify", json={
+        "pending_transfer_id": response.json["pending_transfer_id"], "otp": issued_otp(payer["email"], "transfer"),
+    }, headers=payer["headers"])
+
+    now = datetime.now(UTC)
+    analytics = client.get("/api/analytics/monthly", query_string={"year": now.year, "account_number": account_number},
+                           headers=payer["headers"])
+    assert analytics.status_code == 200
+    month = analytics.json["monthly"][now.month - 1]
+    assert (month["debit"], month["debit_count"]) == (300, 1)
+    assert month["top_beneficiaries"] == [{"beneficiary_id": payer["beneficiary_id"], "total": 300}]
+    missing = client.get("/api/analytics/monthly", query_string={"account_number": "0000000000"},
+                         headers=payer["headers"])
+    assert missing.status_code == 404
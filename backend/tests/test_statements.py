@@ -0,0 +1,45 @@
+# tests/test_statements.py
+import csv
+import io
+import time
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+
+
+def test_statement_is_generated_after_its_otp(client, payer, issued_otp):
+    today = datetime.now(UTC).strftime("%Y-%m-%d")
+    response = client.post("/api/statement/initiate", json={
+        "account_number": payer["account"]["account_number"], "start_date": today, "end_date": today,
+    }, headers=payer["headers"])
+    assert response.status_code == 200, response.json
+    statement_id = response.json["pending_statement_id"]
+    assert client.get(f"/api/statement/{statement_id}/download", headers=payer["headers"]).status_code == 409
+
+    verified = client.post("/api/statement/verify", json={
+        "pending_statement_id": statement_id, "otp": issued_otp(payer["email"], "statement"),
+    }, headers=payer["headers"])
+    assert verified.status_code == 202, verified.json
+    deadline = time.monotonic() + 5
+    while True:
+        status = client.get(f"/api/statement/{statement_id}", headers=payer["headers"]).json
+        if status["status"] == "ready":
+            break
+        assert status["status"] in ("queued", "running") and time.monotonic() < deadline, status
+        time.sleep(0.01)
+    assert (status["written"], status["opening_balance"], status["closing_balance"]) == (1, 0, 1000)
+
+    download = client.get(status["download_url"], headers=payer["headers"])
+    rows = list(csv.DictReader(io.StringIO(download.get_data(as_text=True))))
+    assert [(row["type"], float(row["amount"])) for row in rows] == [("credit", 1000.0)]
+
+
+def test_statement_otp_guesses_are_rate_limited(client, app_module, make_user, monkeypatch):
+    user = make_user()
+    monkeypatch.setitem(app_module.app.config, "RATE_LIMIT_ENABLED", True)
+    guess = {"pending_statement_id": str(ObjectId()), "otp": "000000"}
+
+    statuses = [client.post("/api/statement/verify", json=guess, headers=user["headers"]).status_code
+                for _ in range(11)]
+    assert statuses[:10] == [400] * 10
+    assert statuses[10] == 429
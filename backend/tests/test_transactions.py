@@ -0,0 +1,72 @@
+# tests/test_transactions.py
+import json
+import os
+from datetime import datetime, timedelta, UTC
+
+import pytest
+from bson.objectid import ObjectId
+
+
+@pytest.fixture
+def history(app_db, make_user):
+    """A user whose account has 25 journal rows, alternating debit/credit, several sharing a timestamp."""
+    user = make_user(deposit=0)
+    account = app_db.accounts.find_one({"account_number": user["account"]["account_number"]})
+    base = datetime.now(UTC) - timedelta(days=1)
+    stamped = [base + timedelta(minutes=i // 3) for i in range(25)]
+    app_db.transactions.insert_many([{
+        # _ids from the time each row was written, as the journal's are
+        "_id": ObjectId(ObjectId.from_datetime(stamped[i]).binary[:4] + os.urandom(8)),
+        "transfer_id": ObjectId(), "user_id": account["user_id"],
+        "account_number": account["account_number"], "type": "debit" if i % 2 else "credit",
+        "amount": float(i + 1), "transfer_mode": "IMPS", "beneficiary_id": None,
+        "timestamp": stamped[i],
+    } for i in range(25)])
+    user["row_ids"] = [str(row["_id"]) for row in app_db.transactions.find(
+        {"user_id": account["user_id"]}).sort([("timestamp", -1), ("_id", -1)])]
+    return user
+
+
+def pages(client, user, path, **params):
+    """Every page of a keyset-paginated listing; returns the row ids in order."""
+    ids, cursor = [], None
+    while True:
+        query = {**params, **({"cursor": cursor} if cursor else {})}
+        response = client.get(path, query_string=query, headers=user["headers"])
+        assert response.status_code == 200, response.json
+        ids.extend(row["_id"] for row in response.json["transactions"])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def test_keyset_pages_cover_the_history_once_in_order(client, history):
+    assert pages(client, history, "/api/transactions", limit=4) == history["row_ids"]
+
+
+def test_filter_pages_by_type(client, app_db, history):
+    ids = pages(client, history, "/api/transactions/filter", type="debit", limit=5)
+    assert ids == [i for i in history["row_ids"]
+                   if app_db.transactions.find_one({"_id": ObjectId(i)})["type"] == "debit"]
+
+
+def test_malformed_cursor_is_rejected(client, history):
+    response = client.get("/api/transactions", query_string={"cursor": "not-a-cursor"},
+                          headers=history["headers"])
+    assert response.status_code == 400
+
+
+def test_streamed_listing_matches_the_pages(client, history):
+    buffered = pages(client, history, "/api/transactions", limit=200)
+    chunked = client.get("/api/transactions?stream=1", headers=history["headers"]).get_data(as_text=True)
+    assert [row["_id"] for row in json.loads(chunked)["transactions"]] == buffered
+    ndjson = client.get("/api/transactions", headers={**history["headers"], "Accept": "application/x-ndjson"})
+    assert [json.loads(line)["_id"] for line in ndjson.get_data(as_text=True).splitlines()] == buffered
+
+
+def test_pages_span_the_archive(client, app_module, history, monkeypatch):
+    archive = app_module.bank_model.archive
+    monkeypatch.setattr(archive, "state_ttl", 0)  # a single process: nothing to wait for
+    moved = archive.archive(cutoff=datetime.now(UTC) - timedelta(hours=23, minutes=56))
+    assert 0 < moved < 25
+    assert pages(client, history, "/api/transactions", limit=4) == history["row_ids"]
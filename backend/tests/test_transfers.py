@@ -0,0 +1,95 @@
+# tests/test_transfers.py
+import pytest
+from bson.objectid import ObjectId
+
+
+def initiate(client, user, amount):
+    response = client.post("/api/transfer/initiate", json={
+        "beneficiary_id": user["beneficiary_id"], "amount": amount, "transfer_mode": "IMPS",
+        "from_acc_number": user["account"]["account_number"],
+    }, headers=user["headers"])
+    assert response.status_code == 200, response.json
+    return response.json["pending_transfer_id"]
+
+
+def verify(client, user, pending_id, code):
+    return client.post("/api/transfer/verify", json={"pending_transfer_id": pending_id, "otp": code},
+                       headers=user["headers"])
+
+
+def balance(client, user):
+    return client.get("/api/user/balance", headers=user["headers"]).json["balances"][
+        user["account"]["account_number"]]
+
+
+def test_transfer_moves_money(client, payer, issued_otp):
+    pending_id = initiate(client, payer, 250)
+    response = verify(client, payer, pending_id, issued_otp(payer["email"], "transfer"))
+    assert response.status_code == 200, response.json
+    assert balance(client, payer) == 750
+    assert balance(client, payer["payee"]) == 250
+
+
+def test_otp_of_an_earlier_transfer_does_not_authorise_a_later_one(client, payer, issued_otp):
+    initiate(client, payer, 10)
+    first_code = issued_otp(payer["email"], "transfer")
+    second = initiate(client, payer, 900)
+    if issued_otp(payer["email"], "transfer") == first_code:
+        pytest.skip("both transfers drew the same code")
+    assert verify(client, payer, second, first_code).status_code == 400
+    assert balance(client, payer) == 1000
+
+
+def test_otp_is_bound_to_its_pending_transfer(client, app_db, payer, issued_otp):
+    pending_id = initiate(client, payer, 10)
+    code = issued_otp(payer["email"], "transfer")
+    # A pending transfer of the same user for which no OTP was issued
+    other = app_db.pending_transfers.insert_one({
+        **app_db.pending_transfers.find_one({}, {"_id": 0}), "amount": 900.0,
+    }).inserted_id
+    response = verify(client, payer, str(other), code)
+    assert response.status_code == 400
+    assert response.json == {"error": "OTP does not match this transfer"}
+    assert balance(client, payer) == 1000
+    # Not consumed by the mismatch: it still authorises the transfer it was issued for
+    assert verify(client, payer, pending_id, code).status_code == 200
+    assert balance(client, payer) == 990
+
+
+def test_second_transfer_beyond_the_balance_is_refused(client, payer, issued_otp):
+    pending_id = initiate(client, payer, 600)
+    assert verify(client, payer, pending_id, issued_otp(payer["email"], "transfer")).status_code == 200
+    response = client.post("/api/transfer/initiate", json={
+        "beneficiary_id": payer["beneficiary_id"], "amount": 500, "transfer_mode": "IMPS",
+        "from_acc_number": payer["account"]["account_number"],
+    }, headers=payer["headers"])
+    assert (response.status_code, response.json) == (400, {"error": "Insufficient balance"})
+    assert balance(client, payer) == 400
+
+
+def test_failed_journal_write_is_compensated(app_module, app_db, payer, monkeypatch):
+    import transfers
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("journal unavailable")
+
+    monkeypatch.setattr(transfers, "write_journal", fail)
+    source = payer["account"]["account_number"]
+    beneficiary = app_db.beneficiaries.find_one({"_id": ObjectId(payer["beneficiary_id"])})
+    with pytest.raises(RuntimeError):
+        app_module.bank_model.transfers.transfer({"account_number": source}, beneficiary, 250.0, "IMPS",
+                                                 app_db.accounts.find_one({"account_number": source})["user_id"])
+    balances = {a["account_number"]: a["balance"] for a in app_db.accounts.find()}
+    assert balances[source] == 1000
+    assert balances[payer["payee"]["account"]["account_number"]] == 0
+    assert app_db.transactions.count_documents({"transfer_mode": "IMPS"}) == 0
+
+
+def test_engine_rejects_an_overdraft(app_module, app_db, payer):
+    source = payer["account"]["account_number"]
+    beneficiary = app_db.beneficiaries.find_one({"_id": ObjectId(payer["beneficiary_id"])})
+    result, status = app_module.bank_model.transfers.transfer(
+        {"account_number": source}, beneficiary, 1000.01, "IMPS",
+        app_db.accounts.find_one({"account_number": source})["user_id"])
+    assert (result, status) == ({"error": "Insufficient balance"}, 400)
+    assert app_db.accounts.find_one({"account_number": source})["balance"] == 1000
@@ -0,0 +1,253 @@
+# transfers.py
+"""
+Transfer engine shared by BankingModel.transfer_money and the OTP transfer flow.
+
+A transfer is three round trips:
+  1. conditional debit   - find_one_and_update guarded by balance >= amount,
+                           so the balance check and the debit cannot race
+  2. credit              - find_one_and_update on the receiver (internal only)
+  3. journal             - one insert_many for the debit and credit rows
+
+With use_transactions=True (replica set / sharded cluster) the three steps
+run in one multi-document transaction. On a standalone mongod they run
+unwrapped and a failure after the debit is compensated by refunding it.
+
+transfer_many() pays a list of beneficiaries out of one account in chunks: per
+chunk one conditional debit of the chunk total, one $in read of the internal
+receivers, one bulk_write of credits and one insert_many of journal rows,
+however many payees the chunk holds.
+
+Journal rows are built and written by journal.py. Each posting is balanced
+(see ledger.py): a transfer to an account held elsewhere is credited to the
+bank's EXTERNAL_CLEARING ledger account.
+
+Listeners registered with add_listener() see the customer journal entries
+of every completed transfer (not the bank-side clearing rows). Inside a transaction they run in it (and a failure
+aborts the transfer); otherwise they run after the writes and failures are
+only logged, so derived data must be repairable by a rebuild.
+"""
+import logging
+import time
+from datetime import datetime, UTC
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from journal import posting, write_journal
+
+logger = logging.getLogger(__name__)
+
+
+class TransferAborted(Exception):
+    """Raised inside a transfer to abort it with an API error and status."""
+
+    def __init__(self, error, status):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+
+class TransferEngine:
+    def __init__(self, db, use_transactions=False):
+        self.db = db
+        self.use_transactions = use_transactions
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """Register listener(entries, session), called with each transfer's journal rows."""
+        self.listeners.append(listener)
+
+    def transfer(self, source_filter, beneficiary, amount, transfer_mode, user_id):
+        """
+        Move `amount` out of the account matching `source_filter` to the
+        account behind `beneficiary` (if it is held at this bank).
+        Returns ({"message", "transfer_id", "latency_ms"}, 200) or ({"error"}, status).
+        """
+        started = time.perf_counter()
+        try:
+            if self.use_transactions:
+                def in_transaction(session):
+                    transfer_id, entries = self._execute(source_filter, beneficiary, amount,
+                                                         transfer_mode, user_id, session)
+                    for listener in self.listeners:
+                        listener(entries, session)
+                    return transfer_id
+
+                with self.db.client.start_session() as session:
+                    transfer_id = session.with_transaction(in_transaction)
+            else:
+                transfer_id, entries = self._execute(source_filter, beneficiary, amount,
+                                                     transfer_mode, user_id, None)
+                for listener in self.listeners:
+                    try:
+                        listener(entries, None)
+                    except Exception:
+                        logger.exception("Transfer listener %r failed", listener)
+        except TransferAborted as e:
+            return {"error": e.error}, e.status
+        latency_ms = round((time.perf_counter() - started) * 1000, 3)
+        return {
+            "message": "Transfer successful",
+            "transfer_id": str(transfer_id),
+            "latency_ms": latency_ms,
+        }, 200
+
+    def transfer_many(self, source_filter, items, transfer_mode, user_id, chunk_size=500, batch_id=None):
+        """
+        Pay `items` ([{"beneficiary": {...}, "amount": float}, ...]) in order out
+        of the account matching `source_filter`, as if each were a separate
+        transfer: an item fails with "Insufficient balance" when the balance
+        left by the items before it does not cover it.
+        Returns one {"status": "completed", "transfer_id"} or
+        {"status": "failed", "error"} per item, in input order.
+        """
+        results = []
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            try:
+                if self.use_transactions:
+                    def in_transaction(session, chunk=chunk):
+                        chunk_results, entries = self._execute_chunk(source_filter, chunk, transfer_mode,
+                                                                     user_id, batch_id, session)
+                        for listener in self.listeners:
+                            listener(entries, session)
+                        return chunk_results
+
+                    with self.db.client.start_session() as session:
+                        chunk_results = session.with_transaction(in_transaction)
+                else:
+                    chunk_results, entries = self._execute_chunk(source_filter, chunk, transfer_mode,
+                                                                 user_id, batch_id, None)
+                    for listener in self.listeners:
+                        try:
+                            listener(entries, None)
+                        except Exception:
+                            logger.exception("Transfer listener %r failed", listener)
+            except TransferAborted as e:
+                chunk_results = [{"status": "failed", "error": e.error} for _ in chunk]
+            except Exception as e:
+                logger.exception("Transfer batch %s chunk at %d failed", batch_id, start)
+                chunk_results = [{"status": "failed", "error": str(e)} for _ in chunk]
+            results.extend(chunk_results)
+        return results
+
+    def _execute_chunk(self, source_filter, chunk, transfer_mode, user_id, batch_id, session):
+        source, accepted = self._debit_chunk(source_filter, chunk, session)
+        if not accepted:
+            return [{"status": "failed", "error": "Insufficient balance"} for _ in chunk], []
+
+        credits = {}
+        applied = []
+        try:
+            numbers = list({chunk[i]["beneficiary"]["account_number"] for i in accepted})
+            receivers = {acc["account_number"]: acc for acc in self.db.accounts.find(
+                {"account_number": {"$in": numbers}},
+                {"_id": 1, "user_id": 1, "account_number": 1},
+                session=session,
+            )}
+            for i in accepted:
+                number = chunk[i]["beneficiary"]["account_number"]
+                if number in receivers:
+                    credits[number] = credits.get(number, 0) + chunk[i]["amount"]
+            ops = [UpdateOne({"account_number": number}, {"$inc": {"balance": amount}})
+                   for number, amount in credits.items()]
+            if ops:
+                try:
+                    self.db.accounts.bulk_write(ops, ordered=True, session=session)
+                except BulkWriteError as e:
+                    # ordered: everything before the first error was applied
+                    applied = list(credits.items())[:e.details["writeErrors"][0]["index"]]
+                    raise
+            applied = list(credits.items())
+
+            now = datetime.now(UTC)
+            extra = {} if batch_id is None else {"batch_id": batch_id}
+            entries, rows = [], []
+            results = [{"status": "failed", "error": "Insufficient balance"} for _ in chunk]
+            for i in accepted:
+                item = chunk[i]
+                customer, journal = posting(user_id, source["account_number"],
+                                            receivers.get(item["beneficiary"]["account_number"]),
+                                            item["beneficiary"]["_id"], item["amount"], transfer_mode,
+                                            timestamp=now, **extra)
+                entries.extend(customer)
+                rows.extend(journal)
+                results[i] = {"status": "completed", "transfer_id": str(customer[0]["transfer_id"])}
+            write_journal(self.db.transactions, rows, session)
+        except Exception:
+            if session is None:
+                total = sum(chunk[i]["amount"] for i in accepted)
+                self.db.accounts.update_one({"_id": source["_id"]}, {"$inc": {"balance": total}})
+                for number, amount in applied:
+                    self.db.accounts.update_one({"account_number": number}, {"$inc": {"balance": -amount}})
+            raise
+        return results, entries
+
+    def _debit_chunk(self, source_filter, chunk, session, attempts=3):
+        """
+        Debit the source for as many items of `chunk` as its balance covers,
+        taken in order. Returns (source, indexes of the items debited).
+        """
+        total = sum(item["amount"] for item in chunk)
+        accepted = list(range(len(chunk)))
+        for _ in range(attempts):
+            source = self.db.accounts.find_one_and_update(
+                {**source_filter, "balance": {"$gte": total}},
+                {"$inc": {"balance": -total}},
+                projection={"_id": 1, "account_number": 1},
+                session=session,
+            )
+            if source is not None:
+                return source, accepted
+            # Short of funds (or raced): re-plan against the balance actually there
+            account = self.db.accounts.find_one(source_filter, {"balance": 1}, session=session)
+            if account is None:
+                raise TransferAborted("Source account not found", 400)
+            balance = account.get("balance", 0)
+            accepted = []
+            for i, item in enumerate(chunk):
+                if item["amount"] <= balance:
+                    accepted.append(i)
+                    balance -= item["amount"]
+            if not accepted:
+                return None, []
+            total = sum(chunk[i]["amount"] for i in accepted)
+        raise TransferAborted("Source balance kept changing, please retry", 409)
+
+    def _execute(self, source_filter, beneficiary, amount, transfer_mode, user_id, session):
+        source = self.db.accounts.find_one_and_update(
+            {**source_filter, "balance": {"$gte": amount}},
+            {"$inc": {"balance": -amount}},
+            projection={"_id": 1, "user_id": 1, "account_number": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if source is None:
+            # Only the failure path pays for the extra read that tells the two cases apart
+            if self.db.accounts.find_one(source_filter, {"_id": 1}, session=session) is None:
+                raise TransferAborted("Source account not found", 400)
+            raise TransferAborted("Insufficient balance", 400)
+
+        receiver = None
+        try:
+            receiver = self.db.accounts.find_one_and_update(
+                {"account_number": beneficiary["account_number"]},
+                {"$inc": {"balance": amount}},
+                projection={"_id": 1, "user_id": 1, "account_number": 1},
+                session=session,
+            )
+
+            entries, journal = posting(user_id, source["account_number"], receiver, beneficiary["_id"],
+                                       amount, transfer_mode)
+            write_journal(self.db.transactions, journal, session)
+        except Exception:
+            if session is None:
+                self._compensate(source, receiver, amount)
+            raise
+        return entries[0]["transfer_id"], entries
+
+    def _compensate(self, source, receiver, amount):
+        """Undo the balance changes of a transfer that failed part-way (no transaction)."""
+        self.db.accounts.update_one({"_id": source["_id"]}, {"$inc": {"balance": amount}})
+        if receiver:
+            self.db.accounts.update_one({"_id": receiver["_id"]}, {"$inc": {"balance": -amount}})
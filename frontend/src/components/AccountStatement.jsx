@@ -68,8 +68,34 @@ const AccountStatement = () => {
     }
   }
 
-  const printPage = () => {
-    window.print()
+  // Statements are generated in the background; poll until the file is ready
+  useEffect(() => {
+    if (phase !== 'result' || !result || ['ready', 'failed'].includes(result.status)) return
+    const timer = setTimeout(async () => {
+      try {
+        const token = localStorage.getItem('token')
+        const res = await axios.get(`/api/statement/${result.statement_id}`, { headers: { Authorization: `Bearer ${token}` } })
+        setResult(res.data)
+      } catch (e) {
+        setMessage(e.response?.data?.error || 'Failed to check statement status')
+      }
+    }, 1500)
+    return () => clearTimeout(timer)
+  }, [phase, result])
+
+  const download = async () => {
+    try {
+      const token = localStorage.getItem('token')
+      const res = await axios.get(result.download_url, { responseType: 'blob', headers: { Authorization: `Bearer ${token}` } })
+      const url = window.URL.createObjectURL(res.data)
+      const link = document.createElement('a')
+      link.href = url
+      link.download = `statement-${result.account?.account_number}-${result.start_date}-${result.end_date}.csv`
+      link.click()
+      window.URL.revokeObjectURL(url)
+    } catch (e) {
+      setMessage('Failed to download statement')
+    }
   }
 
   return (
@@ -123,30 +149,19 @@ const AccountStatement = () => {
                   <div className="font-semibold">Account: {result.account?.account_number}</div>
                   <div className="text-sm text-gray-600">{result.start_date} to {result.end_date}</div>
                 </div>
-                <button onClick={printPage} className="px-4 py-2 rounded bg-blue-600 text-white">Print</button>
-              </div>
-              <div className="overflow-x-auto">
-                <table className="min-w-full text-sm">
-                  <thead>
-                    <tr className="text-left border-b">
-                      <th className="p-2">Date</th>
-                      <th className="p-2">Type</th>
-                      <th className="p-2">Mode</th>
-                      <th className="p-2">Amount</th>
-                    </tr>
-                  </thead>
-                  <tbody>
-                    {result.transactions.map(t => (
-                      <tr key={t._id} className="border-b">
-                        <td className="p-2">{t.timestamp || t.created_at}</td>
-                        <td className="p-2 capitalize">{t.type || '-'}</td>
-                        <td className="p-2">{t.transfer_mode || '-'}</td>
-                        <td className="p-2">₹{t.amount}</td>
-                      </tr>
-                    ))}
-                  </tbody>
-                </table>
+                {result.status === 'ready' && (
+                  <button onClick={download} className="px-4 py-2 rounded bg-blue-600 text-white">Download CSV</button>
+                )}
               </div>
+              {result.status === 'failed' ? (
+                <div className="p-3 rounded bg-red-100 text-red-700">Statement generation failed: {result.error}</div>
+              ) : result.status === 'ready' ? (
+                <div className="text-sm text-gray-700">{result.written} transactions in this statement.</div>
+              ) : (
+                <div className="text-sm text-gray-700">
+                  Preparing statement... {result.total ? `${result.written} of ${result.total} transactions` : ''}
+                </div>
+              )}
             </div>
           )}
         </div>
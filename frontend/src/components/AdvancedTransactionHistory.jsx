@@ -8,6 +8,7 @@ const AdvancedTransactionHistory = () => {
   const [accountNumber, setAccountNumber] = useState('')
   const [accounts, setAccounts] = useState([])
   const [transactions, setTransactions] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
   const [loading, setLoading] = useState(false)
   const [message, setMessage] = useState('')
 
@@ -25,7 +26,7 @@ const AdvancedTransactionHistory = () => {
     fetchAccounts()
   }, [])
 
-  const fetchTx = async (e) => {
+  const fetchTx = async (e, cursor = null) => {
     e?.preventDefault()
     setLoading(true)
     setMessage('')
@@ -36,8 +37,11 @@ const AdvancedTransactionHistory = () => {
       if (startDate) params.start_date = startDate
       if (endDate) params.end_date = endDate
       if (type !== 'all') params.type = type
+      if (cursor) params.cursor = cursor
       const res = await axios.get('/api/transactions/filter', { params, headers: { Authorization: `Bearer ${token}` } })
-      setTransactions(res.data.transactions || [])
+      const page = res.data.transactions || []
+      setTransactions(prev => cursor ? [...prev, ...page] : page)
+      setNextCursor(res.data.next_cursor || null)
     } catch (e) {
       setMessage(e.response?.data?.error || 'Failed to load transactions')
     } finally {
@@ -113,6 +117,11 @@ const AdvancedTransactionHistory = () => {
               </tbody>
             </table>
           </div>
+          {nextCursor && (
+            <div className="mt-4">
+              <button type="button" disabled={loading} onClick={() => fetchTx(null, nextCursor)} className="px-4 py-2 rounded bg-gray-200">{loading? 'Loading...' : 'Load more'}</button>
+            </div>
+          )}
         </div>
       </div>
     </div>